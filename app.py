@@ -1,4 +1,5 @@
 from flask import Flask, render_template, redirect, url_for, request, session, flash
+import csv
 import sqlite3
 from datetime import datetime, timedelta
 import smtplib
@@ -7,9 +8,29 @@ import json
 import os
 import re
 from functools import wraps
+from db_pool import get_pool, check_storage_profile, run_immediate
+from audit import get_audit_writer
+from audit_archive import archive_audit_logs, archive_dir_for, archive_stats, query_audit_logs
+from bulk_import import BOOK_FIELDS, CHUNK_SIZE as IMPORT_CHUNK_SIZE, detect_format, import_books, read_records, text_stream
+from cache import get_cache, cached
+from data_versions import make_etag
+from holds import (QUEUE_POSITION_SQL, allocate_copies, claim_held_copy, expire_holds, member_holds, notify_ready,
+                   place_hold, queue_position, release_hold)
+from events import get_event_hub
+from outbox import enqueue, get_outbox_worker
+from migrations import migrate
+from catalog_search import match_expression, search_sql, render_highlight
+from copies import add_copies, checkout_copy, close_loan, copy_counts
+from circulation import MAX_BATCH_ITEMS, process_batch
+from inbox import fetch_inbox, mark_all_read, reconcile_unread, unread_count
+from popularity import WINDOWS as POPULARITY_WINDOWS, refresh_in_background, top_books
+from jobs import job_history, run_job
+from pagination import DEFAULT_PAGE_SIZE, InvalidCursor, clamp_page_size, decode_cursor, split_page
+from stat_counters import read_dashboard_stats, reconcile
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Change this!
+app.add_template_filter(render_highlight, 'highlight')
 
 # Dummy user for demonstration
 USER = {'username': 'admin', 'password': 'password'}
@@ -42,234 +63,76 @@ def librarian_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def conditional_get(*tables, per_user=False):
+    """ETag a JSON endpoint by its tables' versions; a matching If-None-Match gets 304 without running it"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import make_response
+            # Read before the view runs, so a write racing it can only make the tag older than the body
+            etag = library.get_data_etag(tables, request.endpoint, request.query_string,
+                                         session.get('user_id') if per_user else None)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                payload = response.get_json(silent=True) if response.is_json else None
+                if response.status_code != 200 or (isinstance(payload, dict) and payload.get('success') is False):
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 class LibraryManager:
     def __init__(self, db_name='library.db'):
         self.db_name = db_name
-        self.init_user_tables()
-        self.init_enhanced_tables()
+        self.pool = get_pool(db_name)
+        self.cache = get_cache(db_name)
+        self.audit = get_audit_writer(db_name, self.pool)
+        self.events = get_event_hub(db_name, self.pool.profile)
+        self.outbox = get_outbox_worker(db_name, self.pool)
+        self.audit_archive_dir = archive_dir_for(db_name)
     
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        """Check out a pooled connection; conn.close() hands it back to the pool"""
+        return self.pool.acquire()
     
-    def init_user_tables(self):
-        """Initialize user authentication tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Create Users table for authentication
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Users (
-                UserID INTEGER PRIMARY KEY AUTOINCREMENT,
-                Username TEXT UNIQUE NOT NULL,
-                Password TEXT NOT NULL,
-                UserType TEXT NOT NULL,  -- 'student' or 'librarian'
-                MemberID INTEGER,  -- Link to Members table for students
-                Name TEXT NOT NULL,
-                Email TEXT,
-                CreatedDate DATE DEFAULT CURRENT_DATE,
-                FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
-            )
-        ''')
-        
-        # Create default users if they don't exist
-        cursor.execute('SELECT COUNT(*) FROM Users')
-        if cursor.fetchone()[0] == 0:
-            # Default librarian
-            cursor.execute('''
-                INSERT INTO Users (Username, Password, UserType, Name, Email)
-                VALUES ('librarian', 'admin123', 'librarian', 'Library Administrator', 'admin@library.com')
-            ''')
-            
-            # Default student (will be linked to member after member creation)
-            cursor.execute('''
-                INSERT INTO Users (Username, Password, UserType, Name, Email)
-                VALUES ('student', 'student123', 'student', 'John Doe', 'john.doe@student.edu')
-            ''')
-        
-        conn.commit()
-        conn.close()
+    def connection(self):
+        """Context manager for a pooled connection, released on exit"""
+        return self.pool.connection()
     
-    def init_enhanced_tables(self):
-        """Initialize enhanced tables for new features"""
+    def get_pool_stats(self):
+        """Connection pool metrics (checkouts, waits, opens, ...)"""
+        return self.pool.stats()
+    
+    def get_cache_stats(self):
+        """Query cache metrics (hits, misses, evictions, ...)"""
+        return self.cache.stats()
+    
+    def get_audit_stats(self):
+        """Audit writer metrics (queue depth, batches flushed, ...)"""
+        return self.audit.stats()
+
+    def get_event_stats(self):
+        """Live event metrics for this worker (open streams, events published, ...)"""
+        return self.events.stats()
+
+    def get_outbox_stats(self):
+        """Notification outbox rows by status and this worker's delivery metrics"""
+        return self.outbox.stats()
+
+    def deliver_outbox(self):
+        """Deliver every queued notification that is due now, in the calling thread"""
+        return self.outbox.drain()
+
+    def get_data_etag(self, tables, *extra):
+        """ETag for the current TableVersions of `tables` (plus today's date and `extra`)"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Enhanced Messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Messages (
-                MessageID INTEGER PRIMARY KEY AUTOINCREMENT,
-                FromUserID INTEGER,
-                ToUserID INTEGER,
-                ToUserType TEXT,
-                Subject TEXT,
-                Message TEXT,
-                SentDate DATETIME DEFAULT CURRENT_TIMESTAMP,
-                IsRead BOOLEAN DEFAULT 0,
-                MessageType TEXT DEFAULT 'general',
-                Priority TEXT DEFAULT 'normal',
-                FOREIGN KEY (FromUserID) REFERENCES Users(UserID),
-                FOREIGN KEY (ToUserID) REFERENCES Users(UserID)
-            )
-        ''')
-        
-        # Book Categories/Genres management
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS BookCategories (
-                CategoryID INTEGER PRIMARY KEY AUTOINCREMENT,
-                CategoryName TEXT UNIQUE NOT NULL,
-                Description TEXT,
-                CreatedDate DATE DEFAULT CURRENT_DATE
-            )
-        ''')
-        
-        # Book Reservations
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS BookReservations (
-                ReservationID INTEGER PRIMARY KEY AUTOINCREMENT,
-                BookID TEXT NOT NULL,
-                MemberID INTEGER NOT NULL,
-                ReservationDate DATE DEFAULT CURRENT_DATE,
-                ExpiryDate DATE,
-                Status TEXT DEFAULT 'active',
-                FOREIGN KEY (BookID) REFERENCES Books(ISBN),
-                FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
-            )
-        ''')
-        
-        # Member Tiers/Categories
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS MemberTiers (
-                TierID INTEGER PRIMARY KEY AUTOINCREMENT,
-                TierName TEXT UNIQUE NOT NULL,
-                MaxBooks INTEGER DEFAULT 3,
-                LoanPeriodDays INTEGER DEFAULT 14,
-                FinePerDay DECIMAL(5,2) DEFAULT 0.50,
-                Description TEXT
-            )
-        ''')
-        
-        # Enhanced Members table (add columns if not exist)
-        cursor.execute('PRAGMA table_info(Members)')
-        existing_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'MembershipTier' not in existing_columns:
-            cursor.execute('ALTER TABLE Members ADD COLUMN MembershipTier INTEGER DEFAULT 1')
-        if 'Address' not in existing_columns:
-            cursor.execute('ALTER TABLE Members ADD COLUMN Address TEXT')
-        if 'DateOfBirth' not in existing_columns:
-            cursor.execute('ALTER TABLE Members ADD COLUMN DateOfBirth DATE')
-        if 'Status' not in existing_columns:
-            cursor.execute('ALTER TABLE Members ADD COLUMN Status TEXT DEFAULT "active"')
-        if 'PhotoPath' not in existing_columns:
-            cursor.execute('ALTER TABLE Members ADD COLUMN PhotoPath TEXT')
-        
-        # Fines and Fees
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Fines (
-                FineID INTEGER PRIMARY KEY AUTOINCREMENT,
-                MemberID INTEGER NOT NULL,
-                LoanID INTEGER,
-                FineType TEXT NOT NULL,
-                Amount DECIMAL(10,2) NOT NULL,
-                IssueDate DATE DEFAULT CURRENT_DATE,
-                DueDate DATE,
-                PaidDate DATE,
-                Status TEXT DEFAULT 'unpaid',
-                Description TEXT,
-                FOREIGN KEY (MemberID) REFERENCES Members(MemberID),
-                FOREIGN KEY (LoanID) REFERENCES Loans(LoanID)
-            )
-        ''')
-        
-        # System Settings
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS SystemSettings (
-                SettingID INTEGER PRIMARY KEY AUTOINCREMENT,
-                SettingKey TEXT UNIQUE NOT NULL,
-                SettingValue TEXT,
-                Description TEXT,
-                LastModified DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Audit Logs
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS AuditLogs (
-                LogID INTEGER PRIMARY KEY AUTOINCREMENT,
-                UserID INTEGER,
-                Action TEXT NOT NULL,
-                TableName TEXT,
-                RecordID INTEGER,
-                OldValues TEXT,
-                NewValues TEXT,
-                Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                IPAddress TEXT,
-                FOREIGN KEY (UserID) REFERENCES Users(UserID)
-            )
-        ''')
-        
-        # Announcements
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Announcements (
-                AnnouncementID INTEGER PRIMARY KEY AUTOINCREMENT,
-                Title TEXT NOT NULL,
-                Content TEXT NOT NULL,
-                CreatedBy INTEGER NOT NULL,
-                CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP,
-                ExpiryDate DATE,
-                Priority TEXT DEFAULT 'normal',
-                Status TEXT DEFAULT 'active',
-                TargetAudience TEXT DEFAULT 'all',
-                FOREIGN KEY (CreatedBy) REFERENCES Users(UserID)
-            )
-        ''')
-        
-        # Book Reviews/Ratings
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS BookReviews (
-                ReviewID INTEGER PRIMARY KEY AUTOINCREMENT,
-                BookID TEXT NOT NULL,
-                MemberID INTEGER NOT NULL,
-                Rating INTEGER CHECK(Rating >= 1 AND Rating <= 5),
-                Review TEXT,
-                ReviewDate DATE DEFAULT CURRENT_DATE,
-                FOREIGN KEY (BookID) REFERENCES Books(ISBN),
-                FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
-            )
-        ''')
-        
-        # Insert default data
-        cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
-                      ('Standard', 3, 14, 0.50, 'Standard membership with basic privileges'))
-        cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
-                      ('Premium', 5, 21, 0.25, 'Premium membership with extended privileges'))
-        cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
-                      ('Student', 4, 30, 0.10, 'Student membership with educational benefits'))
-        
-        # Insert default book categories
-        categories = ['Fiction', 'Non-Fiction', 'Science', 'Technology', 'History', 'Biography', 
-                     'Romance', 'Mystery', 'Fantasy', 'Educational', 'Reference', 'Children']
-        for category in categories:
-            cursor.execute('INSERT OR IGNORE INTO BookCategories (CategoryName) VALUES (?)', (category,))
-        
-        # Insert default system settings
-        settings = [
-            ('default_loan_period', '14', 'Default loan period in days'),
-            ('max_renewals', '2', 'Maximum number of renewals allowed'),
-            ('fine_per_day', '0.50', 'Fine amount per day for overdue books'),
-            ('max_books_per_member', '3', 'Maximum books a member can borrow'),
-            ('library_name', 'Lancaster University Library', 'Name of the library'),
-            ('library_email', 'info@citylibrary.com', 'Library contact email'),
-            ('library_phone', '(555) 123-4567', 'Library contact phone'),
-            ('reservation_hold_days', '3', 'Days to hold a reserved book')
-        ]
-        
-        for key, value, desc in settings:
-            cursor.execute('INSERT OR IGNORE INTO SystemSettings (SettingKey, SettingValue, Description) VALUES (?, ?, ?)',
-                          (key, value, desc))
-        
-        conn.commit()
+        etag = make_etag(conn, tables, *extra)
         conn.close()
+        return etag
     
     def authenticate_user(self, username, password):
         """Authenticate user login"""
@@ -336,30 +199,7 @@ class LibraryManager:
     
     def send_message_to_librarian(self, student_id, message):
         """Send message from student to librarian"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Create Messages table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Messages (
-                MessageID INTEGER PRIMARY KEY AUTOINCREMENT,
-                FromUserID INTEGER,
-                ToUserType TEXT,  -- 'librarian' or 'student'
-                Subject TEXT,
-                Message TEXT,
-                SentDate DATETIME DEFAULT CURRENT_TIMESTAMP,
-                IsRead BOOLEAN DEFAULT 0,
-                FOREIGN KEY (FromUserID) REFERENCES Users(UserID)
-            )
-        ''')
-        
-        cursor.execute('''
-            INSERT INTO Messages (FromUserID, ToUserType, Subject, Message)
-            VALUES (?, 'librarian', 'Student Inquiry', ?)
-        ''', (student_id, message))
-        
-        conn.commit()
-        conn.close()
+        self.broadcast_message(student_id, 'librarian', 'Student Inquiry', message)
         return True
     
     def get_all_books(self):
@@ -431,19 +271,115 @@ class LibraryManager:
         conn.close()
         return overdue_loans
     
-    def search_books(self, search_term):
+    # ===== KEYSET PAGINATION =====
+    def get_books_page(self, cursor=None, limit=DEFAULT_PAGE_SIZE, available_only=False):
+        """One page of the catalog ordered by (Title, ISBN); returns (books, next_cursor)"""
+        limit = clamp_page_size(limit)
+        after = decode_cursor('books', cursor, 2)
+        query = 'SELECT ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus FROM Books WHERE 1=1'
+        params = []
+        if available_only:
+            query += " AND AvailabilityStatus = 'Available'"
+        if after:
+            query += ' AND (Title, ISBN) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY Title, ISBN LIMIT ?'
+        params.append(limit + 1)
+
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus
-            FROM Books
-            WHERE Title LIKE ? OR Author LIKE ? OR Genre LIKE ?
-        ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
+        cursor.execute(query, params)
+        books = cursor.fetchall()
+        conn.close()
+        return split_page('books', books, limit, lambda b: (b[1], b[0]))
+    
+    def count_books(self, available_only=False):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if available_only:
+            cursor.execute("SELECT COUNT(*) FROM Books WHERE AvailabilityStatus = 'Available'")
+        else:
+            cursor.execute('SELECT COUNT(*) FROM Books')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def get_active_loans_page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """One page of open loans ordered by (DueDate, LoanID); returns (loans, next_cursor)"""
+        limit = clamp_page_size(limit)
+        after = decode_cursor('loans', cursor, 2)
+        query = '''
+            SELECT l.LoanID, b.Title, m.Name, l.LoanDate, l.DueDate
+            FROM Loans l
+            JOIN Books b ON l.BookID = b.ISBN
+            JOIN Members m ON l.MemberID = m.MemberID
+            WHERE l.ReturnDate IS NULL
+        '''
+        params = []
+        if after:
+            query += ' AND (l.DueDate, l.LoanID) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY l.DueDate, l.LoanID LIMIT ?'
+        params.append(limit + 1)
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        loans = cursor.fetchall()
+        conn.close()
+        return split_page('loans', loans, limit, lambda l: (l[4], l[0]))
+    
+    def count_active_loans(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM Loans WHERE ReturnDate IS NULL')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def get_members_page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """One page of active members ordered by (Name, MemberID); returns (members, next_cursor)"""
+        limit = clamp_page_size(limit)
+        after = decode_cursor('members', cursor, 2)
+        query = 'SELECT * FROM Members WHERE (Status = "active" OR Status IS NULL)'
+        params = []
+        if after:
+            query += ' AND (Name, MemberID) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY Name, MemberID LIMIT ?'
+        params.append(limit + 1)
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        members = cursor.fetchall()
+        conn.close()
+        return split_page('members', members, limit, lambda m: (m[1], m[0]))
+    
+    def count_members(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM Members WHERE Status = "active" OR Status IS NULL')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def search_books(self, search_term, available_only=False, limit=None):
+        """Full-text catalog search (prefix match, diacritic-insensitive, best match first)"""
+        expression = match_expression(search_term)
+        if not expression:
+            return []
+        conditions = ["b.AvailabilityStatus = 'Available'"] if available_only else []
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(search_sql(conditions, limit), (expression,))
         books = cursor.fetchall()
         conn.close()
         return books
     
-    def add_book(self, isbn, title, author, genre, publication_year):
+    def add_book(self, isbn, title, author, genre, publication_year, audit=None, copies=1, location=None):
+        """Add a book with `copies` copies shelved at `location`; audit is an optional dict of log_audit
+        arguments, written in the same transaction"""
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
@@ -451,6 +387,13 @@ class LibraryManager:
                 INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus)
                 VALUES (?, ?, ?, ?, ?, 'Available')
             ''', (isbn, title, author, genre, publication_year))
+            # The first copy comes from a trigger
+            if location:
+                cursor.execute('UPDATE Copies SET Location = ? WHERE ISBN = ?', (location, isbn))
+            if copies > 1:
+                add_copies(cursor, isbn, copies - 1, location)
+            if audit:
+                self.log_audit(conn=conn, **audit)
             conn.commit()
             conn.close()
             return True, "Book added successfully!"
@@ -471,53 +414,71 @@ class LibraryManager:
         conn.close()
         return member_id
     
-    def loan_book(self, isbn, member_id, loan_days=14):
+    def loan_book(self, isbn, member_id, loan_days=14, audit=None, notification=None):
+        """Loan a book in one BEGIN IMMEDIATE transaction; audit and notification are optional dicts of
+        log_audit and outbox.enqueue arguments, written in the same transaction"""
+        loan_date = datetime.now().strftime('%Y-%m-%d')
+        due_date = (datetime.now() + timedelta(days=loan_days)).strftime('%Y-%m-%d')
         conn = self.get_connection()
-        cursor = conn.cursor()
         
-        # Check if book is available
-        cursor.execute('SELECT AvailabilityStatus FROM Books WHERE ISBN = ?', (isbn,))
-        result = cursor.fetchone()
+        def checkout(cursor):
+            # Claim the copy set aside for the member's hold, else an available one off the shelf, with a
+            # conditional UPDATE; no copy claimed means another desk got there first
+            barcode = claim_held_copy(cursor, isbn, member_id) or checkout_copy(cursor, isbn)
+            if barcode is None:
+                return None
+            cursor.execute('''
+                INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, CopyBarcode)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (isbn, member_id, loan_date, due_date, barcode))
+            if audit:
+                self.log_audit(conn=conn, **audit)
+            if notification:
+                enqueue(cursor, **notification)
+            return barcode
         
-        if not result or result[0] != 'Available':
+        try:
+            barcode = run_immediate(conn, checkout)
+        finally:
             conn.close()
+        if barcode is None:
             return False, "Book is not available!"
+        if notification:
+            self.outbox.wake()
+        return True, f"Book loaned successfully. Due date: {due_date}"
+    
+    def circulate_batch(self, items, user_id, loan_days=14):
+        """Check out and return a desk scanning session's items in one BEGIN IMMEDIATE transaction;
+        returns one result dict per item (see circulation.py)"""
+        hold_days = self.get_hold_days()
+        conn = self.get_connection()
         
-        # Create loan record
-        loan_date = datetime.now().strftime('%Y-%m-%d')
-        due_date = (datetime.now() + timedelta(days=loan_days)).strftime('%Y-%m-%d')
-        
-        cursor.execute('''
-            INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate)
-            VALUES (?, ?, ?, ?)
-        ''', (isbn, member_id, loan_date, due_date))
-        
-        # Update book availability
-        cursor.execute('''
-            UPDATE Books SET AvailabilityStatus = 'Loaned' WHERE ISBN = ?
-        ''', (isbn,))
+        def work(cursor):
+            results, audit_rows = process_batch(cursor, items, user_id, hold_days, loan_days)
+            self.audit.write_rows(audit_rows, conn)
+            return results
         
-        conn.commit()
-        conn.close()
-        return True, f"Book loaned successfully. Due date: {due_date}"
+        try:
+            results = run_immediate(conn, work)
+        finally:
+            conn.close()
+        self.outbox.wake()
+        return results
     
     # ===== ENHANCED ANALYTICS & REPORTS =====
-    def get_popular_books(self, limit=10):
-        """Get most popular books based on loan count"""
+    def get_popular_books(self, limit=10, window='all'):
+        """Get most popular books by loan count ('all', '7d' or '30d'), from the maintained ranking
+
+        Not cached: the ranking is kept current by triggers and read with one index walk, so
+        loans show up at once. A stale windowed snapshot is served as it is and rebuilt off
+        the request thread.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT b.ISBN, b.Title, b.Author, COUNT(l.LoanID) as loan_count,
-                   AVG(COALESCE(br.Rating, 0)) as avg_rating
-            FROM Books b
-            LEFT JOIN Loans l ON b.ISBN = l.BookID
-            LEFT JOIN BookReviews br ON b.ISBN = br.BookID
-            GROUP BY b.ISBN, b.Title, b.Author
-            ORDER BY loan_count DESC, avg_rating DESC
-            LIMIT ?
-        ''', (limit,))
-        books = cursor.fetchall()
-        conn.close()
+        try:
+            books = top_books(conn, limit, window,
+                              on_stale=lambda w: refresh_in_background(self.get_connection, w, self.db_name))
+        finally:
+            conn.close()
         return books
     
     def get_member_activity_stats(self):
@@ -553,6 +514,7 @@ class LibraryManager:
     
     
     # ===== ENHANCED BOOK MANAGEMENT =====
+    @cached('categories', ttl=3600)
     def get_book_categories(self):
         """Get all book categories"""
         conn = self.get_connection()
@@ -571,73 +533,123 @@ class LibraryManager:
                           (name, description))
             conn.commit()
             conn.close()
+            self.cache.invalidate('categories')
             return True, "Category added successfully!"
         except sqlite3.IntegrityError:
             conn.close()
             return False, f"Category '{name}' already exists!"
     
-    def get_low_stock_books(self, threshold=2):
-        """Get books with low availability (assuming multiple copies)"""
+    def get_low_stock_books(self, threshold=1):
+        """Books with at most `threshold` copies on the shelf, fewest first:
+        (ISBN, Title, Author, AvailabilityStatus, Genre, AvailableCount, TotalCount)"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        # This would require a Copies table in a real system
+        # Range scan of idx_copy_counts_available
         cursor.execute('''
-            SELECT ISBN, Title, Author, AvailabilityStatus
-            FROM Books
-            WHERE AvailabilityStatus = 'Available'
-            GROUP BY Title, Author
-            HAVING COUNT(*) <= ?
+            SELECT b.ISBN, b.Title, b.Author, b.AvailabilityStatus, b.Genre, c.AvailableCount, c.TotalCount
+            FROM CopyCounts c
+            JOIN Books b ON b.ISBN = c.ISBN
+            WHERE c.AvailableCount <= ?
+            ORDER BY c.AvailableCount, c.ISBN
         ''', (threshold,))
         books = cursor.fetchall()
         conn.close()
         return books
     
-    def bulk_import_books(self, books_data):
-        """Import multiple books at once"""
+    def get_copy_counts(self, isbn):
+        """(available, total) copies of a book"""
+        conn = self.get_connection()
+        counts = copy_counts(conn, isbn)
+        conn.close()
+        return counts
+    
+    def add_book_copies(self, isbn, count, location=None):
+        """Add copies of a book already in the catalog, filling waiting holds first; returns their barcodes"""
+        hold_days = self.get_hold_days()
         conn = self.get_connection()
-        cursor = conn.cursor()
-        success_count = 0
-        errors = []
         
-        for book in books_data:
-            try:
-                cursor.execute('''
-                    INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus)
-                    VALUES (?, ?, ?, ?, ?, 'Available')
-                ''', tuple(book))
-                success_count += 1
-            except sqlite3.IntegrityError as e:
-                errors.append(f"ISBN {book[0]}: {str(e)}")
+        def work(cursor):
+            barcodes = add_copies(cursor, isbn, count, location)
+            notify_ready(cursor, allocate_copies(cursor, isbn, hold_days))
+            return barcodes
         
-        conn.commit()
+        try:
+            return run_immediate(conn, work)
+        finally:
+            conn.close()
+    
+    def bulk_import_books(self, books_data):
+        """Import (isbn, title, author, genre, year) tuples; ISBNs already in the catalog are skipped"""
+        records = ((row, dict(zip(BOOK_FIELDS, book))) for row, book in enumerate(books_data, 1))
+        conn = self.get_connection()
+        try:
+            report = import_books(conn, records, on_conflict='skip')
+        finally:
+            conn.close()
+        return report.inserted, [f"Row {row}: {message}" for row, message in report.errors]
+    
+    def import_catalog(self, stream, fmt='csv', has_headers=True, skip_duplicates=False, filename=None,
+                       imported_by=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+        """Stream a CSV/JSON-lines catalog dump into Books and record it in ImportRuns (see bulk_import.py)"""
+        conn = self.get_connection()
+        try:
+            report = import_books(conn, read_records(stream, fmt, has_headers),
+                                  'skip' if skip_duplicates else 'update', chunk_size, progress)
+            conn.execute('''
+                INSERT INTO ImportRuns (ImportType, FileName, ImportedBy, Processed, Inserted, Updated,
+                                        Skipped, Failed, DurationMs, Errors)
+                VALUES ('books', ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (filename, imported_by, report.processed, report.inserted, report.updated,
+                  report.skipped, report.failed, round(report.elapsed * 1000, 3),
+                  json.dumps(report.errors[:100]) if report.errors else None))
+            conn.commit()
+        finally:
+            conn.close()
+        return report
+    
+    def get_import_history(self, limit=10):
+        """Most recent bulk imports, newest first"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ImportID, ImportType, FileName, StartedAt, Processed, Inserted, Updated, Skipped,
+                   Failed, DurationMs
+            FROM ImportRuns
+            ORDER BY ImportID DESC
+            LIMIT ?
+        ''', (limit,))
+        imports = cursor.fetchall()
         conn.close()
-        return success_count, errors
+        return imports
     
     # ===== BOOK RESERVATION SYSTEM =====
-    def create_reservation(self, isbn, member_id, days_to_hold=3):
-        """Create book reservation"""
+    def get_hold_days(self):
+        """Days a copy set aside for a hold waits for pickup (the reservation_hold_days setting)"""
+        return int(self.get_system_setting('reservation_hold_days') or 3)
+    
+    def create_reservation(self, isbn, member_id, days_to_hold=None):
+        """Join the hold queue for a book; a copy on the shelf is set aside for the hold straight away"""
+        hold_days = days_to_hold or self.get_hold_days()
         conn = self.get_connection()
-        cursor = conn.cursor()
         
-        # Check if book is already reserved
-        cursor.execute('''
-            SELECT COUNT(*) FROM BookReservations 
-            WHERE BookID = ? AND Status = 'active'
-        ''', (isbn,))
+        def work(cursor):
+            # In one BEGIN IMMEDIATE, so two requests can't both pass the duplicate-hold check
+            reservation_id, allocations = place_hold(cursor, isbn, member_id, hold_days)
+            if reservation_id is None:
+                return None
+            notify_ready(cursor, allocations)
+            return queue_position(cursor, reservation_id)
         
-        if cursor.fetchone()[0] > 0:
+        try:
+            placed = run_immediate(conn, work)
+        finally:
             conn.close()
-            return False, "Book is already reserved!"
-        
-        expiry_date = (datetime.now() + timedelta(days=days_to_hold)).strftime('%Y-%m-%d')
-        cursor.execute('''
-            INSERT INTO BookReservations (BookID, MemberID, ExpiryDate)
-            VALUES (?, ?, ?)
-        ''', (isbn, member_id, expiry_date))
-        
-        conn.commit()
-        conn.close()
-        return True, f"Book reserved until {expiry_date}"
+        if placed is None:
+            return False, "Member already has a hold on this book!"
+        position, expiry_date = placed
+        if position == 0:
+            return True, f"Book reserved and ready for pickup until {expiry_date}"
+        return True, f"Book reserved. Position {position} in the queue"
     
     def get_member_reservations(self, member_id):
         """Get reservations for a member"""
@@ -655,18 +667,46 @@ class LibraryManager:
         return reservations
     
     def cancel_reservation(self, reservation_id):
-        """Cancel a book reservation"""
+        """Cancel a book reservation; a copy set aside for it goes to the next hold in line"""
+        hold_days = self.get_hold_days()
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE BookReservations SET Status = 'cancelled'
-            WHERE ReservationID = ?
-        ''', (reservation_id,))
-        conn.commit()
+        
+        def work(cursor):
+            allocations = release_hold(cursor, reservation_id, 'cancelled', hold_days)
+            if allocations:
+                notify_ready(cursor, allocations)
+            return allocations is not None
+        
+        try:
+            return run_immediate(conn, work)
+        finally:
+            conn.close()
+    
+    def get_member_holds(self, member_id):
+        """Active holds with queue positions (see holds.member_holds)"""
+        conn = self.get_connection()
+        holds = member_holds(conn, member_id)
         conn.close()
-        return True
+        return holds
+    
+    def expire_stale_holds(self):
+        """Expire holds not picked up by their ExpiryDate and pass their copies on"""
+        hold_days = self.get_hold_days()
+        conn = self.get_connection()
+        
+        def work(cursor):
+            expired, allocations = expire_holds(cursor, hold_days)
+            notify_ready(cursor, allocations)
+            return expired, allocations
+        
+        try:
+            expired, allocations = run_immediate(conn, work)
+        finally:
+            conn.close()
+        return {'expired': expired, 'reallocated': len(allocations)}
     
     # ===== ENHANCED MEMBER MANAGEMENT =====
+    @cached('member_tiers', ttl=3600)
     def get_member_tiers(self):
         """Get all membership tiers"""
         conn = self.get_connection()
@@ -712,10 +752,11 @@ class LibraryManager:
                       (tier_id, member_id))
         conn.commit()
         conn.close()
+        # Changes which tier a member is on, not the tiers themselves: nothing cached to invalidate
         return True
     
-    def remove_member(self, member_id):
-        """Remove/deactivate a member from the library"""
+    def remove_member(self, member_id, audit=None):
+        """Remove/deactivate a member from the library; audit is written in the same transaction"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -765,47 +806,84 @@ class LibraryManager:
             WHERE MemberID = ? AND UserType = 'student'
         ''', (member_id,))
         
+        if audit:
+            self.log_audit(conn=conn, **audit)
         conn.commit()
         conn.close()
+        self.cache.invalidate('users')
         
         return True, f"Member '{member_name}' has been successfully removed from the library system."
     
     # ===== FINES AND FEES =====
     def calculate_overdue_fines(self):
-        """Calculate fines for overdue books"""
+        """Calculate fines for overdue books; returns the number of new fines"""
+        return self.accrue_overdue_fines()['created']
+    
+    def accrue_overdue_fines(self, today=None):
+        """Set-based fine accrual: create fines for newly overdue loans, grow existing ones
+
+        Amounts are whole days overdue x the member tier's FinePerDay, accrued up
+        to today or the return date. AccruedThrough records how far each fine has
+        been accrued, so running this more than once a day changes nothing.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        # Get overdue loans that don't have fines yet
-        cursor.execute('''
-            SELECT l.LoanID, l.MemberID, l.DueDate, mt.FinePerDay,
-                   (julianday('now') - julianday(l.DueDate)) as DaysOverdue
-            FROM Loans l
-            JOIN Members m ON l.MemberID = m.MemberID
-            JOIN MemberTiers mt ON m.MembershipTier = mt.TierID
-            WHERE l.ReturnDate IS NULL AND l.DueDate < date('now')
-            AND NOT EXISTS (
-                SELECT 1 FROM Fines f 
-                WHERE f.LoanID = l.LoanID AND f.FineType = 'overdue'
-            )
-        ''')
-        
-        overdue_loans = cursor.fetchall()
-        fines_created = 0
-        
-        for loan_id, member_id, due_date, fine_per_day, days_overdue in overdue_loans:
-            if days_overdue > 0:
-                fine_amount = days_overdue * fine_per_day
-                cursor.execute('''
-                    INSERT INTO Fines (MemberID, LoanID, FineType, Amount, Description)
-                    VALUES (?, ?, 'overdue', ?, ?)
-                ''', (member_id, loan_id, fine_amount, 
-                     f'Overdue fine for {days_overdue} days at ${fine_per_day}/day'))
-                fines_created += 1
-        
-        conn.commit()
-        conn.close()
-        return fines_created
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            if today is None:
+                today = cursor.execute("SELECT date('now')").fetchone()[0]
+            
+            # New fines for overdue loans that don't have one yet
+            cursor.execute('''
+                INSERT INTO Fines (MemberID, LoanID, FineType, Amount, IssueDate, Description, AccruedThrough)
+                SELECT MemberID, LoanID, 'overdue', ROUND(Days * Rate, 2), :today,
+                       printf('Overdue fine for %d days at $%.2f/day', Days, Rate), :today
+                FROM (
+                    SELECT l.LoanID, l.MemberID, mt.FinePerDay AS Rate,
+                           CAST(julianday(:today) - julianday(l.DueDate) AS INTEGER) AS Days
+                    FROM Loans l
+                    JOIN Members m ON l.MemberID = m.MemberID
+                    JOIN MemberTiers mt ON m.MembershipTier = mt.TierID
+                    WHERE l.ReturnDate IS NULL AND l.DueDate < :today
+                    AND NOT EXISTS (
+                        SELECT 1 FROM Fines f
+                        WHERE f.LoanID = l.LoanID AND f.FineType = 'overdue'
+                    )
+                )
+                WHERE Days > 0
+            ''', {'today': today})
+            created = cursor.rowcount
+            
+            # Grow unpaid overdue fines up to today, or up to the return date for returned loans
+            cursor.execute('''
+                UPDATE Fines
+                SET Amount = ROUND(a.Days * a.Rate, 2),
+                    Description = printf('Overdue fine for %d days at $%.2f/day', a.Days, a.Rate),
+                    AccruedThrough = a.AccrueTo
+                FROM (
+                    SELECT LoanID, Rate, AccrueTo,
+                           CAST(julianday(AccrueTo) - julianday(DueDate) AS INTEGER) AS Days
+                    FROM (
+                        SELECT l.LoanID, l.DueDate, mt.FinePerDay AS Rate,
+                               MIN(COALESCE(date(l.ReturnDate), :today), :today) AS AccrueTo
+                        FROM Loans l
+                        JOIN Members m ON l.MemberID = m.MemberID
+                        JOIN MemberTiers mt ON m.MembershipTier = mt.TierID
+                    )
+                ) a
+                WHERE Fines.LoanID = a.LoanID
+                AND Fines.FineType = 'overdue' AND Fines.Status = 'unpaid'
+                AND COALESCE(Fines.AccruedThrough, Fines.IssueDate) < a.AccrueTo
+                AND a.Days > 0
+            ''', {'today': today})
+            updated = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return {'created': created, 'updated': updated}
     
     def get_member_fines(self, member_id):
         """Get all fines for a member"""
@@ -823,6 +901,43 @@ class LibraryManager:
         conn.close()
         return fines
     
+    def get_unpaid_fines_page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """One page of unpaid fines, newest first by (IssueDate, FineID); returns (fines, next_cursor)"""
+        limit = clamp_page_size(limit)
+        after = decode_cursor('fines', cursor, 2)
+        # Explicit columns: the rows are read by position and Fines has grown columns since
+        query = '''
+            SELECT f.FineID, f.MemberID, f.LoanID, f.FineType, f.Amount, f.IssueDate, f.DueDate,
+                   f.PaidDate, f.Status, f.Description, m.Name as MemberName, b.Title as BookTitle
+            FROM Fines f
+            JOIN Members m ON f.MemberID = m.MemberID
+            LEFT JOIN Loans l ON f.LoanID = l.LoanID
+            LEFT JOIN Books b ON l.BookID = b.ISBN
+            WHERE f.Status = 'unpaid'
+        '''
+        params = []
+        if after:
+            query += ' AND (f.IssueDate, f.FineID) < (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY f.IssueDate DESC, f.FineID DESC LIMIT ?'
+        params.append(limit + 1)
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        fines = cursor.fetchall()
+        conn.close()
+        return split_page('fines', fines, limit, lambda f: (f[5], f[0]))
+    
+    def get_unpaid_fines_summary(self):
+        """Count and total amount of unpaid fines"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(Amount), 0) FROM Fines WHERE Status = 'unpaid'")
+        summary = cursor.fetchone()
+        conn.close()
+        return summary
+    
     def pay_fine(self, fine_id):
         """Mark fine as paid"""
         conn = self.get_connection()
@@ -848,41 +963,94 @@ class LibraryManager:
         conn.close()
         return True
     
-    def get_user_messages(self, user_id, message_type=None):
-        """Get messages for a user"""
+    @cached('user_roster', ttl=300, tags=lambda user_type: ('users',))
+    def get_user_ids_by_type(self, user_type):
+        """UserIDs of every user of a type (e.g. the librarian roster); invalidated by the 'users' tag"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        if message_type:
-            cursor.execute('''
-                SELECT m.*, u.Name as SenderName
-                FROM Messages m
-                LEFT JOIN Users u ON m.FromUserID = u.UserID
-                WHERE (m.ToUserID = ? OR m.ToUserType = (SELECT UserType FROM Users WHERE UserID = ?))
-                AND m.MessageType = ?
-                ORDER BY m.SentDate DESC
-            ''', (user_id, user_id, message_type))
-        else:
-            cursor.execute('''
-                SELECT m.*, u.Name as SenderName
-                FROM Messages m
-                LEFT JOIN Users u ON m.FromUserID = u.UserID
-                WHERE (m.ToUserID = ? OR m.ToUserType = (SELECT UserType FROM Users WHERE UserID = ?))
-                ORDER BY m.SentDate DESC
-            ''', (user_id, user_id))
-        
-        messages = cursor.fetchall()
+        cursor.execute('SELECT UserID FROM Users WHERE UserType = ? ORDER BY UserID', (user_type,))
+        user_ids = tuple(row[0] for row in cursor.fetchall())
+        conn.close()
+        return user_ids
+    
+    def broadcast_message(self, from_user_id, to_user_type, subject, message, message_type='general',
+                          priority='normal'):
+        """Send one message to every user of a type; returns the number of recipients
+        
+        The message is stored once, addressed by ToUserType, with a
+        MessageRecipients row per recipient for their delivery/read state.
+        """
+        recipients = self.get_user_ids_by_type(to_user_type)
+        if not recipients:
+            return 0
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Messages (FromUserID, ToUserType, Subject, Message, MessageType, Priority)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (from_user_id, to_user_type, subject, message, message_type, priority))
+        cursor.execute('''
+            INSERT INTO MessageRecipients (MessageID, UserID, MessageType, SentDate)
+            SELECT m.MessageID, r.value, m.MessageType, m.SentDate
+            FROM Messages m, json_each(?) r
+            WHERE m.MessageID = ?
+        ''', (json.dumps(recipients), cursor.lastrowid))
+        conn.commit()
+        conn.close()
+        return len(recipients)
+    
+    def get_inbox(self, user_id, message_type=None, unread_only=False, limit=None):
+        """A user's messages (Messages.* + SenderName), newest first; filters and limit run in SQL"""
+        conn = self.get_connection()
+        messages = fetch_inbox(conn, user_id, message_type, unread_only, limit)
         conn.close()
         return messages
+        
+    def get_user_messages(self, user_id, message_type=None, limit=None):
+        """Get messages for a user"""
+        return self.get_inbox(user_id, message_type, limit=limit)
+        
+    def get_unread_count(self, user_id):
+        """Unread messages in a user's inbox, from the trigger-maintained counter"""
+        conn = self.get_connection()
+        count = unread_count(conn, user_id)
+        conn.close()
+        return count
     
-    def mark_message_read(self, message_id):
-        """Mark message as read"""
+    def mark_message_read(self, message_id, user_id=None):
+        """Mark message as read (and, for a broadcast, record that user_id has read it)"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('UPDATE Messages SET IsRead = 1 WHERE MessageID = ?', (message_id,))
+        if user_id:
+            # Triggers set Messages.IsRead and the unread counter to match
+            cursor.execute('''
+                UPDATE MessageRecipients SET ReadAt = CURRENT_TIMESTAMP
+                WHERE UserID = ? AND MessageID = ? AND ReadAt IS NULL
+            ''', (user_id, message_id))
+        else:
+            cursor.execute('UPDATE Messages SET IsRead = 1 WHERE MessageID = ?', (message_id,))
         conn.commit()
         conn.close()
         return True
+
+    def mark_all_messages_read(self, user_id, message_type=None):
+        """Mark every unread message in a user's inbox read in one statement; returns how many"""
+        conn = self.get_connection()
+        count = mark_all_read(conn, user_id, message_type)
+        conn.commit()
+        conn.close()
+        return count
+
+    def reconcile_unread_counters(self, repair=True):
+        """Recount the per-user unread counters; returns {user_id: (stored, actual)} drift"""
+        conn = self.get_connection()
+        try:
+            drift = reconcile_unread(conn, repair=repair)
+        finally:
+            conn.close()
+        for user_id, (stored, actual) in drift.items():
+            print(f'⚠️  Unread counter for user {user_id} drifted: stored {stored}, actual {actual}')
+        return drift
     
     # ===== ANNOUNCEMENTS =====
     def create_announcement(self, title, content, created_by, expiry_date=None, priority='normal', target_audience='all'):
@@ -895,8 +1063,10 @@ class LibraryManager:
         ''', (title, content, created_by, expiry_date, priority, target_audience))
         conn.commit()
         conn.close()
+        self.cache.invalidate('announcements')
         return True
     
+    @cached('announcements', ttl=60)
     def get_active_announcements(self, target_audience='all'):
         """Get active announcements"""
         conn = self.get_connection()
@@ -915,6 +1085,7 @@ class LibraryManager:
         return announcements
     
     # ===== SYSTEM ADMINISTRATION =====
+    @cached('settings', ttl=300, tags=lambda key: (f'setting:{key}',))
     def get_system_setting(self, key):
         """Get system setting value"""
         conn = self.get_connection()
@@ -935,6 +1106,7 @@ class LibraryManager:
         ''', (value, key))
         conn.commit()
         conn.close()
+        self.cache.invalidate(f'setting:{key}')
         return True
     
     def get_all_settings(self):
@@ -946,48 +1118,58 @@ class LibraryManager:
         conn.close()
         return settings
     
-    def log_audit(self, user_id, action, table_name=None, record_id=None, old_values=None, new_values=None):
-        """Log user action for audit"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO AuditLogs (UserID, Action, TableName, RecordID, OldValues, NewValues)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, action, table_name, record_id, 
-             json.dumps(old_values) if old_values else None,
-             json.dumps(new_values) if new_values else None))
-        conn.commit()
-        conn.close()
+    def log_audit(self, user_id, action, table_name=None, record_id=None, old_values=None, new_values=None,
+                  conn=None):
+        """Log user action for audit
+        
+        Pass the connection of an open transaction to commit the entry with the
+        change it describes; otherwise it is group-committed by the audit writer.
+        """
+        self.audit.write(user_id, action, table_name, record_id, old_values, new_values, conn=conn)
         return True
     
-    def get_audit_logs(self, limit=100, user_id=None, action=None):
-        """Get audit logs"""
+    def flush_audit_log(self):
+        """Write any buffered audit entries now"""
+        return self.audit.flush()
+    
+    def get_audit_logs(self, limit=100, user_id=None, action=None, start=None, end=None, action_match='contains'):
+        """Get audit logs, newest first, from the live table and the monthly archive
+        
+        action is matched anywhere in the action text, or only at its start
+        with action_match='prefix' (indexed); start/end bound the Timestamp
+        (end exclusive).
+        """
+        # Include entries this process has logged but not yet flushed
+        self.audit.flush()
+        conn = self.get_connection()
+        try:
+            logs = query_audit_logs(conn, self.audit_archive_dir, start, end, user_id, action, limit, action_match)
+        finally:
+            conn.close()
+        return logs
+    
+    def get_latest_audit_id(self):
+        """LogID of the newest audit entry (0 if there are none)"""
+        self.audit.flush()
         conn = self.get_connection()
         cursor = conn.cursor()
-        
-        query = '''
-            SELECT al.*, u.Name as UserName
-            FROM AuditLogs al
-            LEFT JOIN Users u ON al.UserID = u.UserID
-            WHERE 1=1
-        '''
-        params = []
-        
-        if user_id:
-            query += ' AND al.UserID = ?'
-            params.append(user_id)
-        
-        if action:
-            query += ' AND al.Action LIKE ?'
-            params.append(f'%{action}%')
-        
-        query += ' ORDER BY al.Timestamp DESC LIMIT ?'
-        params.append(limit)
-        
-        cursor.execute(query, params)
-        logs = cursor.fetchall()
+        cursor.execute('SELECT COALESCE(MAX(LogID), 0) FROM AuditLogs')
+        latest = cursor.fetchone()[0]
         conn.close()
-        return logs
+        return latest
+    
+    def archive_audit_logs(self, retention_days=None):
+        """Move audit entries older than the retention window into the monthly archive files"""
+        if retention_days is None:
+            retention_days = int(self.get_system_setting('audit_retention_days') or 90)
+        self.audit.flush()
+        conn = self.get_connection()
+        try:
+            result = archive_audit_logs(conn, self.audit_archive_dir, retention_days)
+            result.update(archive_stats(conn, self.audit_archive_dir))
+        finally:
+            conn.close()
+        return result
     
     # ===== ADVANCED SEARCH & FILTERING =====
     def advanced_search_books(self, title=None, author=None, genre=None, year_from=None, year_to=None, availability=None):
@@ -995,29 +1177,36 @@ class LibraryManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        query = 'SELECT * FROM Books WHERE 1=1'
+        # Text fields go through the full-text index, one column filter each
+        expressions = [match_expression(value, column)
+                       for column, value in (('Title', title), ('Author', author), ('Genre', genre))
+                       if value]
+        expressions = [e for e in expressions if e]
+        
+        conditions = []
         params = []
         
-        if title:
-            query += ' AND Title LIKE ?'
-            params.append(f'%{title}%')
-        if author:
-            query += ' AND Author LIKE ?'
-            params.append(f'%{author}%')
-        if genre:
-            query += ' AND Genre LIKE ?'
-            params.append(f'%{genre}%')
         if year_from:
-            query += ' AND PublicationYear >= ?'
+            conditions.append('b.PublicationYear >= ?')
             params.append(year_from)
         if year_to:
-            query += ' AND PublicationYear <= ?'
+            conditions.append('b.PublicationYear <= ?')
             params.append(year_to)
         if availability:
-            query += ' AND AvailabilityStatus = ?'
+            conditions.append('b.AvailabilityStatus = ?')
             params.append(availability)
         
-        query += ' ORDER BY Title'
+        if expressions:
+            query = search_sql(conditions)
+            params.insert(0, ' AND '.join(expressions))
+        else:
+            query = '''
+                SELECT b.ISBN, b.Title, b.Author, b.Genre, b.PublicationYear, b.AvailabilityStatus
+                FROM Books b WHERE 1=1
+            '''
+            for condition in conditions:
+                query += f' AND {condition}'
+            query += ' ORDER BY b.Title'
         
         cursor.execute(query, params)
         books = cursor.fetchall()
@@ -1025,54 +1214,35 @@ class LibraryManager:
         return books
     
     def get_dashboard_stats(self):
-        """Get comprehensive dashboard statistics"""
+        """Get comprehensive dashboard statistics (one read of the trigger-maintained counters)"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Basic stats
-        cursor.execute('SELECT COUNT(*) FROM Books')
-        total_books = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Books WHERE AvailabilityStatus = "Available"')
-        available_books = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Members WHERE Status = "active" OR Status IS NULL')
-        total_members = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Loans WHERE ReturnDate IS NULL')
-        active_loans = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Loans WHERE DueDate < date("now") AND ReturnDate IS NULL')
-        overdue_loans = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM BookReservations WHERE Status = "active"')
-        active_reservations = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Fines WHERE Status = "unpaid"')
-        unpaid_fines = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Messages WHERE IsRead = 0')
-        unread_messages = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM Members WHERE RegistrationDate >= date("now", "-30 days")')
-        new_members_month = cursor.fetchone()[0]
-        
+        stats = read_dashboard_stats(conn)
         conn.close()
-        
-        return {
-            'total_books': total_books,
-            'available_books': available_books,
-            'total_members': total_members,
-            'active_loans': active_loans,
-            'overdue_loans': overdue_loans,
-            'active_reservations': active_reservations,
-            'unpaid_fines': unpaid_fines,
-            'unread_messages': unread_messages,
-            'new_members_month': new_members_month
-        }
-
-# Initialize library manager
-library = LibraryManager()
+        return stats
+    
+    def reconcile_dashboard_counters(self, repair=True):
+        """Recount the dashboard counters from their tables; returns {name: (stored, actual)} drift"""
+        conn = self.get_connection()
+        try:
+            drift = reconcile(conn, repair=repair)
+        finally:
+            conn.close()
+        for name, (stored, actual) in drift.items():
+            print(f'⚠️  Dashboard counter {name} drifted: stored {stored}, actual {actual}')
+        return drift
+
+# Apply pending schema migrations once at startup, then share one manager
+DATABASE = os.environ.get('LIBRARY_DB', 'library.db')
+migrate(DATABASE)
+library = LibraryManager(DATABASE)
+
+# Startup check: report the SQLite storage settings in effect for this worker
+storage_ok, storage_report = check_storage_profile(library.pool)
+print('SQLite storage profile: ' + ', '.join(f"{key}={value['effective']}" for key, value in storage_report.items()))
+if not storage_ok:
+    print('⚠️  Some SQLite storage settings differ from the requested profile: '
+          + ', '.join(f"{key} requested {value['requested']}" for key, value in storage_report.items()
+                      if value['requested'] != value['effective']))
 
 # Authentication routes
 
@@ -1149,6 +1319,7 @@ def register():
             
             conn.commit()
             conn.close()
+            library.cache.invalidate('users')
             
             flash(f'Account created successfully! You can now login as a {user_type}.', 'success')
             return render_template('login_new.html', show_register=False)
@@ -1194,21 +1365,18 @@ def student_dashboard():
         loans = []
         recent_returns = []
     
-    books = library.get_all_books()
-    available_books = [b for b in books if b[5] == 'Available']
+    available_books, _ = library.get_books_page(limit=20, available_only=True)
     
     # Get messages from librarians (replies to student's messages)
-    student_messages = library.get_user_messages(session['user_id'])
-    # Filter for messages from librarians (message_type='librarian_reply')
-    librarian_messages = [msg for msg in student_messages if msg[8] == 'librarian_reply']
+    librarian_messages = library.get_inbox(session['user_id'], 'librarian_reply', limit=5)
     
     # Get book return notifications for this student
     return_notifications = library.get_student_return_notifications(member_id) if member_id else []
     
     return render_template('student_dashboard.html', 
                          loans=loans, 
-                         available_books=available_books[:20],  # Show top 20 available books for display
-                         total_available_books=len(available_books),  # Total count for stats
+                         available_books=available_books,  # First 20 available books for display
+                         total_available_books=library.count_books(available_only=True),  # Total count for stats
                          student_messages=librarian_messages,
                          recent_returns=recent_returns,
                          return_notifications=return_notifications)
@@ -1218,17 +1386,20 @@ def student_dashboard():
 @student_required
 def student_catalog():
     search_term = request.args.get('search', '')
+    next_cursor = None
     if search_term:
-        book_list = library.search_books(search_term)
+        available_books = library.search_books(search_term, available_only=True)
+        total_books = len(available_books)
     else:
-        book_list = library.get_all_books()
-    
-    available_books = [b for b in book_list if b[5] == 'Available']
-    return render_template('student_catalog.html', books=available_books, search_term=search_term)
+        available_books, next_cursor = library.get_books_page(available_only=True)
+        total_books = library.count_books(available_only=True)
+    return render_template('student_catalog.html', books=available_books, search_term=search_term,
+                         total_books=total_books, next_cursor=next_cursor)
 
 # Student Account Management API endpoints
 @app.route('/student/borrowing_history', methods=['GET'])
 @student_required
+@conditional_get('Loans', 'Books', per_user=True)
 def get_student_borrowing_history():
     """Get complete borrowing history for student"""
     try:
@@ -1437,32 +1608,17 @@ def get_student_holds_info():
         if not member_id:
             return {'success': False, 'message': 'Member ID not found'}
         
-        conn = library.get_connection()
-        cursor = conn.cursor()
-        
-        # Get active reservations
-        cursor.execute('''
-            SELECT r.ReservationID, b.Title, b.Author, r.ReservationDate, 
-                   r.ExpiryDate, r.Status
-            FROM BookReservations r
-            JOIN Books b ON r.BookID = b.ISBN
-            WHERE r.MemberID = ? AND r.Status = 'active'
-            ORDER BY r.ReservationDate DESC
-        ''', (member_id,))
-        
-        reservations = cursor.fetchall()
-        conn.close()
-        
         holds_info = []
-        for reservation in reservations:
+        for hold in library.get_member_holds(member_id):
             holds_info.append({
-                'reservation_id': reservation[0],
-                'title': reservation[1],
-                'author': reservation[2],
-                'reservation_date': reservation[3],
-                'expiry_date': reservation[4],
-                'status': reservation[5],
-                'position': 1  # Simplified - in real system would calculate queue position
+                'reservation_id': hold[0],
+                'isbn': hold[1],
+                'title': hold[2],
+                'author': hold[3],
+                'reservation_date': hold[4],
+                'expiry_date': hold[5],
+                'status': 'Available' if hold[6] else 'Waiting',
+                'position': hold[7]
             })
         
         return {'success': True, 'holds': holds_info}
@@ -1471,6 +1627,17 @@ def get_student_holds_info():
         print(f"Error getting holds info: {e}")
         return {'success': False, 'message': 'Failed to load holds information'}
 
+@app.route('/student/cancel_hold', methods=['POST'])
+@student_required
+def student_cancel_hold():
+    from flask import jsonify
+    member_id = session.get('member_id')
+    isbn = (request.get_json(silent=True) or {}).get('isbn')
+    hold = next((hold for hold in library.get_member_holds(member_id) if hold[1] == isbn), None) if member_id else None
+    if hold is None or not library.cancel_reservation(hold[0]):
+        return jsonify({'success': False, 'message': 'No active hold on this book'}), 404
+    return jsonify({'success': True})
+
 # Enhanced Librarian Dashboard
 from datetime import datetime
 
@@ -1481,7 +1648,7 @@ def librarian_dashboard():
     stats = library.get_dashboard_stats()
     popular_books = library.get_popular_books(20)
     recent_announcements = library.get_active_announcements('librarian')
-    unread_messages = library.get_user_messages(session['user_id'])[:5]
+    unread_messages = library.get_inbox(session['user_id'], limit=5)
 
     # Get current login time
     last_login = datetime.now().strftime('%B %d %Y, %I:%M %p')
@@ -1504,29 +1671,101 @@ def librarian_dashboard():
 @login_required
 def books():
     search_term = request.args.get('search', '')
+    next_cursor = None
     if search_term:
         book_list = library.search_books(search_term)
+        total_books = len(book_list)
     else:
-        book_list = library.get_all_books()
-    return render_template('books.html', books=book_list, search_term=search_term)
+        book_list, next_cursor = library.get_books_page()
+        total_books = library.count_books()
+    return render_template('books.html', books=book_list, search_term=search_term,
+                         total_books=total_books, next_cursor=next_cursor)
 
 @app.route('/members')
 @login_required
 def members():
-    member_list = library.get_all_members()
-    return render_template('members.html', members=member_list)
+    member_list, next_cursor = library.get_members_page()
+    return render_template('members.html', members=member_list,
+                         total_members=library.count_members(), next_cursor=next_cursor)
 
 @app.route('/loans')
 @login_required
 def loans():
-    active_loans = library.get_active_loans()
+    active_loans, next_cursor = library.get_active_loans_page()
     overdue_loans = library.get_overdue_loans()
     current_date = datetime.now().strftime('%Y-%m-%d')
     return render_template('loans.html', 
                          active_loans=active_loans, 
+                         total_active_loans=library.count_active_loans(),
+                         next_cursor=next_cursor,
                          overdue_loans=overdue_loans,
                          current_date=current_date)
 
+# Paginated JSON listings: {items, next_cursor}, plus rendered rows when
+# ?render=<partial> names one of the endpoint's partials ("Load more" buttons)
+def paged_response(items, next_cursor, partials, **context):
+    from flask import jsonify
+    payload = {'success': True, 'items': items, 'next_cursor': next_cursor}
+    partial = request.args.get('render')
+    if partial in partials:
+        payload['html'] = render_template(f'partials/{partial}.html', **context)
+    return jsonify(payload)
+
+def invalid_cursor_response(error):
+    from flask import jsonify
+    return jsonify({'success': False, 'error': str(error)}), 400
+
+@app.route('/api/books')
+@login_required
+def api_books():
+    available_only = request.args.get('available') == '1' or session.get('user_type') == 'student'
+    try:
+        books, next_cursor = library.get_books_page(request.args.get('cursor'),
+                                                    request.args.get('limit', DEFAULT_PAGE_SIZE),
+                                                    available_only)
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    items = [{'isbn': b[0], 'title': b[1], 'author': b[2], 'genre': b[3],
+              'publication_year': b[4], 'status': b[5]} for b in books]
+    return paged_response(items, next_cursor, ('book_rows', 'catalog_cards'), books=books)
+
+@app.route('/api/loans')
+@librarian_required
+def api_loans():
+    try:
+        loans, next_cursor = library.get_active_loans_page(request.args.get('cursor'),
+                                                           request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    items = [{'loan_id': l[0], 'title': l[1], 'member_name': l[2],
+              'loan_date': l[3], 'due_date': l[4]} for l in loans]
+    return paged_response(items, next_cursor, ('loan_rows',), active_loans=loans,
+                          current_date=datetime.now().strftime('%Y-%m-%d'))
+
+@app.route('/api/members')
+@librarian_required
+def api_members():
+    try:
+        members, next_cursor = library.get_members_page(request.args.get('cursor'),
+                                                        request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    items = [{'member_id': m[0], 'name': m[1], 'contact_info': m[2],
+              'registration_date': m[3]} for m in members]
+    return paged_response(items, next_cursor, ('member_rows',), members=members)
+
+@app.route('/api/fines')
+@librarian_required
+def api_fines():
+    try:
+        fines, next_cursor = library.get_unpaid_fines_page(request.args.get('cursor'),
+                                                           request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    items = [{'fine_id': f[0], 'member_name': f[10], 'book_title': f[11], 'fine_type': f[3],
+              'amount': f[4], 'issue_date': f[5], 'description': f[9]} for f in fines]
+    return paged_response(items, next_cursor, ('fine_rows',), fines=fines)
+
 @app.route('/admin')
 @librarian_required
 def admin():
@@ -1541,8 +1780,10 @@ def add_book():
         author = request.form['author']
         genre = request.form['genre']
         year = int(request.form['year'])
+        copies = max(1, request.form.get('copies', 1, type=int))
+        location = request.form.get('location', '').strip() or None
         
-        success, message = library.add_book(isbn, title, author, genre, year)
+        success, message = library.add_book(isbn, title, author, genre, year, copies=copies, location=location)
         if success:
             flash(message, 'success')
         else:
@@ -1571,17 +1812,16 @@ def add_member():
 def loan_book():
     if request.method == 'POST':
         isbn = request.form['isbn']
-        member_id = request.form['member_id']
+        member_id = int(request.form['member_id'])
         
-        library = LibraryManager()
-        if library.loan_book(isbn, member_id):
-            flash('Book loaned successfully!', 'success')
+        success, message = library.loan_book(isbn, member_id)
+        if success:
+            flash(message, 'success')
         else:
             flash('Failed to loan book. Please check availability.', 'error')
         
         return redirect(url_for('loans'))
     
-    library = LibraryManager()
     books = library.get_available_books()
     members = library.get_all_members()
     
@@ -1663,11 +1903,15 @@ def send_reminders():
 @app.route('/analytics')
 @librarian_required
 def analytics():
-    popular_books = library.get_popular_books(20)
+    window = request.args.get('window', 'all')
+    if window not in POPULARITY_WINDOWS:
+        window = 'all'
+    popular_books = library.get_popular_books(20, window)
     member_stats = library.get_member_activity_stats()
     loan_trends = library.get_loan_trends(30)
     return render_template('analytics.html', 
                          popular_books=popular_books,
+                         popularity_window=window,
                          member_stats=member_stats,
                          loan_trends=loan_trends)
 
@@ -1724,11 +1968,24 @@ def advanced_search():
 @app.route('/bulk_import', methods=['GET', 'POST'])
 @librarian_required
 def bulk_import():
+    report = None
     if request.method == 'POST':
-        # Handle CSV upload and bulk import
-        flash('Bulk import feature coming soon!', 'info')
-        return redirect(url_for('books'))
-    return render_template('bulk_import.html')
+        upload = request.files.get('csv_file')
+        if request.form.get('import_type', 'books') != 'books':
+            flash('Only book imports are supported at the moment.', 'warning')
+        elif not upload or not upload.filename:
+            flash('Please choose a file to import.', 'error')
+        else:
+            # The upload is parsed as it is read, never held in memory as a whole
+            try:
+                report = library.import_catalog(text_stream(upload.stream), detect_format(upload.filename),
+                                                has_headers=bool(request.form.get('has_headers')),
+                                                skip_duplicates=bool(request.form.get('skip_duplicates')),
+                                                filename=upload.filename, imported_by=session.get('user_id'))
+                flash(f'Import finished: {report.summary()}', 'warning' if report.failed else 'success')
+            except (UnicodeDecodeError, csv.Error) as e:
+                flash(f'Import stopped, the file could not be read: {e}', 'error')
+    return render_template('bulk_import.html', report=report, history=library.get_import_history())
 
 @app.route('/inventory_alerts')
 @librarian_required
@@ -1740,11 +1997,12 @@ def inventory_alerts():
 @app.route('/reservations')
 @librarian_required
 def reservations():
-    # Get all active reservations
+    # Get all active reservations, with whether a copy is waiting for pickup and the queue position otherwise
     conn = library.get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT r.ReservationID, b.Title, b.Author, m.Name, r.ReservationDate, r.ExpiryDate
+    cursor.execute(f'''
+        SELECT r.ReservationID, b.Title, b.Author, m.Name, r.ReservationDate, r.ExpiryDate,
+               r.CopyBarcode IS NOT NULL, {QUEUE_POSITION_SQL}
         FROM BookReservations r
         JOIN Books b ON r.BookID = b.ISBN
         JOIN Members m ON r.MemberID = m.MemberID
@@ -1753,7 +2011,8 @@ def reservations():
     ''')
     reservations_list = cursor.fetchall()
     conn.close()
-    return render_template('reservations.html', reservations=reservations_list)
+    return render_template('reservations.html', reservations=reservations_list,
+                           today=datetime.now().strftime('%Y-%m-%d'))
 
 @app.route('/create_reservation', methods=['POST'])
 @librarian_required
@@ -1767,6 +2026,14 @@ def create_reservation():
         flash(message, 'error')
     return redirect(url_for('reservations'))
 
+@app.route('/cancel_reservation/<int:reservation_id>', methods=['POST'])
+@librarian_required
+def cancel_reservation(reservation_id):
+    from flask import jsonify
+    if library.cancel_reservation(reservation_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': 'Reservation is not active'}), 404
+
 # Enhanced Member Management
 @app.route('/member_tiers')
 @librarian_required
@@ -1816,11 +2083,12 @@ def enhanced_add_member():
 def remove_member(member_id):
     """Remove/deactivate a member from the library"""
     try:
-        success, message = library.remove_member(member_id)
+        # The audit entry is committed together with the deactivation
+        success, message = library.remove_member(member_id, audit={
+            'user_id': session['user_id'], 'action': f'Removed member ID: {member_id}',
+            'table_name': 'Members', 'record_id': member_id})
         
         if success:
-            # Log the action for audit trail
-            library.log_audit(session['user_id'], f'Removed member ID: {member_id}', 'Members', member_id)
             flash(message, 'success')
         else:
             flash(message, 'error')
@@ -1834,27 +2102,13 @@ def remove_member(member_id):
 @app.route('/fines')
 @librarian_required
 def fines():
-    # Calculate new overdue fines first
-    new_fines = library.calculate_overdue_fines()
-    if new_fines > 0:
-        flash(f'Calculated {new_fines} new overdue fines', 'info')
+    # Fines are accrued by the scheduled accrue_fines job (jobs.py), not on page views
+    # First page of unpaid fines, newest first
+    unpaid_fines, next_cursor = library.get_unpaid_fines_page()
+    fines_count, fines_total = library.get_unpaid_fines_summary()
     
-    # Get all unpaid fines
-    conn = library.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT f.*, m.Name as MemberName, b.Title as BookTitle
-        FROM Fines f
-        JOIN Members m ON f.MemberID = m.MemberID
-        LEFT JOIN Loans l ON f.LoanID = l.LoanID
-        LEFT JOIN Books b ON l.BookID = b.ISBN
-        WHERE f.Status = 'unpaid'
-        ORDER BY f.IssueDate DESC
-    ''')
-    unpaid_fines = cursor.fetchall()
-    conn.close()
-    
-    return render_template('fines.html', fines=unpaid_fines)
+    return render_template('fines.html', fines=unpaid_fines, next_cursor=next_cursor,
+                         fines_count=fines_count, fines_total=fines_total)
 
 @app.route('/pay_fine/<int:fine_id>')
 @librarian_required
@@ -1896,9 +2150,16 @@ def send_message():
 @app.route('/mark_message_read/<int:message_id>')
 @login_required
 def mark_message_read(message_id):
-    library.mark_message_read(message_id)
+    library.mark_message_read(message_id, session['user_id'])
     return redirect(url_for('messages'))
 
+@app.route('/mark_all_messages_read', methods=['POST'])
+@login_required
+def mark_all_messages_read():
+    from flask import jsonify
+    marked = library.mark_all_messages_read(session['user_id'], request.form.get('message_type') or None)
+    return jsonify({'success': True, 'marked': marked, 'unread': library.get_unread_count(session['user_id'])})
+
 # Student message to librarian route
 @app.route('/student/send_message', methods=['POST'])
 @student_required
@@ -1912,27 +2173,19 @@ def student_send_message():
         if not message:
             return jsonify({'success': False, 'error': 'Message cannot be empty'}), 400
         
-        # Get all librarians to send the message to
-        conn = library.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT UserID FROM Users WHERE UserType = "librarian"')
-        librarians = cursor.fetchall()
-        conn.close()
+        # One message for the whole librarian roster
+        recipients = library.broadcast_message(
+            from_user_id=session['user_id'],
+            to_user_type='librarian',
+            subject=subject,
+            message=message,
+            message_type='student_inquiry',
+            priority='normal'
+        )
         
-        if not librarians:
+        if not recipients:
             return jsonify({'success': False, 'error': 'No librarians available to receive messages'}), 500
         
-        # Send message to all librarians
-        for librarian in librarians:
-            library.send_message(
-                from_user_id=session['user_id'],
-                to_user_id=librarian[0],
-                subject=subject,
-                message=message,
-                message_type='student_inquiry',
-                priority='normal'
-            )
-        
         return jsonify({'success': True, 'message': 'Message sent to librarian successfully!'})
         
     except Exception as e:
@@ -1969,27 +2222,19 @@ def student_request_book():
         
         message_content += f"Please process this book request at your earliest convenience."
         
-        # Get all librarians to send the message to
-        conn = library.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT UserID FROM Users WHERE UserType = "librarian"')
-        librarians = cursor.fetchall()
-        conn.close()
+        # One message for the whole librarian roster
+        recipients = library.broadcast_message(
+            from_user_id=session['user_id'],
+            to_user_type='librarian',
+            subject=f'Book Request from {student_name}: {title}',
+            message=message_content,
+            message_type='book_request',
+            priority='normal'
+        )
         
-        if not librarians:
+        if not recipients:
             return jsonify({'success': False, 'error': 'No librarians available to receive requests'}), 500
         
-        # Send request to all librarians
-        for librarian in librarians:
-            library.send_message(
-                from_user_id=session['user_id'],
-                to_user_id=librarian[0],
-                subject=f'Book Request from {student_name}: {title}',
-                message=message_content,
-                message_type='book_request',
-                priority='normal'
-            )
-        
         return jsonify({'success': True, 'message': f'Book request for "{title}" sent to librarian!'})
         
     except Exception as e:
@@ -2020,7 +2265,7 @@ def librarian_reply_message():
         )
         
         # Mark original message as read
-        library.mark_message_read(original_message_id)
+        library.mark_message_read(original_message_id, session['user_id'])
         
         return jsonify({
             'success': True, 
@@ -2063,36 +2308,29 @@ def add_book_from_request():
         except ValueError:
             publication_year = 2024
         
-        # Add book to system
-        success, message = library.add_book(isbn, title, author, genre, publication_year)
+        # Add book to system, logging the action in the same transaction
+        success, message = library.add_book(isbn, title, author, genre, publication_year, audit={
+            'user_id': session['user_id'], 'action': f'Added book from request: {title} (ISBN: {isbn})',
+            'table_name': 'Books', 'record_id': isbn})
         
         if not success:
             return jsonify({'success': False, 'error': message}), 400
         
-        # Log the action
-        library.log_audit(session['user_id'], f'Added book from request: {title} (ISBN: {isbn})', 'Books', isbn)
-        
         response_data = {'success': True, 'message': f'Book "{title}" added successfully!'}
         
         # If requested, loan the book immediately
         if loan_immediately and member_id:
             try:
-                loan_success, loan_message = library.loan_book(isbn, int(member_id))
+                # Tell the student in the loan's transaction; the outbox worker delivers it
+                notification = None
+                if student_user_id:
+                    notification = {'kind': 'request_approved', 'payload': {'title': title, 'author': author},
+                                    'to_user_id': int(student_user_id), 'from_user_id': session['user_id']}
+                loan_success, loan_message = library.loan_book(isbn, int(member_id), audit={
+                    'user_id': session['user_id'], 'action': f'Loaned book from request: {isbn} to member {member_id}'},
+                    notification=notification)
                 if loan_success:
                     response_data['message'] += f' Book loaned successfully to member.'  
-                    # Log loan action
-                    library.log_audit(session['user_id'], f'Loaned book from request: {isbn} to member {member_id}')
-                    
-                    # Send success message to student
-                    if student_user_id:
-                        library.send_message(
-                            from_user_id=session['user_id'],
-                            to_user_id=int(student_user_id),
-                            subject=f'Book Request Approved: {title}',
-                            message=f'Good news! Your requested book "{title}" by {author} has been added to our library and is now loaned to you. Please visit the library to collect it.',
-                            message_type='librarian_reply',
-                            priority='high'
-                        )
                 else:
                     response_data['warning'] = f'Book added but loan failed: {loan_message}'
             except Exception as e:
@@ -2100,7 +2338,7 @@ def add_book_from_request():
         
         # Mark original request message as read
         if message_id:
-            library.mark_message_read(int(message_id))
+            library.mark_message_read(int(message_id), session['user_id'])
         
         return jsonify(response_data)
         
@@ -2175,6 +2413,7 @@ def extract_book_info_from_message():
 
 @app.route('/api/recent_returns')
 @librarian_required
+@conditional_get('Loans', 'Books', 'Members')
 def api_recent_returns():
     """Get recent book returns for librarian dashboard"""
     from flask import jsonify
@@ -2211,6 +2450,7 @@ def api_recent_returns():
 
 @app.route('/api/student_dashboard_refresh')
 @student_required
+@conditional_get('Loans', 'Books', 'Messages', 'MessageRecipients', 'Users', per_user=True)
 def api_student_dashboard_refresh():
     """Refresh student dashboard data via API"""
     from flask import jsonify
@@ -2225,12 +2465,10 @@ def api_student_dashboard_refresh():
         return_notifications = library.get_student_return_notifications(member_id)
         
         # Get updated book count
-        books = library.get_all_books()
-        available_books_count = len([b for b in books if b[5] == 'Available'])
+        available_books_count = library.count_books(available_only=True)
         
         # Get updated messages
-        student_messages = library.get_user_messages(session['user_id'])
-        librarian_messages = [msg for msg in student_messages if msg[8] == 'librarian_reply']
+        librarian_messages = library.get_inbox(session['user_id'], 'librarian_reply', limit=5)
         
         # Format data for JSON response
         loans_data = []
@@ -2341,13 +2579,25 @@ def update_setting():
 @app.route('/audit_logs')
 @librarian_required
 def audit_logs():
-    limit = int(request.args.get('limit', 100))
+    limit = min(int(request.args.get('limit', 100)), 500)
     user_id = request.args.get('user_id')
     action = request.args.get('action')
+    action_match = 'prefix' if request.args.get('action_match') == 'prefix' else 'contains'
+    
+    # Date range, both ends inclusive on the page (end is exclusive in the query)
+    start = end = None
+    try:
+        if request.args.get('start'):
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d').strftime('%Y-%m-%d')
+        if request.args.get('end'):
+            end = (datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format.', 'warning')
+        start = end = None
     
     logs = library.get_audit_logs(limit, 
                                 int(user_id) if user_id else None, 
-                                action)
+                                action, start, end, action_match)
     
     # Get all users for filtering
     conn = library.get_connection()
@@ -2356,7 +2606,33 @@ def audit_logs():
     users = cursor.fetchall()
     conn.close()
     
-    return render_template('audit_logs.html', logs=logs, users=users)
+    return render_template('audit_logs.html', logs=logs, users=users, latest_id=library.get_latest_audit_id())
+
+@app.route('/api/audit_logs/latest')
+@librarian_required
+def api_latest_audit_log():
+    from flask import jsonify
+    return jsonify({'latest_id': library.get_latest_audit_id()})
+
+@app.route('/api/archive_audit_logs', methods=['POST'])
+@librarian_required
+def api_archive_audit_logs():
+    from flask import jsonify
+    try:
+        run = run_job(library, 'archive_audit_logs', force=True)
+        if run['error']:
+            raise RuntimeError(run['error'])
+        result = run['result']
+        return jsonify({
+            'success': True,
+            'archived': result['archived'],
+            'hot_rows': result['hot_rows'],
+            'duration_ms': run['duration_ms'],
+            'message': f"Archived {result['archived']} audit log entries older than {result['cutoff']}; "
+                       f"{result['hot_rows']} remain in the live table."
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/user_management')
 @librarian_required
@@ -2385,6 +2661,7 @@ def create_user():
             VALUES (?, ?, ?, ?, ?)
         ''', (username, password, user_type, name, email))
         conn.commit()
+        library.cache.invalidate('users')
         flash(f'User "{name}" created successfully!', 'success')
     except sqlite3.IntegrityError:
         flash(f'Username "{username}" already exists!', 'error')
@@ -2399,11 +2676,10 @@ def create_user():
 def quick_loan():
     isbn = request.form['isbn']
     member_id = int(request.form['member_id'])
-    success, message = library.loan_book(isbn, member_id)
+    success, message = library.loan_book(isbn, member_id, audit={
+        'user_id': session['user_id'], 'action': f'Quick loan: {isbn} to member {member_id}'})
     
     if success:
-        # Log the action
-        library.log_audit(session['user_id'], f'Quick loan: {isbn} to member {member_id}')
         flash(message, 'success')
     else:
         flash(message, 'error')
@@ -2413,64 +2689,80 @@ def quick_loan():
 @app.route('/return_book/<int:loan_id>')
 @librarian_required
 def return_book(loan_id):
+    hold_days = library.get_hold_days()
     conn = library.get_connection()
-    cursor = conn.cursor()
     
-    # Get loan details including member and book information
-    cursor.execute('''
-        SELECT l.BookID, l.MemberID, b.Title, b.Author, m.Name, u.UserID
-        FROM Loans l
-        JOIN Books b ON l.BookID = b.ISBN
-        JOIN Members m ON l.MemberID = m.MemberID
-        LEFT JOIN Users u ON m.MemberID = u.MemberID
-        WHERE l.LoanID = ?
-    ''', (loan_id,))
-    loan_result = cursor.fetchone()
-    
-    if loan_result:
+    def checkin(cursor):
+        # Get loan details including member and book information
+        cursor.execute('''
+            SELECT l.BookID, l.MemberID, b.Title, b.Author, m.Name, u.UserID
+            FROM Loans l
+            JOIN Books b ON l.BookID = b.ISBN
+            JOIN Members m ON l.MemberID = m.MemberID
+            LEFT JOIN Users u ON m.MemberID = u.MemberID
+            WHERE l.LoanID = ?
+        ''', (loan_id,))
+        loan_result = cursor.fetchone()
+        
+        # Close the loan only if it is still open, putting its copy back on the shelf (the book's counts and
+        # status follow); a second desk returning the same loan finds nothing left to do
+        if not loan_result or not close_loan(cursor, loan_id):
+            return loan_result, False
         book_id, member_id, book_title, book_author, member_name, student_user_id = loan_result
         
-        # Update loan record
-        cursor.execute('UPDATE Loans SET ReturnDate = date("now") WHERE LoanID = ?', (loan_id,))
-        # Update book availability
-        cursor.execute('UPDATE Books SET AvailabilityStatus = "Available" WHERE ISBN = ?', (book_id,))
+        # The next hold in the book's queue gets the copy
+        notify_ready(cursor, allocate_copies(cursor, book_id, hold_days), session['user_id'])
         
-        # Send confirmation message to student if they have a user account
+        # Queue a confirmation for the student if they have a user account; the outbox worker delivers it
         if student_user_id:
-            return_message = f"""Book Return Confirmation
-            
-Dear {member_name},
-            
-Your book has been successfully returned to the library:
-            
-📚 Book Details:
-            - Title: "{book_title}"
-            - Author: {book_author}
-            - ISBN: {book_id}
-            - Return Date: {datetime.now().strftime('%Y-%m-%d')}
-            
-Thank you for returning your book on time!
-            
-Best regards,
-            Library Staff"""
-            
-            cursor.execute('''
-                INSERT INTO Messages (FromUserID, ToUserID, Subject, Message, MessageType, Priority)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (session['user_id'], student_user_id, f'Book Return Confirmation: {book_title}', 
-                 return_message, 'return_confirmation', 'normal'))
+            enqueue(cursor, 'return_confirmation', {
+                'member_name': member_name, 'title': book_title, 'author': book_author, 'isbn': book_id,
+                'return_date': datetime.now().strftime('%Y-%m-%d')
+            }, to_user_id=student_user_id, from_user_id=session['user_id'])
         
-        conn.commit()
-        
-        # Log the action
-        library.log_audit(session['user_id'], f'Book returned: {book_title} by {member_name} (LoanID {loan_id})')
-        flash(f'Book "{book_title}" returned successfully by {member_name}!', 'success')
+        # Log the action as part of the return's transaction
+        library.log_audit(session['user_id'], f'Book returned: {book_title} by {member_name} (LoanID {loan_id})',
+                          conn=conn)
+        return loan_result, True
+    
+    # The whole check-in is one BEGIN IMMEDIATE transaction, retried if the database stays locked
+    try:
+        loan_result, returned = run_immediate(conn, checkin)
+    finally:
+        conn.close()
+    
+    if returned:
+        library.outbox.wake()
+        flash(f'Book "{loan_result[2]}" returned successfully by {loan_result[4]}!', 'success')
+    elif loan_result:
+        flash('This loan has already been returned!', 'error')
     else:
         flash('Loan not found!', 'error')
-    
-    conn.close()
     return redirect(request.referrer or url_for('loans'))
 
+@app.route('/api/circulation/batch', methods=['POST'])
+@librarian_required
+def api_circulation_batch():
+    """Check out and/or return a list of items in one transaction:
+    {"items": [{"action": "checkout" | "return", "code": barcode or ISBN, "member_id": 7}, ...]}"""
+    from flask import jsonify
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'success': False, 'error': 'items must be a non-empty list of objects'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BATCH_ITEMS} items per batch'}), 400
+    
+    results = library.circulate_batch(items, session['user_id'])
+    done = [result for result in results if result['success']]
+    return jsonify({
+        'success': True,
+        'loaned': sum(result['action'] == 'checkout' for result in done),
+        'returned': sum(result['action'] == 'return' for result in done),
+        'failed': len(results) - len(done),
+        'results': results
+    })
+
 # Student message API routes
 @app.route('/student/mark_message_read', methods=['POST'])
 @student_required
@@ -2483,7 +2775,7 @@ def student_mark_message_read():
         if not message_id:
             return jsonify({'success': False, 'error': 'Message ID required'}), 400
         
-        library.mark_message_read(message_id)
+        library.mark_message_read(message_id, session['user_id'])
         return jsonify({'success': True, 'message': 'Message marked as read'})
         
     except Exception as e:
@@ -2495,9 +2787,7 @@ def student_get_all_messages():
     from flask import jsonify
     try:
         # Get messages from librarians (replies to student's messages)
-        student_messages = library.get_user_messages(session['user_id'])
-        # Filter for messages from librarians (message_type='librarian_reply')
-        librarian_messages = [msg for msg in student_messages if msg[8] == 'librarian_reply']
+        librarian_messages = library.get_inbox(session['user_id'], 'librarian_reply')
         
         # Format messages for JSON response
         messages_data = []
@@ -2524,13 +2814,74 @@ def student_get_all_messages():
 # Dashboard APIs for AJAX calls
 @app.route('/api/dashboard_stats')
 @librarian_required
+@conditional_get('Books', 'Members', 'Loans', 'BookReservations', 'Fines', 'Messages')
 def api_dashboard_stats():
     from flask import jsonify
     stats = library.get_dashboard_stats()
     return jsonify(stats)
 
+@app.route('/api/pool_stats')
+@librarian_required
+def api_pool_stats():
+    from flask import jsonify
+    return jsonify(library.get_pool_stats())
+
+@app.route('/api/job_runs')
+@librarian_required
+def api_job_runs():
+    from flask import jsonify
+    runs = job_history(library, int(request.args.get('limit', 20)), request.args.get('job'))
+    return jsonify([{
+        'run_id': run[0],
+        'job': run[1],
+        'run_key': run[2],
+        'status': run[3],
+        'started_at': run[4],
+        'duration_ms': run[5],
+        'result': json.loads(run[6]) if run[6] else None,
+        'error': run[7]
+    } for run in runs])
+
+@app.route('/api/audit_stats')
+@librarian_required
+def api_audit_stats():
+    from flask import jsonify
+    return jsonify(library.get_audit_stats())
+
+@app.route('/api/outbox_stats')
+@librarian_required
+def api_outbox_stats():
+    from flask import jsonify
+    return jsonify(library.get_outbox_stats())
+
+@app.route('/api/event_stats')
+@librarian_required
+def api_event_stats():
+    from flask import jsonify
+    return jsonify(library.get_event_stats())
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Server-Sent Events stream of dashboard stats, messages, returns and announcements as they change"""
+    from flask import Response, jsonify
+    stream = library.events.stream(session['user_id'], session.get('user_type'),
+                                   request.headers.get('Last-Event-ID'))
+    if stream is None:
+        # Every stream slot of this worker is taken; the page retries later
+        return jsonify({'error': 'Too many live update streams, try again later'}), 503
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/cache_stats')
+@librarian_required
+def api_cache_stats():
+    from flask import jsonify
+    return jsonify(library.get_cache_stats())
+
 @app.route('/api/recent_activities')
 @librarian_required
+@conditional_get('Loans', 'Books', 'Members')
 def api_recent_activities():
     from flask import jsonify
     # Get recent loans, returns, etc.
@@ -2561,11 +2912,16 @@ def api_recent_activities():
 def api_calculate_fines():
     from flask import jsonify
     try:
-        fines_created = library.calculate_overdue_fines()
+        run = run_job(library, 'accrue_fines', force=True)
+        if run['error']:
+            raise RuntimeError(run['error'])
+        fines_created = run['result']['created']
         return jsonify({
             'success': True,
             'fines_created': fines_created,
-            'message': f'Successfully calculated {fines_created} new fines.'
+            'fines_updated': run['result']['updated'],
+            'duration_ms': run['duration_ms'],
+            'message': f"Successfully calculated {fines_created} new fines and updated {run['result']['updated']}."
         })
     except Exception as e:
         return jsonify({
@@ -2583,6 +2939,7 @@ def deactivate_announcement(announcement_id):
         cursor.execute('UPDATE Announcements SET Status = "inactive" WHERE AnnouncementID = ?', (announcement_id,))
         conn.commit()
         conn.close()
+        library.cache.invalidate('announcements')
         
         # Log the action
         library.log_audit(session['user_id'], f'Deactivated announcement ID {announcement_id}')
@@ -2616,6 +2973,7 @@ def update_announcement():
     ''', (title, content, priority, target_audience, expiry_date, announcement_id))
     conn.commit()
     conn.close()
+    library.cache.invalidate('announcements')
     
     # Log the action
     library.log_audit(session['user_id'], f'Updated announcement: {title}')
@@ -2641,6 +2999,7 @@ def update_user():
             WHERE UserID = ?
         ''', (username, name, email, user_type, user_id))
         conn.commit()
+        library.cache.invalidate('users')
         
         # Log the action
         library.log_audit(session['user_id'], f'Updated user: {name} (ID: {user_id})')
@@ -0,0 +1,235 @@
+"""
+Audit Log Writer
+================
+
+AuditLogs rows are written one of two ways instead of with a connection,
+INSERT and commit of their own per audited action:
+
+- joined: when the caller passes the connection its operation is using and
+  a transaction is open on it, the row is inserted there and committed
+  (or rolled back) together with the change it describes, at no extra fsync
+- buffered: otherwise the row goes into an in-process queue that a
+  background thread flushes with executemany, one transaction per batch,
+  whenever `max_batch` rows are waiting or the oldest has waited
+  `max_delay` seconds
+
+Buffered rows carry the time they were logged, not the time they were
+flushed. They are drained at interpreter exit (atexit, which gunicorn's
+graceful worker shutdown runs) and by flush()/close(); only a hard kill
+can lose the last `max_delay` seconds of them. If a flush fails the batch
+is put back and retried on the next cycle.
+
+Configured with LIBRARY_AUDIT_MAX_BATCH, LIBRARY_AUDIT_MAX_DELAY (seconds)
+and LIBRARY_AUDIT_MAX_QUEUE; stats() reports queue depth and flush metrics.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+INSERT_SQL = '''
+    INSERT INTO AuditLogs (UserID, Action, TableName, RecordID, OldValues, NewValues, Timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def audit_row(user_id, action, table_name=None, record_id=None, old_values=None, new_values=None):
+    """AuditLogs parameters for one entry, timestamped now (same format as CURRENT_TIMESTAMP)"""
+    return (user_id, action, table_name, record_id,
+            json.dumps(old_values) if old_values else None,
+            json.dumps(new_values) if new_values else None,
+            datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+
+
+class AuditWriter:
+    """Writes audit rows inside the caller's transaction, or group-commits them from a buffer"""
+
+    def __init__(self, pool, max_batch=200, max_delay=0.5, max_queue=10000):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._reset_state()
+        atexit.register(self.close)
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._buffer = []           # (enqueued at, row)
+        self._flushing = 0          # rows taken by a flush that hasn't committed yet
+        self._thread = None
+        self._closed = False
+        self._metrics = {
+            'joined': 0,
+            'enqueued': 0,
+            'flushed': 0,
+            'batches': 0,
+            'flush_errors': 0,
+            'max_queue_depth': 0,
+            'last_flush_ms': None,
+            'last_error': None,
+        }
+
+    def _check_fork(self):
+        # A forked worker must not inherit the parent's buffer (the parent flushes
+        # those rows) or its flusher thread (which doesn't exist in the child)
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def write(self, user_id, action, table_name=None, record_id=None, old_values=None, new_values=None,
+              conn=None):
+        """Log one action; joins conn's open transaction if there is one, otherwise buffers it"""
+        row = audit_row(user_id, action, table_name, record_id, old_values, new_values)
+        if conn is not None and conn.in_transaction:
+            conn.execute(INSERT_SQL, row)
+            with self._cond:
+                self._metrics['joined'] += 1
+            return
+
+        with self._cond:
+            self._check_fork()
+            if not self._closed:
+                # Backpressure: never hold more than max_queue rows in memory
+                while len(self._buffer) + self._flushing >= self.max_queue:
+                    self._cond.notify_all()
+                    self._cond.wait(self.max_delay)
+                self._buffer.append((time.monotonic(), row))
+                self._metrics['enqueued'] += 1
+                depth = len(self._buffer) + self._flushing
+                self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], depth)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+                if len(self._buffer) >= self.max_batch:
+                    self._cond.notify_all()
+                return
+        # Late writes after shutdown started go straight to the database, without holding the
+        # lock that stats() and the flusher need while it waits for a connection and commits
+        self._write_batch([row])
+
+    def write_rows(self, rows, conn):
+        """Log several audit_row() entries in conn's open transaction with one executemany"""
+        conn.executemany(INSERT_SQL, rows)
+        with self._cond:
+            self._metrics['joined'] += len(rows)
+
+    def _write_batch(self, rows):
+        conn = self.pool.acquire()
+        try:
+            conn.executemany(INSERT_SQL, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _take_batch(self, force):
+        """Called with the lock held: the next batch to flush, or [] if nothing is due yet"""
+        if not self._buffer:
+            return []
+        due = force or len(self._buffer) >= self.max_batch or \
+            time.monotonic() - self._buffer[0][0] >= self.max_delay
+        if not due:
+            return []
+        batch = [row for _, row in self._buffer[:self.max_batch]]
+        del self._buffer[:self.max_batch]
+        self._flushing += len(batch)
+        return batch
+
+    def _flush_batch(self, batch):
+        start = time.perf_counter()
+        error = None
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        with self._cond:
+            self._flushing -= len(batch)
+            if error:
+                # Put the rows back in front and let the next cycle retry them
+                self._buffer[:0] = [(time.monotonic(), row) for row in batch]
+                self._metrics['flush_errors'] += 1
+                self._metrics['last_error'] = error
+            else:
+                self._metrics['flushed'] += len(batch)
+                self._metrics['batches'] += 1
+                self._metrics['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self._cond.notify_all()
+        return error is None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch(self._closed)
+                while not batch:
+                    if self._closed and not self._buffer:
+                        return
+                    wait = self.max_delay
+                    if self._buffer:
+                        wait = max(0.0, self._buffer[0][0] + self.max_delay - time.monotonic())
+                    self._cond.wait(wait)
+                    batch = self._take_batch(self._closed)
+            if not self._flush_batch(batch):
+                time.sleep(self.max_delay)
+
+    def flush(self):
+        """Write every buffered row now, in the calling thread; returns False if a batch failed"""
+        ok = True
+        while True:
+            with self._cond:
+                self._check_fork()
+                batch = self._take_batch(force=True)
+                if not batch:
+                    # Wait for a batch the flusher thread is still committing
+                    while self._flushing:
+                        self._cond.wait()
+                    if not self._buffer:
+                        return ok
+                    continue
+            if not self._flush_batch(batch):
+                return False
+
+    def close(self):
+        """Drain the buffer and stop the flusher thread (registered with atexit)"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._closed = True
+            self._cond.notify_all()
+        ok = self.flush()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        return ok
+
+    def stats(self):
+        """Queue depth and flush metrics"""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats['queue_depth'] = len(self._buffer) + self._flushing
+            stats['oldest_age_ms'] = round((time.monotonic() - self._buffer[0][0]) * 1000, 3) \
+                if self._buffer else None
+            stats['max_batch'] = self.max_batch
+            stats['max_delay'] = self.max_delay
+            return stats
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_audit_writer(db_name, pool):
+    """Return the process-wide audit writer for a database file, creating it on first use"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else db_name
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = AuditWriter(pool,
+                                 max_batch=int(os.environ.get('LIBRARY_AUDIT_MAX_BATCH', 200)),
+                                 max_delay=float(os.environ.get('LIBRARY_AUDIT_MAX_DELAY', 0.5)),
+                                 max_queue=int(os.environ.get('LIBRARY_AUDIT_MAX_QUEUE', 10000)))
+            _writers[key] = writer
+        return writer
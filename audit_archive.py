@@ -0,0 +1,274 @@
+"""
+Audit Log Archive
+=================
+
+Keeps the AuditLogs table down to the last `audit_retention_days` days
+(a SystemSettings value, 90 by default). Older rows are moved, oldest
+first and a batch at a time, into one SQLite file per calendar month:
+
+    <archive dir>/audit-2024-01.db
+
+Archived rows keep their LogID, so a batch is copied with INSERT OR IGNORE,
+committed, and only then deleted from the hot table: a run that dies half
+way is simply finished by the next one. OldValues/NewValues are stored
+zlib-compressed. The archive directory is `audit_archive/` next to the
+database, or LIBRARY_AUDIT_ARCHIVE_DIR.
+
+Audit payloads are short JSON documents, which zlib alone can't shrink, so
+each archive file carries a preset dictionary built from the first rows
+written to it (ArchiveInfo.zdict). A payload is stored compressed (BLOB)
+when that saves space and as plain TEXT otherwise; the column type tells
+the reader which.
+
+query_audit_logs searches the hot table and the archive files together,
+newest first, by time range, user and action prefix. Archive months
+outside the range are never opened, and older months are only read while
+they can still contribute to the requested page.
+
+The archive_audit_logs job (jobs.py) runs it daily.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import zlib
+from datetime import datetime, timedelta, timezone
+
+ARCHIVE_BATCH_SIZE = 5000
+ZDICT_SIZE = 16384
+# Raw deflate with a 8 KB window and small state: payloads are short, and the
+# per-row compressor is a copy of one primed with the dictionary
+ZLIB_WBITS = -13
+ZLIB_MEM_LEVEL = 5
+ARCHIVE_FILE_PATTERN = re.compile(r'^audit-(\d{4}-\d{2})\.db$')
+COLUMNS = 'LogID, UserID, Action, TableName, RecordID, OldValues, NewValues, Timestamp, IPAddress'
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS AuditLogs (
+        LogID INTEGER PRIMARY KEY,
+        UserID INTEGER,
+        Action TEXT NOT NULL,
+        TableName TEXT,
+        RecordID INTEGER,
+        OldValues BLOB,
+        NewValues BLOB,
+        Timestamp DATETIME,
+        IPAddress TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_auditlogs_timestamp ON AuditLogs(Timestamp);
+    CREATE INDEX IF NOT EXISTS idx_auditlogs_user_timestamp ON AuditLogs(UserID, Timestamp);
+    CREATE INDEX IF NOT EXISTS idx_auditlogs_action ON AuditLogs(lower(Action));
+    CREATE TABLE IF NOT EXISTS ArchiveInfo (
+        Key TEXT PRIMARY KEY,
+        Value BLOB
+    );
+'''
+
+
+def archive_dir_for(db_name):
+    """Where a database's audit archive files live"""
+    return os.environ.get('LIBRARY_AUDIT_ARCHIVE_DIR') or \
+        os.path.join(os.path.dirname(os.path.abspath(db_name)), 'audit_archive')
+
+
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f'audit-{month}.db')
+
+
+def archived_months(archive_dir):
+    """'YYYY-MM' of every archive file, oldest first"""
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(match.group(1) for match in map(ARCHIVE_FILE_PATTERN.match, os.listdir(archive_dir)) if match)
+
+
+def _next_month(month):
+    year, mon = map(int, month.split('-'))
+    return f'{year + mon // 12:04d}-{mon % 12 + 1:02d}'
+
+
+class ArchiveFile:
+    """One month's archive database and its compression dictionary"""
+
+    def __init__(self, archive_dir, month, create=False):
+        if create:
+            os.makedirs(archive_dir, exist_ok=True)
+        self.conn = sqlite3.connect(archive_path(archive_dir, month))
+        if create:
+            self.conn.executescript(ARCHIVE_SCHEMA)
+        row = self.conn.execute("SELECT Value FROM ArchiveInfo WHERE Key = 'zdict'").fetchone()
+        self._set_zdict(row[0] if row else None)
+
+    def _set_zdict(self, zdict):
+        self.zdict = zdict
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, ZLIB_WBITS, ZLIB_MEM_LEVEL,
+                                            zlib.Z_DEFAULT_STRATEGY, zdict) if zdict else None
+
+    def train(self, payloads):
+        """Build and store the dictionary from sample payloads, if this file doesn't have one yet"""
+        if self.zdict:
+            return
+        samples = b''.join(dict.fromkeys(text.encode('utf-8') for text in payloads if text))
+        if samples:
+            # zlib favours the end of the dictionary, so keep the last ZDICT_SIZE bytes
+            self.conn.execute("INSERT INTO ArchiveInfo (Key, Value) VALUES ('zdict', ?)", (samples[-ZDICT_SIZE:],))
+            self._set_zdict(samples[-ZDICT_SIZE:])
+
+    def pack(self, text):
+        """Compressed BLOB if that is smaller, otherwise the text itself"""
+        if text is None or self._compressor is None:
+            return text
+        data = text.encode('utf-8')
+        compressor = self._compressor.copy()
+        blob = compressor.compress(data) + compressor.flush()
+        return blob if len(blob) < len(data) else text
+
+    def unpack(self, value):
+        if not isinstance(value, bytes):
+            return value
+        decompressor = zlib.decompressobj(ZLIB_WBITS, self.zdict)
+        return (decompressor.decompress(value) + decompressor.flush()).decode('utf-8')
+
+    def close(self):
+        self.conn.close()
+
+
+def archive_audit_logs(conn, archive_dir, retention_days, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move AuditLogs rows older than retention_days into the monthly archive files
+
+    Returns {'archived': rows moved, 'months': months written, 'cutoff': timestamp}.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    archives = {}
+    archived = 0
+    try:
+        while True:
+            rows = conn.execute(f'''
+                SELECT {COLUMNS} FROM AuditLogs
+                WHERE Timestamp < ?
+                ORDER BY Timestamp, LogID
+                LIMIT ?
+            ''', (cutoff, batch_size)).fetchall()
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(row[7][:7], []).append(row)
+            for month, month_rows in by_month.items():
+                if month not in archives:
+                    archives[month] = ArchiveFile(archive_dir, month, create=True)
+                archive = archives[month]
+                archive.train(value for row in month_rows for value in (row[5], row[6]))
+                archive.conn.executemany(
+                    f'INSERT OR IGNORE INTO AuditLogs ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (row[:5] + (archive.pack(row[5]), archive.pack(row[6])) + row[7:] for row in month_rows))
+                archive.conn.commit()
+
+            # Only now that every row is durable in its archive file
+            conn.execute('DELETE FROM AuditLogs WHERE LogID IN (SELECT value FROM json_each(?))',
+                         (json.dumps([row[0] for row in rows]),))
+            conn.commit()
+            archived += len(rows)
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return {'archived': archived, 'months': sorted(archives), 'cutoff': cutoff}
+
+
+def _newest_first(rows):
+    rows.sort(key=lambda row: (row[7] or '', row[0]), reverse=True)
+
+
+def _prefix_successor(prefix):
+    """Exclusive upper bound for strings starting with prefix (None: no bound needed).
+
+    SQLite compares text by its UTF-8 bytes, where characters outside the BMP
+    sort above '\\uffff', so the last character is bumped instead of appending
+    one (skipping the surrogates, which can't be encoded)."""
+    while prefix and prefix[-1] == '\U0010ffff':
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    return prefix[:-1] + chr(0xE000 if 0xD800 <= code <= 0xDFFF else code)
+
+
+def _filters(start, end, user_id, action, action_match='contains'):
+    """WHERE clause and parameters shared by the hot table and the archive files"""
+    clauses, params = [], []
+    if start:
+        clauses.append('Timestamp >= ?')
+        params.append(start)
+    if end:
+        clauses.append('Timestamp < ?')
+        params.append(end)
+    if user_id:
+        clauses.append('UserID = ?')
+        params.append(user_id)
+    if action and action_match == 'prefix':
+        # Case-insensitive prefix match as a range on the lower(Action) index
+        prefix = action.strip().lower()
+        clauses.append('lower(Action) >= ?')
+        params.append(prefix)
+        end_of_prefix = _prefix_successor(prefix)
+        if end_of_prefix is not None:
+            clauses.append('lower(Action) < ?')
+            params.append(end_of_prefix)
+    elif action:
+        # Anywhere in the text, ignoring case: no index helps, the other filters narrow the scan
+        clauses.append('instr(lower(Action), ?) > 0')
+        params.append(action.strip().lower())
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def query_audit_logs(conn, archive_dir, start=None, end=None, user_id=None, action=None, limit=100,
+                     action_match='contains'):
+    """Newest-first audit rows from the hot table and the archive, with the user's name appended
+
+    start/end are 'YYYY-MM-DD[ HH:MM:SS]' bounds (end exclusive); action is
+    found anywhere in the action text, ignoring case, or only at its start
+    (using the lower(Action) index) with action_match='prefix'. Rows are
+    (LogID, UserID, Action, TableName, RecordID, OldValues, NewValues,
+    Timestamp, IPAddress, UserName), the same shape as AuditLogs.* + Users.Name.
+    """
+    where, params = _filters(start, end, user_id, action, action_match)
+    order = ' ORDER BY Timestamp DESC, LogID DESC LIMIT ?'
+    rows = conn.execute(f'SELECT {COLUMNS} FROM AuditLogs' + where + order, params + [limit]).fetchall()
+
+    for month in reversed(archived_months(archive_dir)):
+        month_start, month_end = f'{month}-01', f'{_next_month(month)}-01'
+        if (start and month_end <= start[:10]) or (end and month_start >= end):
+            continue
+        if len(rows) >= limit:
+            _newest_first(rows)
+            del rows[limit:]
+            if (rows[-1][7] or '') >= month_end:
+                # Everything in this month and before is older than the page
+                break
+        archive = ArchiveFile(archive_dir, month)
+        try:
+            rows.extend(row[:5] + (archive.unpack(row[5]), archive.unpack(row[6])) + row[7:] for row in
+                        archive.conn.execute(f'SELECT {COLUMNS} FROM AuditLogs' + where + order, params + [limit]))
+        finally:
+            archive.close()
+
+    _newest_first(rows)
+    # A row can be in both places if an archive run died between copy and delete
+    seen = set()
+    rows = [row for row in rows if not (row[0] in seen or seen.add(row[0]))][:limit]
+    user_ids = sorted({row[1] for row in rows if row[1] is not None})
+    names = dict(conn.execute('SELECT UserID, Name FROM Users WHERE UserID IN (SELECT value FROM json_each(?))',
+                              (json.dumps(user_ids),))) if user_ids else {}
+    return [tuple(row) + (names.get(row[1]),) for row in rows]
+
+
+def archive_stats(conn, archive_dir):
+    """Hot row count and per-month archive file sizes"""
+    months = archived_months(archive_dir)
+    return {
+        'hot_rows': conn.execute('SELECT COUNT(*) FROM AuditLogs').fetchone()[0],
+        'archive_months': months,
+        'archive_bytes': sum(os.path.getsize(archive_path(archive_dir, month)) for month in months),
+    }
@@ -0,0 +1,1009 @@
+#!/usr/bin/env python3
+"""
+Performance Benchmarks
+======================
+
+Each benchmark builds its own throwaway database under a temp directory,
+so library.db is never touched.
+
+Usage:
+    python benchmarks.py storage [--workers 4] [--seconds 5]
+    python benchmarks.py search [--sizes 10000,100000,1000000]
+    python benchmarks.py dashboard [--loans 1000000]
+    python benchmarks.py import [--rows 200000]
+    python benchmarks.py digest [--loans 100000]
+    python benchmarks.py audit [--actions 5000]
+    python benchmarks.py audit-archive [--rows 1000000]
+    python benchmarks.py broadcast [--librarians 50]
+    python benchmarks.py inbox [--messages 200000]
+    python benchmarks.py events [--dashboards 50] [--seconds 20]
+    python benchmarks.py copies [--titles 100000]
+    python benchmarks.py circulation [--sessions 20] [--items 50]
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from db_pool import ConnectionPool, load_storage_profile
+from migrations import migrate
+
+# Python's sqlite3 defaults: rollback journal, FULL sync, 2 MB cache, 5s timeout
+LEGACY_PROFILE = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'cache_size': -2000,
+    'mmap_size': 0,
+    'temp_store': 'DEFAULT',
+    'busy_timeout': 5000,
+}
+
+
+_app_scratch = None
+
+
+def _library_manager():
+    """LibraryManager, importing app (which migrates and opens LIBRARY_DB) against a scratch database"""
+    global _app_scratch
+    if 'app' not in sys.modules:
+        _app_scratch = tempfile.TemporaryDirectory(prefix='bench-app-')
+        os.environ['LIBRARY_DB'] = os.path.join(_app_scratch.name, 'app.db')
+    from app import LibraryManager
+    return LibraryManager
+
+
+def create_core_schema(db_path):
+    """Create the Books/Members/Loans tables used by the benchmarks"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS Books (
+            ISBN TEXT PRIMARY KEY,
+            Title TEXT NOT NULL,
+            Author TEXT NOT NULL,
+            Genre TEXT,
+            PublicationYear INT,
+            AvailabilityStatus TEXT
+        );
+        CREATE TABLE IF NOT EXISTS Members (
+            MemberID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name TEXT NOT NULL,
+            ContactInfo TEXT,
+            RegistrationDate DATE
+        );
+        CREATE TABLE IF NOT EXISTS Loans (
+            LoanID INTEGER PRIMARY KEY AUTOINCREMENT,
+            BookID TEXT NOT NULL,
+            MemberID INT NOT NULL,
+            LoanDate DATE,
+            DueDate DATE,
+            ReturnDate DATE
+        );
+        CREATE TABLE IF NOT EXISTS AuditLogs (
+            LogID INTEGER PRIMARY KEY AUTOINCREMENT,
+            UserID INTEGER,
+            Action TEXT NOT NULL,
+            Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def seed_books(db_path, count):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+        ((f'BENCH{i:07d}', f'Title {i}', f'Author {i % 997}', 'Fiction', 1900 + i % 120, 'Available')
+         for i in range(count)))
+    conn.commit()
+    conn.close()
+
+
+def report(title, rows):
+    print(f'\n{title}')
+    print('-' * len(title))
+    for label, value in rows:
+        print(f'  {label:<48} {value}')
+
+
+# ===== STORAGE PROFILE =====
+def _storage_worker(db_path, profile, seconds, write_ratio, seed, results):
+    rng = random.Random(seed)
+    pool = ConnectionPool(db_path, max_size=1, profile=profile)
+    reads = writes = locked = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            with pool.connection() as conn:
+                if rng.random() < write_ratio:
+                    conn.execute('INSERT INTO AuditLogs (UserID, Action) VALUES (?, ?)',
+                                 (seed, 'benchmark write'))
+                    conn.commit()
+                    writes += 1
+                else:
+                    isbn = f'BENCH{rng.randrange(1000):07d}'
+                    conn.execute('SELECT * FROM Books WHERE ISBN = ?', (isbn,)).fetchone()
+                    conn.execute('SELECT COUNT(*) FROM AuditLogs WHERE UserID = ?', (seed,)).fetchone()
+                    reads += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    results.put((reads, writes, locked))
+
+
+def _run_storage(profile, workers, seconds, write_ratio):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        create_core_schema(db_path)
+        seed_books(db_path, 1000)
+        # Put the file into the profile's journal mode before the workers start
+        ConnectionPool(db_path, max_size=1, profile=profile).acquire().close()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_storage_worker,
+                                         args=(db_path, profile, seconds, write_ratio, i, results))
+                 for i in range(workers)]
+        for proc in procs:
+            proc.start()
+        totals = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    reads = sum(t[0] for t in totals)
+    writes = sum(t[1] for t in totals)
+    locked = sum(t[2] for t in totals)
+    return reads / seconds, writes / seconds, locked
+
+
+def bench_storage(args):
+    """Read/write throughput with N worker processes, legacy vs tuned profile"""
+    tuned = load_storage_profile()
+    rows = []
+    for name, profile in (('legacy (rollback journal)', LEGACY_PROFILE), ('tuned (WAL)', tuned)):
+        reads, writes, locked = _run_storage(profile, args.workers, args.seconds, args.write_ratio)
+        rows.append((f'{name} reads/s', f'{reads:,.0f}'))
+        rows.append((f'{name} writes/s', f'{writes:,.0f}'))
+        rows.append((f'{name} "database is locked"', locked))
+    report(f'Storage profile: {args.workers} workers, {args.seconds}s, '
+           f'{args.write_ratio:.0%} writes', rows)
+
+
+
+# ===== CATALOG SEARCH =====
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'dor', 'sil', 'var', 'tho', 'ne', 'bri', 'gal', 'um',
+             'os', 'ter', 'fa', 'lin', 'qua', 'zel', 'mor', 'pe']
+SPECIAL_WORDS = ['misérables', 'brontë', 'café', 'python', 'kingdom', 'memory', 'secret']
+
+
+def _catalog_words(rng, count=20000):
+    words = {''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)}
+    return sorted(words) + SPECIAL_WORDS
+
+
+def _seed_catalog(db_path, count, seed=42):
+    rng = random.Random(seed)
+    words = _catalog_words(rng)
+    conn = sqlite3.connect(db_path)
+    # Skewed word choice: a few words are common, most are rare, like real titles
+    rows = ((f'BENCH{i:08d}',
+             ' '.join(words[min(int(rng.paretovariate(0.6)) - 1, len(words) - 1)]
+                      if rng.random() < 0.5 else rng.choice(words)
+                      for _ in range(rng.randint(2, 5))),
+             f'{rng.choice(words).title()} {rng.choice(words).title()}',
+             rng.choice(['Fiction', 'History', 'Science', 'Technology', 'Romance']),
+             1900 + i % 120,
+             'Available' if i % 4 else 'Loaned') for i in range(count))
+    conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def _time_queries(fn, terms, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for term in terms:
+            fn(term)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(terms))
+
+
+def bench_search(args):
+    """Catalog search latency: legacy LIKE '%term%' scan vs FTS5 index"""
+    LibraryManager = _library_manager()
+    terms = ['secret', 'kingdom memory', 'miserables', 'bronte', 'silvar', 'kalo']
+    rows = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            migrate(db_path)
+            _seed_catalog(db_path, size)
+            library = LibraryManager(db_path)
+
+            def like_search(term):
+                with library.connection() as conn:
+                    return conn.execute('''
+                        SELECT ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus
+                        FROM Books
+                        WHERE Title LIKE ? OR Author LIKE ? OR Genre LIKE ?
+                    ''', (f'%{term}%', f'%{term}%', f'%{term}%')).fetchall()
+
+            def fts_search(term):
+                return library.search_books(term, limit=args.limit)
+
+            like_ms = _time_queries(like_search, terms, args.repeat)
+            fts_ms = _time_queries(fts_search, terms, args.repeat)
+            library.pool.close_all()
+        rows.append((f'{size:>9,} books  LIKE scan', f'{like_ms:8.2f} ms/query'))
+        rows.append((f'{size:>9,} books  FTS5 top {args.limit}', f'{fts_ms:8.2f} ms/query  ({like_ms / fts_ms:,.1f}x)'))
+    report('Catalog search', rows)
+
+
+# ===== DASHBOARD STATS =====
+# get_dashboard_stats before the StatCounters table: nine COUNT(*) statements
+LEGACY_DASHBOARD_QUERIES = [
+    'SELECT COUNT(*) FROM Books',
+    'SELECT COUNT(*) FROM Books WHERE AvailabilityStatus = "Available"',
+    'SELECT COUNT(*) FROM Members WHERE Status = "active" OR Status IS NULL',
+    'SELECT COUNT(*) FROM Loans WHERE ReturnDate IS NULL',
+    'SELECT COUNT(*) FROM Loans WHERE DueDate < date("now") AND ReturnDate IS NULL',
+    'SELECT COUNT(*) FROM BookReservations WHERE Status = "active"',
+    'SELECT COUNT(*) FROM Fines WHERE Status = "unpaid"',
+    'SELECT COUNT(*) FROM Messages WHERE IsRead = 0',
+    'SELECT COUNT(*) FROM Members WHERE RegistrationDate >= date("now", "-30 days")',
+]
+
+
+def _seed_circulation(db_path, loans, books=100000, members=20000, seed=7):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+                     ((f'BENCH{i:08d}', f'Title {i}', f'Author {i % 997}', 'Fiction', 2000,
+                       'Available' if i % 5 else 'Loaned') for i in range(books)))
+    conn.executemany('INSERT INTO Members (Name, ContactInfo, RegistrationDate) VALUES (?, ?, ?)',
+                     ((f'Member {i}', f'member{i}@example.com', f'20{10 + i % 15}-01-01')
+                      for i in range(members)))
+    # ~3% of loans still open, some of them overdue
+    conn.executemany('INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, ReturnDate) VALUES (?, ?, ?, ?, ?)',
+                     ((f'BENCH{rng.randrange(books):08d}', rng.randrange(1, members + 1),
+                       '2024-01-01', f'2024-{rng.randint(1, 12):02d}-15',
+                       None if rng.random() < 0.03 else '2024-01-10') for _ in range(loans)))
+    conn.executemany("INSERT INTO Fines (MemberID, FineType, Amount, Status) VALUES (?, 'overdue', 1.0, ?)",
+                     ((rng.randrange(1, members + 1), 'unpaid' if i % 3 else 'paid')
+                      for i in range(loans // 20)))
+    conn.commit()
+    conn.close()
+
+
+def bench_dashboard(args):
+    """get_dashboard_stats latency: nine COUNT(*) scans vs trigger-maintained counters"""
+    LibraryManager = _library_manager()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        start = time.perf_counter()
+        _seed_circulation(db_path, args.loans)
+        seed_s = time.perf_counter() - start
+        library = LibraryManager(db_path)
+
+        def legacy_stats(_):
+            with library.connection() as conn:
+                return [conn.execute(query).fetchone()[0] for query in LEGACY_DASHBOARD_QUERIES]
+
+        def counter_stats(_):
+            return library.get_dashboard_stats()
+
+        legacy_ms = _time_queries(legacy_stats, [None], args.repeat)
+        counter_ms = _time_queries(counter_stats, [None], args.repeat)
+        start = time.perf_counter()
+        drift = library.reconcile_dashboard_counters(repair=False)
+        reconcile_ms = (time.perf_counter() - start) * 1000
+        library.pool.close_all()
+    report(f'Dashboard stats at {args.loans:,} loans', [
+        ('seed (with counter triggers)', f'{seed_s:8.1f} s'),
+        ('nine COUNT(*) statements', f'{legacy_ms:8.2f} ms/render'),
+        ('StatCounters + range counts', f'{counter_ms:8.2f} ms/render  ({legacy_ms / counter_ms:,.1f}x)'),
+        ('reconcile (full recount)', f'{reconcile_ms:8.2f} ms, drift: {drift or "none"}'),
+    ])
+
+
+# ===== BULK IMPORT =====
+def _write_catalog_dump(path, rows, seed=11):
+    rng = random.Random(seed)
+    words = _catalog_words(rng, 2000)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write('isbn,title,author,genre,publication_year\n')
+        for i in range(rows):
+            f.write(f'978{i:010d},{rng.choice(words).title()} {rng.choice(words)},'
+                    f'{rng.choice(words).title()} {rng.choice(words).title()},Fiction,{1900 + i % 120}\n')
+
+
+def bench_import(args):
+    """Catalog import throughput: one INSERT per row vs streaming chunked executemany upserts"""
+    import csv
+    from bulk_import import text_stream
+    LibraryManager = _library_manager()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, 'catalog.csv')
+        _write_catalog_dump(dump, args.rows)
+
+        # What bulk_import_books used to do: parse everything, then a Python loop of INSERTs
+        db_path = os.path.join(tmp, 'legacy.db')
+        migrate(db_path)
+        start = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        with open(dump, newline='', encoding='utf-8') as f:
+            books = [tuple(row) for row in list(csv.reader(f))[1:]]
+        for book in books:
+            conn.execute("INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus) "
+                         "VALUES (?, ?, ?, ?, ?, 'Available')", book)
+        conn.commit()
+        conn.close()
+        legacy_s = time.perf_counter() - start
+        rows.append(('row-at-a-time INSERT', f'{args.rows / legacy_s:>10,.0f} rows/s  ({legacy_s:.1f} s)'))
+
+        for chunk_size in (int(s) for s in args.chunk_sizes.split(',')):
+            db_path = os.path.join(tmp, f'chunked-{chunk_size}.db')
+            migrate(db_path)
+            library = LibraryManager(db_path)
+            for label in ('insert', 're-import (all updates)'):
+                with open(dump, 'rb') as f:
+                    result = library.import_catalog(text_stream(f), 'csv', chunk_size=chunk_size)
+                rows.append((f'chunked upsert x{chunk_size}: {label}',
+                             f'{result.rows_per_sec:>10,.0f} rows/s  ({result.elapsed:.1f} s)'))
+            library.pool.close_all()
+    report(f'Bulk import of {args.rows:,} books (FTS and counter triggers enabled)', rows)
+
+
+# ===== REMINDER DIGESTS =====
+def _seed_open_loans(db_path, loans, members, seed=13):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+                     ((f'BENCH{i:08d}', f'Title {i}', f'Author {i % 997}', 'Fiction', 2000, 'Loaned')
+                      for i in range(loans)))
+    conn.executemany('INSERT INTO Members (Name, ContactInfo) VALUES (?, ?)',
+                     ((f'Member {i}', f'member{i}@example.com') for i in range(members)))
+    # Open loans due between two months ago and three weeks from now
+    conn.executemany("INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate) "
+                     "VALUES (?, ?, date('now', '-90 days'), date('now', ?))",
+                     ((f'BENCH{i:08d}', rng.randrange(1, members + 1), f'{rng.randint(-60, 20)} days')
+                      for i in range(loans)))
+    conn.commit()
+    conn.close()
+
+
+def bench_digest(args):
+    """Reminder run size: one email per loan vs one digest per member"""
+    from library_chatbot import LibraryChatbot
+    from mailer import build_message
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        _seed_open_loans(db_path, args.loans, args.members)
+        chatbot = LibraryChatbot(db_path)
+
+        start = time.perf_counter()
+        per_loan = 0
+        for loans, overdue in ((chatbot.get_overdue_loans(), True), (chatbot.get_loans_due_soon(3), False)):
+            for loan in loans:
+                subject, body = chatbot.create_reminder_email(loan[3], loan[1], loan[2], loan[5], overdue)
+                build_message('library@example.com', loan[4], subject, body)
+                per_loan += 1
+        per_loan_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        digests = covered = 0
+        for _, name, contact_info, loans in chatbot.iter_reminder_digests(3):
+            subject, body = chatbot.create_digest_email(name, loans)
+            build_message('library@example.com', contact_info, subject, body)
+            digests += 1
+            covered += len(loans)
+        digest_s = time.perf_counter() - start
+    report(f'Reminder run over {args.loans:,} open loans, {args.members:,} members', [
+        ('one email per loan', f'{per_loan:>8,} messages  ({per_loan_s:.2f} s to query and render)'),
+        ('one digest per member', f'{digests:>8,} messages  ({digest_s:.2f} s to query and render)'),
+        ('loans covered by the digests', f'{covered:>8,}'),
+        ('reduction in messages / SMTP transactions', f'{per_loan / max(digests, 1):>8.1f}x'),
+    ])
+
+
+# ===== AUDIT LOG =====
+def bench_audit(args):
+    """Audited loans/sec: a separate audit commit per action vs joined or group-committed audit rows"""
+    LibraryManager = _library_manager()
+    from audit import INSERT_SQL, audit_row
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+                         ((f'BENCH{i:08d}', f'Title {i}', 'Author', 'Fiction', 2000, 'Available')
+                          for i in range(args.actions * 3)))
+        member_id = conn.execute("INSERT INTO Members (Name) VALUES ('Bench Member')").lastrowid
+        conn.commit()
+        conn.close()
+        library = LibraryManager(db_path)
+
+        def legacy(isbn):
+            # What log_audit used to do: its own connection, INSERT and commit after the loan
+            library.loan_book(isbn, member_id)
+            with library.connection() as audit_conn:
+                audit_conn.execute(INSERT_SQL, audit_row(1, f'Quick loan: {isbn}'))
+                audit_conn.commit()
+
+        def joined(isbn):
+            library.loan_book(isbn, member_id, audit={'user_id': 1, 'action': f'Quick loan: {isbn}'})
+
+        def buffered(isbn):
+            library.loan_book(isbn, member_id)
+            library.log_audit(1, f'Quick loan: {isbn}')
+
+        for offset, (label, action) in enumerate((('separate audit commit', legacy),
+                                                  ('audit row in the loan transaction', joined),
+                                                  ('group-committed audit buffer', buffered))):
+            start = time.perf_counter()
+            for i in range(offset * args.actions, (offset + 1) * args.actions):
+                action(f'BENCH{i:08d}')
+            library.flush_audit_log()
+            elapsed = time.perf_counter() - start
+            rows.append((label, f'{args.actions / elapsed:>8,.0f} loans/s  ({elapsed:.2f} s)'))
+        stats = library.get_audit_stats()
+        rows.append(('buffer: rows / batches / max queue depth',
+                     f"{stats['flushed']:,} / {stats['batches']:,} / {stats['max_queue_depth']:,}"))
+        library.audit.close()
+        library.pool.close_all()
+    report(f'{args.actions:,} audited loans (storage profile: {load_storage_profile()["synchronous"]} sync)', rows)
+
+
+def _seed_audit_history(db_path, rows, days, seed=17):
+    rng = random.Random(seed)
+    # Removed member is the rare action a filter has to dig for
+    actions = ('Quick loan', 'Book returned', 'Added book from request', 'Updated user') * 50 + ('Removed member ID',)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO AuditLogs (UserID, Action, TableName, OldValues, NewValues, Timestamp) "
+        "VALUES (?, ?, 'Books', ?, ?, datetime('now', ?))",
+        ((rng.randrange(1, 50), f'{rng.choice(actions)}: item {i}',
+          f'{{"status": "Available", "item": {i}, "notes": "restocked from the east wing shelf"}}',
+          f'{{"status": "Loaned", "item": {i}, "notes": "checked out at the front desk"}}',
+          f'-{rng.randrange(days * 86400)} seconds')
+         for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def bench_audit_archive(args):
+    """Audit log page queries and database size before and after archiving to monthly files"""
+    LibraryManager = _library_manager()
+    legacy_sql = (
+        "SELECT al.*, u.Name as UserName FROM AuditLogs al LEFT JOIN Users u ON al.UserID = u.UserID "
+        "WHERE 1=1 AND al.Action LIKE ? ORDER BY al.Timestamp DESC LIMIT ?")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        _seed_audit_history(db_path, args.rows, args.days)
+        library = LibraryManager(db_path)
+        library.audit_archive_dir = os.path.join(tmp, 'audit_archive')
+
+        def timed(fn):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                fn()
+            return (time.perf_counter() - start) / args.repeat * 1000
+
+        def db_mb():
+            with library.connection() as conn:
+                conn.execute('VACUUM')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            return os.path.getsize(db_path) / 1e6
+
+        with library.connection() as conn:
+            legacy_ms = timed(lambda: conn.execute(legacy_sql, ('%removed member%', 100)).fetchall())
+        before_mb = db_mb()
+
+        start = time.perf_counter()
+        result = library.archive_audit_logs(args.retention_days)
+        archive_s = time.perf_counter() - start
+        after_mb = db_mb()
+
+        recent_ms = timed(lambda: library.get_audit_logs(100, action='removed member'))
+        range_end = (time.time() - args.days * 86400 / 2)
+        old_range = (time.strftime('%Y-%m-%d', time.gmtime(range_end - 7 * 86400)),
+                     time.strftime('%Y-%m-%d', time.gmtime(range_end)))
+        old_ms = timed(lambda: library.get_audit_logs(100, action='removed member',
+                                                      start=old_range[0], end=old_range[1]))
+        library.pool.close_all()
+    report(f'{args.rows:,} audit entries over {args.days} days, {args.retention_days}-day retention', [
+        ("legacy LIKE '%x%' page, rare action", f'{legacy_ms:>8.1f} ms'),
+        ('archive run', f"{result['archived']:>8,} rows  ({archive_s:.1f} s, "
+                        f"{len(result['archive_months'])} monthly files)"),
+        ('database size before / after', f'{before_mb:>8.1f} MB / {after_mb:.1f} MB'),
+        ('archive files (compressed payloads)', f"{result['archive_bytes'] / 1e6:>8.1f} MB"),
+        ('action-prefix page, rare action (hot + archive)', f'{recent_ms:>8.1f} ms'),
+        (f'action-prefix page, rare action, week of {old_range[0]}', f'{old_ms:>8.1f} ms'),
+    ])
+
+
+# ===== MESSAGING =====
+def bench_broadcast(args):
+    """Student-to-librarian messages: one send_message per librarian vs one broadcast"""
+    LibraryManager = _library_manager()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO Users (Username, Password, Name, UserType) VALUES (?, 'x', ?, 'librarian')",
+                         ((f'bench_librarian{i}', f'Librarian {i}') for i in range(args.librarians)))
+        conn.commit()
+        conn.close()
+        library = LibraryManager(db_path)
+
+        def fan_out():
+            # What student_send_message used to do
+            with library.connection() as conn:
+                librarians = conn.execute("SELECT UserID FROM Users WHERE UserType = 'librarian'").fetchall()
+            for librarian in librarians:
+                library.send_message(1, librarian[0], 'Question', 'Is the atlas in?', 'student_inquiry')
+
+        def broadcast():
+            library.broadcast_message(1, 'librarian', 'Question', 'Is the atlas in?', 'student_inquiry')
+
+        rows = []
+        for label, send in (('send_message per librarian', fan_out), ('broadcast_message', broadcast)):
+            start = time.perf_counter()
+            for _ in range(args.messages):
+                send()
+            elapsed = time.perf_counter() - start
+            rows.append((label, f'{args.messages / elapsed:>8,.0f} messages/s  '
+                                f'({elapsed / args.messages * 1000:.2f} ms each)'))
+        with library.connection() as conn:
+            stored = conn.execute('SELECT COUNT(*) FROM Messages WHERE ToUserID IS NULL').fetchone()[0]
+        rows.append(('Messages rows per broadcast', f'{stored // args.messages:>8}'))
+        library.pool.close_all()
+    report(f'{args.messages:,} student messages to {args.librarians + 1} librarians', rows)
+
+
+# get_user_messages before MessageRecipients carried the inbox: every message ever received
+LEGACY_INBOX_SQL = '''
+    SELECT m.*, u.Name as SenderName
+    FROM Messages m
+    LEFT JOIN Users u ON m.FromUserID = u.UserID
+    WHERE (m.ToUserID = ? OR m.ToUserType = (SELECT UserType FROM Users WHERE UserID = ?))
+    ORDER BY m.SentDate DESC
+'''
+
+
+def bench_inbox(args):
+    """Student dashboard inbox: fetch everything and filter in Python vs indexed SQL filters"""
+    LibraryManager = _library_manager()
+    rng = random.Random(19)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType) VALUES (?, ?, 'x', ?, ?)",
+                         ((1000 + i, f'bench_user{i}', f'User {i}', 'librarian' if i < 10 else 'student')
+                          for i in range(args.users)))
+        start = time.perf_counter()
+        conn.executemany('INSERT INTO Messages (FromUserID, ToUserID, Subject, Message, SentDate, MessageType, IsRead) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         ((1000 + rng.randrange(10), 1010 + rng.randrange(args.users - 10), f'Subject {i}',
+                           'Message body', f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00',
+                           'librarian_reply' if i % 4 == 0 else 'general', int(rng.random() < 0.7))
+                          for i in range(args.messages)))
+        conn.commit()
+        conn.close()
+        seed_s = time.perf_counter() - start
+        library = LibraryManager(db_path)
+        students = [1010 + rng.randrange(args.users - 10) for _ in range(200)]
+
+        def legacy(user_id):
+            with library.connection() as conn:
+                rows = conn.execute(LEGACY_INBOX_SQL, (user_id, user_id)).fetchall()
+            return [row for row in rows if row[8] == 'librarian_reply']
+
+        def indexed(user_id):
+            return library.get_inbox(user_id, 'librarian_reply', limit=5)
+
+        def legacy_unread(user_id):
+            with library.connection() as conn:
+                rows = conn.execute(LEGACY_INBOX_SQL, (user_id, user_id)).fetchall()
+            return sum(1 for row in rows if not row[7])
+
+        legacy_ms = _time_queries(legacy, students, args.repeat)
+        indexed_ms = _time_queries(indexed, students, args.repeat)
+        legacy_unread_ms = _time_queries(legacy_unread, students, args.repeat)
+        counter_ms = _time_queries(library.get_unread_count, students, args.repeat)
+
+        user_id = students[0]
+        start = time.perf_counter()
+        for message in library.get_inbox(user_id, unread_only=True):
+            library.mark_message_read(message[0], user_id)
+        loop_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        marked = library.mark_all_messages_read(students[1])
+        bulk_ms = (time.perf_counter() - start) * 1000
+        library.pool.close_all()
+    report(f'Inboxes over {args.messages:,} messages to {args.users:,} users', [
+        ('seed (with inbox triggers)', f'{seed_s:8.1f} s'),
+        ('all messages, filter in Python', f'{legacy_ms:8.2f} ms/dashboard'),
+        ('get_inbox(type, limit=5)', f'{indexed_ms:8.2f} ms/dashboard  ({legacy_ms / indexed_ms:,.1f}x)'),
+        ('unread: count fetched rows', f'{legacy_unread_ms:8.2f} ms'),
+        ('unread: UserUnreadCounts', f'{counter_ms:8.3f} ms  ({legacy_unread_ms / counter_ms:,.1f}x)'),
+        ('mark read, one call each', f'{loop_ms:8.2f} ms'),
+        (f'mark_all_messages_read ({marked})', f'{bulk_ms:8.2f} ms'),
+    ])
+
+
+# ===== BOOK COPIES =====
+LEGACY_LOW_STOCK_SQL = '''
+    SELECT b.ISBN, b.Title, b.Author, b.AvailabilityStatus, b.Genre,
+           SUM(c.State = 'available') AS AvailableCount, COUNT(*) AS TotalCount
+    FROM Copies c JOIN Books b ON b.ISBN = c.ISBN
+    GROUP BY c.ISBN
+    HAVING AvailableCount <= ?
+'''
+
+
+def bench_copies(args):
+    """Low-stock alerts and per-title availability: grouping over Copies vs the maintained CopyCounts"""
+    LibraryManager = _library_manager()
+    rng = random.Random(21)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        start = time.perf_counter()
+        # Every title gets its first copy from a trigger; most get a few more
+        conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+                         ((f'BENCH{i:07d}', f'Title {i}', f'Author {i % 997}', 'Fiction', 1900 + i % 120, 'Available')
+                          for i in range(args.titles)))
+        conn.executemany("INSERT INTO Copies (Barcode, ISBN, State) VALUES (?, ?, ?)",
+                         ((f'BENCH{i:07d}-{n}', f'BENCH{i:07d}', 'loaned' if rng.random() < 0.4 else 'available')
+                          for i in range(args.titles) for n in range(2, 2 + rng.randrange(5))))
+        conn.commit()
+        copies = conn.execute('SELECT COUNT(*) FROM Copies').fetchone()[0]
+        conn.execute('ANALYZE')
+        conn.close()
+        seed_s = time.perf_counter() - start
+        library = LibraryManager(db_path)
+        isbns = [f'BENCH{rng.randrange(args.titles):07d}' for _ in range(500)]
+
+        def legacy_low_stock(threshold):
+            with library.connection() as conn:
+                return conn.execute(LEGACY_LOW_STOCK_SQL, (threshold,)).fetchall()
+
+        def legacy_counts(isbn):
+            with library.connection() as conn:
+                return conn.execute("SELECT SUM(State = 'available'), COUNT(*) FROM Copies WHERE ISBN = ?",
+                                    (isbn,)).fetchone()
+
+        alerts = library.get_low_stock_books(1)
+        assert sorted(legacy_low_stock(1)) == sorted(alerts)
+        legacy_alerts_ms = _time_queries(legacy_low_stock, [1], args.repeat)
+        alerts_ms = _time_queries(library.get_low_stock_books, [1], args.repeat)
+        legacy_counts_ms = _time_queries(legacy_counts, isbns, args.repeat)
+        counts_ms = _time_queries(library.get_copy_counts, isbns, args.repeat)
+
+        start = time.perf_counter()
+        loaned = sum(library.loan_book(isbn, 1)[0] for isbn in isbns)
+        loan_ms = (time.perf_counter() - start) * 1000 / len(isbns)
+        library.pool.close_all()
+    report(f'{args.titles:,} titles, {copies:,} copies', [
+        ('seed (with copy triggers)', f'{seed_s:8.1f} s'),
+        (f'low stock ({len(alerts):,} titles): GROUP BY over Copies', f'{legacy_alerts_ms:8.2f} ms'),
+        ('low stock: CopyCounts index range', f'{alerts_ms:8.2f} ms  ({legacy_alerts_ms / alerts_ms:,.1f}x)'),
+        ('availability: count copies of a title', f'{legacy_counts_ms:8.3f} ms'),
+        ('availability: CopyCounts lookup', f'{counts_ms:8.3f} ms  ({legacy_counts_ms / counts_ms:,.1f}x)'),
+        (f'loan_book ({loaned} of {len(isbns)} had a copy)', f'{loan_ms:8.2f} ms/loan'),
+    ])
+
+
+# ===== BATCH CIRCULATION =====
+def bench_circulation(args):
+    """Desk scanning sessions: one /quick_loan and /return_book request per book vs one batch request each way"""
+    import app as app_module
+    LibraryManager = _library_manager()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        titles = args.sessions * args.items * 2
+        conn.executemany('INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?)',
+                         ((f'BENCH{i:08d}', f'Title {i}', 'Author', 'Fiction', 2000, 'Available')
+                          for i in range(titles)))
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)',
+                         ((i, f'Member {i}') for i in range(1, 201)))
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType, MemberID) "
+                         "VALUES (?, ?, 'x', ?, 'student', ?)", ((100000 + i, f'bench_member{i}', f'Member {i}', i)
+                                                                  for i in range(1, 201)))
+        librarian_id = conn.execute("INSERT INTO Users (Username, Password, Name, UserType) "
+                                    "VALUES ('bench_librarian', 'x', 'Bench Librarian', 'librarian')").lastrowid
+        conn.commit()
+        conn.close()
+        library = LibraryManager(db_path)
+        app_module.library = library
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = librarian_id
+            session['user_type'] = 'librarian'
+
+        def session_items(n):
+            first = n * args.items
+            return [(f'BENCH{i:08d}', 1 + i % 200) for i in range(first, first + args.items)]
+
+        def timed_request(send):
+            start = time.perf_counter()
+            send()
+            elapsed = time.perf_counter() - start
+            # The flash a browser would show after the redirect, so the session cookie doesn't grow
+            with client.session_transaction() as session:
+                session.pop('_flashes', None)
+            return elapsed
+
+        def single(n):
+            items = session_items(n)
+            loaned = sum(timed_request(lambda: client.post('/quick_loan', data={'isbn': isbn, 'member_id': member_id}))
+                         for isbn, member_id in items)
+            with library.connection() as conn:
+                loan_ids = [row[0] for row in conn.execute(
+                    f"SELECT LoanID FROM Loans WHERE ReturnDate IS NULL AND BookID IN ({','.join('?' * len(items))})",
+                    [isbn for isbn, _ in items])]
+            return loaned, sum(timed_request(lambda: client.get(f'/return_book/{loan_id}')) for loan_id in loan_ids)
+
+        def batched(n):
+            items = session_items(n)
+            start = time.perf_counter()
+            body = client.post('/api/circulation/batch', json={'items': [
+                {'action': 'checkout', 'code': isbn, 'member_id': member_id} for isbn, member_id in items]}).get_json()
+            assert body['loaned'] == len(items)
+            loaned = time.perf_counter() - start
+            start = time.perf_counter()
+            body = client.post('/api/circulation/batch', json={'items': [
+                {'action': 'return', 'code': isbn, 'member_id': member_id} for isbn, member_id in items]}).get_json()
+            assert body['returned'] == len(items)
+            return loaned, time.perf_counter() - start
+
+        rows = []
+        means = {}
+        for label, run, offset in (('single requests', single, 0), ('batch request', batched, args.sessions)):
+            timings = [run(offset + n) for n in range(args.sessions)]
+            means[label] = [sum(column) * 1000 / args.sessions for column in zip(*timings)]
+            rows.append((f'{label}: checkout {args.items} books', f'{means[label][0]:8.1f} ms'))
+            rows.append((f'{label}: return {args.items} books', f'{means[label][1]:8.1f} ms'))
+        single_ms, batch_ms = means['single requests'], means['batch request']
+        rows.append(('speedup (checkout / return)',
+                     f'{single_ms[0] / batch_ms[0]:8.1f}x / {single_ms[1] / batch_ms[1]:.1f}x'))
+        library.audit.close()
+        library.pool.close_all()
+    report(f'{args.sessions} desk sessions of {args.items} books', rows)
+
+
+# ===== LIVE EVENTS =====
+def _serve_app(db_path, port, max_streams):
+    # Runs in a child process so its CPU time can be measured on its own
+    os.environ['LIBRARY_DB'] = db_path
+    os.environ['LIBRARY_EVENTS_MAX_STREAMS'] = str(max_streams)
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from app import app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def _cpu_seconds(pid):
+    # utime + stime of every thread in the process (Linux)
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('POST', '/login', urllib.parse.urlencode({'username': 'bench_librarian', 'password': 'bench'}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def _poll_client(port, cookie, interval, stop, commits, results):
+    """A dashboard polling /api/dashboard_stats every `interval` seconds on a keep-alive connection"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    time.sleep(random.random() * interval)
+    seen, requests, delays = None, 0, []
+    while not stop.is_set():
+        conn.request('GET', '/api/dashboard_stats', headers={'Cookie': cookie})
+        total = json.loads(conn.getresponse().read())['total_books']
+        requests += 1
+        if seen is not None and total != seen and total in commits:
+            delays.append(time.perf_counter() - commits[total])
+        seen = total
+        stop.wait(interval)
+    conn.close()
+    results.append((requests, delays))
+
+
+def _sse_client(port, cookie, stop, commits, results):
+    """A dashboard holding /api/events open and applying the stats events it is pushed"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/api/events', headers={'Cookie': cookie, 'Accept': 'text/event-stream'})
+    response = conn.getresponse()
+    events, delays = 0, []
+    while not stop.is_set():
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'data: '):
+            events += 1
+            total = json.loads(line[6:]).get('total_books')
+            if total in commits:
+                delays.append(time.perf_counter() - commits[total])
+    conn.close()
+    results.append((events, delays))
+
+
+def bench_events(args):
+    """Server CPU for N open dashboards: polling /api/dashboard_stats vs one SSE stream each"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        migrate(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO Users (Username, Password, Name, UserType) "
+                     "VALUES ('bench_librarian', 'bench', 'Bench Librarian', 'librarian')")
+        conn.commit()
+        conn.close()
+
+        for label in ('polling', 'server-sent events'):
+            port = _free_port()
+            server = multiprocessing.Process(target=_serve_app, args=(db_path, port, args.dashboards + 8))
+            server.start()
+            for _ in range(100):
+                try:
+                    cookie = _login(port)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            stop = threading.Event()
+            commits, results = {}, []
+            if label == 'polling':
+                clients = [threading.Thread(target=_poll_client,
+                                            args=(port, cookie, args.poll_interval, stop, commits, results))
+                           for _ in range(args.dashboards)]
+            else:
+                clients = [threading.Thread(target=_sse_client, args=(port, cookie, stop, commits, results))
+                           for _ in range(args.dashboards)]
+            for client in clients:
+                client.start()
+            # Server CPU from here on, after app startup and with every dashboard connected
+            cpu_before = _cpu_seconds(server.pid)
+
+            # Catalog changes at jittered intervals (so they don't phase-lock with the watcher), each
+            # bumping total_books
+            writer = sqlite3.connect(db_path)
+            changes = 0
+            deadline = time.perf_counter() + args.seconds
+            while time.perf_counter() < deadline:
+                time.sleep(args.change_interval * random.uniform(0.5, 1.5))
+                changes += 1
+                writer.execute("INSERT INTO Books VALUES (?, 'Title', 'Author', 'Fiction', 2000, 'Available')",
+                               (f'{label[:4]}{changes:08d}',))
+                writer.commit()
+                commits[writer.execute("SELECT Value FROM StatCounters WHERE Name = 'total_books'")
+                        .fetchone()[0]] = time.perf_counter()
+            writer.close()
+            # Let the last change reach every dashboard before hanging up
+            time.sleep(1)
+            cpu = _cpu_seconds(server.pid) - cpu_before
+            stop.set()
+            server.terminate()
+            server.join()
+            for client in clients:
+                client.join()
+
+            responses = sum(count for count, _ in results)
+            delays = sorted(delay for _, client_delays in results for delay in client_delays)
+            median = f'{delays[len(delays) // 2] * 1000:,.0f} ms' if delays else 'n/a'
+            rows.append((f'{label}: responses / events', f'{responses:>8,}'))
+            rows.append((f'{label}: server CPU', f'{cpu:8.2f} s  ({cpu / args.seconds * 100:.1f}% of a core)'))
+            rows.append((f'{label}: change -> dashboard', f'{median:>8} median'))
+    report(f'{args.dashboards} dashboards for {args.seconds:.0f} s, a change every {args.change_interval:g} s, '
+           f'polling every {args.poll_interval:g} s', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Library system performance benchmarks')
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    storage = sub.add_parser('storage', help=bench_storage.__doc__)
+    storage.add_argument('--workers', type=int, default=4)
+    storage.add_argument('--seconds', type=float, default=5)
+    storage.add_argument('--write-ratio', type=float, default=0.2)
+    storage.set_defaults(func=bench_storage)
+
+    search = sub.add_parser('search', help=bench_search.__doc__)
+    search.add_argument('--sizes', default='10000,100000,1000000')
+    search.add_argument('--limit', type=int, default=50)
+    search.add_argument('--repeat', type=int, default=5)
+    search.set_defaults(func=bench_search)
+
+    dashboard = sub.add_parser('dashboard', help=bench_dashboard.__doc__)
+    dashboard.add_argument('--loans', type=int, default=1000000)
+    dashboard.add_argument('--repeat', type=int, default=20)
+    dashboard.set_defaults(func=bench_dashboard)
+
+    bulk = sub.add_parser('import', help=bench_import.__doc__)
+    bulk.add_argument('--rows', type=int, default=200000)
+    bulk.add_argument('--chunk-sizes', default='500,5000')
+    bulk.set_defaults(func=bench_import)
+
+    digest = sub.add_parser('digest', help=bench_digest.__doc__)
+    digest.add_argument('--loans', type=int, default=100000)
+    digest.add_argument('--members', type=int, default=20000)
+    digest.set_defaults(func=bench_digest)
+
+    audit = sub.add_parser('audit', help=bench_audit.__doc__)
+    audit.add_argument('--actions', type=int, default=5000)
+    audit.set_defaults(func=bench_audit)
+
+    archive = sub.add_parser('audit-archive', help=bench_audit_archive.__doc__)
+    archive.add_argument('--rows', type=int, default=1000000)
+    archive.add_argument('--days', type=int, default=730)
+    archive.add_argument('--retention-days', type=int, default=90)
+    archive.add_argument('--repeat', type=int, default=20)
+    archive.set_defaults(func=bench_audit_archive)
+
+    broadcast = sub.add_parser('broadcast', help=bench_broadcast.__doc__)
+    broadcast.add_argument('--librarians', type=int, default=50)
+    broadcast.add_argument('--messages', type=int, default=500)
+    broadcast.set_defaults(func=bench_broadcast)
+
+    inbox = sub.add_parser('inbox', help=bench_inbox.__doc__)
+    inbox.add_argument('--messages', type=int, default=200000)
+    inbox.add_argument('--users', type=int, default=2000)
+    inbox.add_argument('--repeat', type=int, default=5)
+    inbox.set_defaults(func=bench_inbox)
+
+    events = sub.add_parser('events', help=bench_events.__doc__)
+    events.add_argument('--dashboards', type=int, default=50)
+    events.add_argument('--seconds', type=float, default=20)
+    events.add_argument('--poll-interval', type=float, default=2.0)
+    events.add_argument('--change-interval', type=float, default=2.0)
+    events.set_defaults(func=bench_events)
+
+    copies = sub.add_parser('copies', help=bench_copies.__doc__)
+    copies.add_argument('--titles', type=int, default=100000)
+    copies.add_argument('--repeat', type=int, default=5)
+    copies.set_defaults(func=bench_copies)
+
+    circulation = sub.add_parser('circulation', help=bench_circulation.__doc__)
+    circulation.add_argument('--sessions', type=int, default=20)
+    circulation.add_argument('--items', type=int, default=50)
+    circulation.set_defaults(func=bench_circulation)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Bulk Catalog Import
+===================
+
+Streams a catalog dump (CSV or JSON lines) into the Books table without
+reading the whole file into memory:
+
+- rows are parsed one at a time and validated; a bad row is recorded as a
+  per-row error (with its line number) and the import carries on
+- valid rows are written CHUNK_SIZE at a time with executemany, one
+  transaction per chunk, as INSERT ... ON CONFLICT(ISBN) upserts: existing
+  books get their catalog fields updated (or are skipped), and their
+  AvailabilityStatus is never touched
+- a progress callback receives the running ImportReport after every chunk
+
+The /bulk_import page (LibraryManager.import_catalog), bulk_import_books and
+the command line all go through import_books:
+
+    python bulk_import.py catalog.csv [--db library.db] [--skip-duplicates]
+    python bulk_import.py catalog.jsonl --format jsonl
+    gunzip -c dump.csv.gz | python bulk_import.py - --format csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import date
+
+BOOK_FIELDS = ('isbn', 'title', 'author', 'genre', 'publication_year')
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 5000
+# Errors beyond this are counted but their messages are dropped
+MAX_REPORTED_ERRORS = 1000
+
+ISBN_PATTERN = re.compile(r'^(\d{9}[\dX]|\d{13})$')
+
+UPSERT_SQL = {
+    'update': '''
+        INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus)
+        VALUES (?, ?, ?, ?, ?, 'Available')
+        ON CONFLICT(ISBN) DO UPDATE SET
+            Title = excluded.Title, Author = excluded.Author,
+            Genre = excluded.Genre, PublicationYear = excluded.PublicationYear
+    ''',
+    'skip': '''
+        INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus)
+        VALUES (?, ?, ?, ?, ?, 'Available')
+        ON CONFLICT(ISBN) DO NOTHING
+    ''',
+}
+
+
+class ImportReport:
+    """Running totals of an import"""
+
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []    # (line, message), at most MAX_REPORTED_ERRORS
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def tick(self):
+        self.elapsed = time.perf_counter() - self._started
+
+    @property
+    def rows_per_sec(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'elapsed_s': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'errors': [list(error) for error in self.errors],
+        }
+
+    def summary(self):
+        return (f'{self.processed:,} rows: {self.inserted:,} added, {self.updated:,} updated, '
+                f'{self.skipped:,} skipped, {self.failed:,} errors '
+                f'({self.elapsed:.1f}s, {self.rows_per_sec:,.0f} rows/s)')
+
+
+def detect_format(filename):
+    """'jsonl' for .jsonl/.ndjson/.json files, 'csv' otherwise"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def text_stream(stream):
+    """Wrap a binary upload/file in a UTF-8 text reader (a leading BOM is dropped)"""
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def read_records(stream, fmt='csv', has_headers=True):
+    """Yield (line number, record) from a text stream, one row at a time
+
+    CSV records are dicts keyed by the header row (or BOOK_FIELDS when there
+    is none). JSON-lines records are the raw line: it is decoded in
+    validate_book, so a malformed line is a row error rather than the end of
+    the import.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream, fieldnames=None if has_headers else BOOK_FIELDS)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_no, line
+    else:
+        raise ValueError(f'Unknown import format: {fmt}')
+
+
+def validate_book(record):
+    """Return the Books row (ISBN, Title, Author, Genre, PublicationYear) for a record, or raise ValueError"""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'invalid JSON: {e.msg}')
+        if not isinstance(record, dict):
+            raise ValueError('expected a JSON object')
+    fields = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+
+    def text(name):
+        value = fields.get(name)
+        return str(value).strip() if value is not None else ''
+
+    isbn = text('isbn')
+    if not isbn:
+        raise ValueError('missing isbn')
+    if not ISBN_PATTERN.match(re.sub(r'[\s-]', '', isbn).upper()):
+        raise ValueError(f'invalid isbn {isbn!r}')
+    title = text('title')
+    if not title:
+        raise ValueError('missing title')
+    author = text('author')
+    if not author:
+        raise ValueError('missing author')
+
+    year = text('publication_year') or text('year')
+    if year:
+        try:
+            year = int(year)
+        except ValueError:
+            raise ValueError(f'invalid publication_year {year!r}')
+        if not 0 < year <= date.today().year + 1:
+            raise ValueError(f'publication_year {year} out of range')
+    return isbn, title, author, text('genre') or None, year or None
+
+
+def _existing_isbns(conn, isbns):
+    rows = conn.execute('SELECT ISBN FROM Books WHERE ISBN IN (SELECT value FROM json_each(?))',
+                        (json.dumps(isbns),))
+    return {row[0] for row in rows}
+
+
+def _write_chunk(conn, chunk, on_conflict, report):
+    """Upsert one chunk of (line, row) in a single transaction"""
+    sql = UPSERT_SQL[on_conflict]
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        seen = _existing_isbns(conn, [row[0] for _, row in chunk])
+        try:
+            conn.executemany(sql, [row for _, row in chunk])
+            written = chunk
+        except sqlite3.IntegrityError:
+            # Something in the chunk was rejected by the database: redo it row by row
+            # so the good rows still land and the bad ones are reported individually
+            conn.rollback()
+            conn.execute('BEGIN IMMEDIATE')
+            written = []
+            for line, row in chunk:
+                try:
+                    conn.execute(sql, row)
+                except sqlite3.IntegrityError as e:
+                    report.add_error(line, str(e))
+                else:
+                    written.append((line, row))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for _, row in written:
+        if row[0] not in seen:
+            report.inserted += 1
+            seen.add(row[0])
+        elif on_conflict == 'update':
+            report.updated += 1
+        else:
+            report.skipped += 1
+
+
+def import_books(conn, records, on_conflict='update', chunk_size=CHUNK_SIZE, progress=None):
+    """Validate and upsert (line number, record) pairs into Books; returns an ImportReport
+
+    on_conflict is 'update' (overwrite the catalog fields of an existing ISBN)
+    or 'skip' (leave existing books alone). progress(report) is called after
+    every chunk is committed.
+    """
+    if on_conflict not in UPSERT_SQL:
+        raise ValueError(f'on_conflict must be one of {", ".join(UPSERT_SQL)}')
+    report = ImportReport()
+    chunk = []
+    for line, record in records:
+        report.processed += 1
+        try:
+            chunk.append((line, validate_book(record)))
+        except ValueError as e:
+            report.add_error(line, str(e))
+        if len(chunk) >= chunk_size:
+            _write_chunk(conn, chunk, on_conflict, report)
+            chunk = []
+            report.tick()
+            if progress:
+                progress(report)
+    if chunk:
+        _write_chunk(conn, chunk, on_conflict, report)
+    report.tick()
+    if progress:
+        progress(report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a CSV or JSON-lines catalog dump into Books')
+    parser.add_argument('file', help="CSV/JSON-lines file, or '-' for stdin")
+    parser.add_argument('--db', default=os.environ.get('LIBRARY_DB', 'library.db'))
+    parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+    parser.add_argument('--no-headers', action='store_true',
+                        help=f'CSV has no header row (columns: {",".join(BOOK_FIELDS)})')
+    parser.add_argument('--skip-duplicates', action='store_true', help='Leave existing ISBNs unchanged')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from app import LibraryManager
+    from migrations import migrate
+    migrate(args.db)
+    library = LibraryManager(args.db)
+
+    fmt = args.format or detect_format(args.file)
+    binary = sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')
+
+    def show_progress(report):
+        print(f'\r  {report.processed:>12,} rows  {report.rows_per_sec:>10,.0f} rows/s  '
+              f'{report.failed:,} errors', end='', file=sys.stderr, flush=True)
+
+    with binary:
+        report = library.import_catalog(text_stream(binary), fmt, has_headers=not args.no_headers,
+                                      skip_duplicates=args.skip_duplicates, filename=args.file,
+                                      chunk_size=args.chunk_size, progress=show_progress)
+    print(file=sys.stderr)
+    for line, message in report.errors:
+        print(f'  line {line}: {message}')
+    if report.failed > len(report.errors):
+        print(f'  ... and {report.failed - len(report.errors):,} more')
+    print(f"{'⚠️' if report.failed else '✅'} {report.summary()}")
+    sys.exit(1 if report.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Query Result Cache
+==================
+
+Read-mostly LibraryManager queries (system settings, member tiers, book
+categories, announcements) are cached in-process with a
+per-entry TTL, LRU eviction and a bound on the number of entries.
+
+Invalidation is by tag. Every entry remembers the generation of each tag it
+depends on when it was loaded; a write bumps the generation of the tags it
+affects and any entry holding an older generation is treated as a miss.
+Where the generations live is the pluggable part:
+
+- LocalGenerations: a dict, visible to this process only
+- SharedGenerations: counters in a memory-mapped file next to the database,
+  so a write handled by one gunicorn worker invalidates the entry in every
+  worker on its next read
+
+Writes that bypass LibraryManager (scripts editing the database directly)
+are only picked up when the TTL runs out.
+
+Configured with LIBRARY_CACHE_BACKEND=shared|local (shared by default where
+fcntl is available) and LIBRARY_CACHE_MAX_ENTRIES.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, fall back to per-process generations
+    fcntl = None
+
+
+class LocalGenerations:
+    """Tag generations kept in this process"""
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, tag):
+        return self._generations.get(tag, 0)
+
+    def bump(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+
+class SharedGenerations:
+    """Tag generations in a memory-mapped file shared by every process using it
+
+    Tags hash into a fixed number of 8-byte slots; two tags sharing a slot
+    only means one invalidates the other's entries too.
+    """
+
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._lock = threading.Lock()
+
+    def _offset(self, tag):
+        return (zlib.crc32(tag.encode('utf-8')) % self.slots) * self.SLOT.size
+
+    def get(self, tag):
+        return self.SLOT.unpack_from(self._map, self._offset(tag))[0]
+
+    def bump(self, tag):
+        offset = self._offset(tag)
+        # Thread lock for this process, file lock against the other workers
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self.SLOT.pack_into(self._map, offset, self.SLOT.unpack_from(self._map, offset)[0] + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class QueryCache:
+    """Bounded TTL + LRU cache with tag-generation invalidation"""
+
+    def __init__(self, max_entries=1024, generations=None):
+        self.max_entries = max_entries
+        self.generations = generations if generations is not None else LocalGenerations()
+        self._entries = OrderedDict()   # key -> (value, expires_at, ((tag, generation), ...))
+        self._lock = threading.Lock()
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stale': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def get_or_load(self, key, loader, ttl, tags=()):
+        """Return the cached value for key, calling loader() on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, generations = entry
+                if expires_at <= now:
+                    self._metrics['expired'] += 1
+                elif any(self.generations.get(tag) != gen for tag, gen in generations):
+                    self._metrics['stale'] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._metrics['hits'] += 1
+                    return value
+                del self._entries[key]
+            self._metrics['misses'] += 1
+
+        # Snapshot generations before loading: a write that lands during the
+        # load bumps them, so the entry stored below is already stale
+        generations = tuple((tag, self.generations.get(tag)) for tag in tags)
+        value = loader()
+        with self._lock:
+            self._entries[key] = (value, now + ttl, generations)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._metrics['evictions'] += 1
+        return value
+
+    def invalidate(self, *tags):
+        """Invalidate every entry depending on any of the tags, in all processes sharing the generations"""
+        for tag in tags:
+            self.generations.bump(tag)
+        with self._lock:
+            self._metrics['invalidations'] += len(tags)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Snapshot of cache metrics"""
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+            stats['backend'] = 'shared' if isinstance(self.generations, SharedGenerations) else 'local'
+            return stats
+
+
+def cached(namespace, ttl, tags=None):
+    """Cache a LibraryManager method's result in self.cache
+
+    The key is the namespace plus the call arguments. `tags` maps the call
+    arguments to the invalidation tags of the entry (default: the namespace).
+    Lists are copied on the way out so callers can't modify the cached value.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (namespace, args, tuple(sorted(kwargs.items())))
+            entry_tags = tags(*args, **kwargs) if tags else (namespace,)
+            value = self.cache.get_or_load(key, lambda: method(self, *args, **kwargs), ttl, entry_tags)
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_name='library.db'):
+    """Return the process-wide cache for a database file, creating it on first use"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else db_name
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            backend = os.environ.get('LIBRARY_CACHE_BACKEND', 'shared' if fcntl else 'local')
+            if backend == 'shared' and fcntl and db_name != ':memory:':
+                generations = SharedGenerations(f'{key}-cache')
+            else:
+                generations = LocalGenerations()
+            cache = QueryCache(int(os.environ.get('LIBRARY_CACHE_MAX_ENTRIES', 1024)), generations)
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,71 @@
+"""
+Catalog Full-Text Search
+========================
+
+Books are indexed in the BooksFTS virtual table (FTS5, external content on
+Books, kept in sync by triggers created in migrations.py). The tokenizer
+folds case and diacritics, so "miserables" finds "Les Misérables" and
+"bronte" finds "Charlotte Brontë".
+
+User input is never passed to MATCH as-is: it is split into word tokens,
+each token is quoted and turned into a prefix query, so "harr pot" becomes
+"harr"* "pot"* (both prefixes must match, in any column).
+"""
+
+import re
+
+# Column weights for bm25(): a hit in the title counts most, then author, then genre
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Markers emitted by highlight(); the |highlight template filter escapes the
+# text and turns them into <mark> tags
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def match_expression(term, column=None):
+    """Build a safe FTS5 MATCH expression for free text, or None if it has no words"""
+    tokens = _TOKEN_RE.findall(term or '')
+    if not tokens:
+        return None
+    expression = ' '.join(f'"{token}"*' for token in tokens)
+    if column:
+        return f'{column} : ({expression})'
+    return expression
+
+
+def search_sql(conditions=(), limit=None):
+    """SELECT for a ranked catalog search
+
+    Bind the MATCH expression first, then any parameters used by the extra
+    `conditions` (SQL snippets on the Books alias `b`). Columns 0-5 match
+    `SELECT * FROM Books` (ISBN, Title, Author, Genre, PublicationYear,
+    AvailabilityStatus); 6 and 7 are the highlighted title and author.
+    """
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    sql = f'''
+        SELECT b.ISBN, b.Title, b.Author, b.Genre, b.PublicationYear, b.AvailabilityStatus,
+               highlight(BooksFTS, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}') AS TitleHighlight,
+               highlight(BooksFTS, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}') AS AuthorHighlight
+        FROM BooksFTS
+        JOIN Books b ON b.rowid = BooksFTS.rowid
+        WHERE BooksFTS MATCH ?
+    '''
+    for condition in conditions:
+        sql += f' AND {condition}'
+    sql += f' ORDER BY bm25(BooksFTS, {weights})'
+    if limit:
+        sql += f' LIMIT {int(limit)}'
+    return sql
+
+
+def render_highlight(text):
+    """Escape text for HTML and turn highlight markers into <mark> tags"""
+    from markupsafe import Markup, escape
+    if text is None:
+        return ''
+    escaped = str(escape(text))
+    return Markup(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
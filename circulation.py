@@ -0,0 +1,169 @@
+"""
+Batch Circulation
+=================
+
+A desk scanning session checks out or returns a whole stack of books in one
+request instead of one /quick_loan POST or /return_book GET per book, each
+with its own connection, transaction, audit write and redirect.
+process_batch runs the items in order inside the caller's transaction
+(LibraryManager.circulate_batch wraps it in one BEGIN IMMEDIATE):
+
+- an item is {'action': 'checkout' | 'return', 'code': barcode or ISBN,
+  'member_id': ...}; a barcode names one copy, an ISBN any copy of the title
+  (checkout) or the member's oldest open loan of it (return)
+- copies are claimed and loans closed with the same conditional statements
+  as single loans and returns, so a batch racing another desk never lends a
+  copy twice or returns a loan twice
+- an item that can't be done gets a failed result and the rest carry on
+- return confirmations (queued in the outbox, see outbox.py), hold-ready
+  notices and audit entries for the whole batch are written with
+  executemany at the end
+"""
+
+from datetime import datetime, timedelta
+
+from audit import audit_row
+from copies import checkout_copy, close_loan
+from holds import allocate_copies, claim_held_copy, notify_ready
+from outbox import enqueue_many
+
+ACTIONS = ('checkout', 'return')
+MAX_BATCH_ITEMS = 500
+
+LOAN_DETAILS_SQL = '''
+    SELECT l.BookID, l.CopyBarcode, b.Title, b.Author, m.Name, u.UserID
+    FROM Loans l
+    JOIN Books b ON l.BookID = b.ISBN
+    JOIN Members m ON l.MemberID = m.MemberID
+    LEFT JOIN Users u ON m.MemberID = u.MemberID
+    WHERE l.LoanID = ?
+'''
+
+def _copy_isbn(cursor, code):
+    """The ISBN of the copy with barcode `code`, or None if `code` isn't a barcode"""
+    cursor.execute('SELECT ISBN FROM Copies WHERE Barcode = ?', (code,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _checkout(cursor, code, member_id, loan_date, due_date):
+    """Lend one copy; returns (message, LoanID, barcode, ISBN), LoanID None if it couldn't be lent"""
+    isbn = _copy_isbn(cursor, code)
+    if isbn is None:
+        # An ISBN: the copy held for the member, else any copy on the shelf
+        isbn = code
+        barcode = claim_held_copy(cursor, isbn, member_id) or checkout_copy(cursor, isbn)
+        if barcode is None:
+            cursor.execute('SELECT 1 FROM Books WHERE ISBN = ?', (isbn,))
+            return ('Book is not available!' if cursor.fetchone() else 'Book not found!'), None, None, isbn
+    else:
+        # A barcode: that copy, if it is on the shelf or held for this member
+        barcode = code
+        cursor.execute('''
+            UPDATE BookReservations SET Status = 'fulfilled'
+            WHERE MemberID = ? AND Status = 'active' AND CopyBarcode = ?
+            RETURNING ReservationID
+        ''', (member_id, barcode))
+        state = 'held' if cursor.fetchall() else 'available'
+        cursor.execute("UPDATE Copies SET State = 'loaned' WHERE Barcode = ? AND State = ? RETURNING Barcode",
+                       (barcode, state))
+        if not cursor.fetchall():
+            return 'Copy is not available!', None, barcode, isbn
+
+    cursor.execute('''
+        INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, CopyBarcode)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (isbn, member_id, loan_date, due_date, barcode))
+    return f'Loaned until {due_date}', cursor.lastrowid, barcode, isbn
+
+
+def _find_open_loan(cursor, code, member_id):
+    """LoanID of the open loan a returned `code` belongs to, or None"""
+    if member_id is None:
+        cursor.execute('SELECT LoanID FROM Loans WHERE CopyBarcode = ? AND ReturnDate IS NULL', (code,))
+    else:
+        cursor.execute('SELECT LoanID FROM Loans WHERE CopyBarcode = ? AND ReturnDate IS NULL AND MemberID = ?',
+                       (code, member_id))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute('''
+        SELECT LoanID FROM Loans
+        WHERE BookID = ? AND ReturnDate IS NULL AND (? IS NULL OR MemberID = ?)
+        ORDER BY LoanDate, LoanID LIMIT 1
+    ''', (code, member_id, member_id))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def process_batch(cursor, items, user_id, hold_days, loan_days=14):
+    """Check out and return `items` in order in the caller's transaction;
+    returns (results, audit rows), one result dict per item"""
+    loan_date = datetime.now().strftime('%Y-%m-%d')
+    due_date = (datetime.now() + timedelta(days=loan_days)).strftime('%Y-%m-%d')
+    members = {}
+    results, audit_rows, confirmations, allocations = [], [], [], []
+
+    for index, item in enumerate(items):
+        action = item.get('action')
+        code = str(item.get('code') or '').strip()
+        member_id = item.get('member_id')
+        result = {'index': index, 'action': action, 'code': code, 'success': False,
+                  'loan_id': None, 'barcode': None, 'isbn': None}
+        results.append(result)
+        if action not in ACTIONS:
+            result['message'] = 'Unknown action!'
+            continue
+        if not code:
+            result['message'] = 'Missing ISBN or barcode!'
+            continue
+        try:
+            member_id = int(member_id) if member_id not in (None, '') else None
+        except (TypeError, ValueError):
+            result['message'] = 'Invalid member ID!'
+            continue
+
+        if action == 'checkout':
+            if member_id is None:
+                result['message'] = 'Missing member ID!'
+                continue
+            if member_id not in members:
+                cursor.execute('SELECT Name FROM Members WHERE MemberID = ?', (member_id,))
+                row = cursor.fetchone()
+                members[member_id] = row[0] if row else None
+            if members[member_id] is None:
+                result['message'] = 'Member not found!'
+                continue
+            message, loan_id, barcode, isbn = _checkout(cursor, code, member_id, loan_date, due_date)
+            result.update(message=message, loan_id=loan_id, barcode=barcode, isbn=isbn, success=loan_id is not None)
+            if loan_id is not None:
+                audit_rows.append(audit_row(user_id, f'Batch loan: {isbn} ({barcode}) to member {member_id}',
+                                            'Loans', loan_id))
+            continue
+
+        loan_id = _find_open_loan(cursor, code, member_id)
+        details = None
+        if loan_id is not None:
+            cursor.execute(LOAN_DETAILS_SQL, (loan_id,))
+            details = cursor.fetchone()
+        if details is None:
+            result['message'] = 'No open loan found!'
+            continue
+        isbn, barcode, title, author, member_name, student_user_id = details
+        result.update(loan_id=loan_id, barcode=barcode, isbn=isbn)
+        # Conditional, like a single return: a loan is only ever closed once
+        if not close_loan(cursor, loan_id):
+            result['message'] = 'This loan has already been returned!'
+            continue
+        allocations.extend(allocate_copies(cursor, isbn, hold_days))
+        if student_user_id:
+            confirmations.append(('return_confirmation', {
+                'member_name': member_name, 'title': title, 'author': author, 'isbn': isbn, 'return_date': loan_date
+            }, student_user_id, None, user_id))
+        audit_rows.append(audit_row(user_id, f'Book returned: {title} by {member_name} (LoanID {loan_id})',
+                                    'Loans', loan_id))
+        result.update(message='Returned', success=True)
+
+    notify_ready(cursor, allocations, user_id)
+    enqueue_many(cursor, confirmations)
+    return results, audit_rows
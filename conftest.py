@@ -0,0 +1,38 @@
+"""
+Shared test fixtures: a freshly migrated library and logged-in test clients
+"""
+import pytest
+
+import app as app_module
+from app import LibraryManager
+from migrations import migrate
+
+
+@pytest.fixture
+def migrated_library(tmp_path, monkeypatch):
+    """An empty, fully migrated library; test files add their own seed rows"""
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    library = LibraryManager(db_path)
+    # The routes use the module-level manager
+    monkeypatch.setattr(app_module, 'library', library)
+    return library
+
+
+@pytest.fixture
+def client_for():
+    """Builds a test client whose session is logged in as the given user"""
+    def client_for(user_id, user_type, member_id=None):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['user_type'] = user_type
+            session['member_id'] = member_id
+        return client
+    return client_for
+
+
+@pytest.fixture
+def librarian_client(client_for):
+    """A client logged in as librarian 101 (seeded by the test files that use it)"""
+    return client_for(101, 'librarian')
@@ -0,0 +1,143 @@
+"""
+Book Copies
+===========
+
+Books has one row per title (ISBN); each physical copy on the shelves is a
+Copies row with its own barcode, location and state ('available',
+'loaned', 'held' for a reservation (see holds.py), 'lost'). CopyCounts
+keeps TotalCount/AvailableCount per ISBN with triggers on Copies, so they
+change in the same transaction as the loan or return that moved a copy, and:
+
+- catalog availability is a primary-key lookup on CopyCounts,
+- low-stock detection is a range scan of idx_copy_counts_available,
+- loan_book picks a copy through idx_copies_isbn_state.
+
+Books.AvailabilityStatus is derived from the counts ('Available' while any
+copy is on the shelf, 'Loaned' otherwise), so the catalog queries, their
+partial index and the stat counters keep working unchanged. Every new Books
+row gets a first copy, '<ISBN>-1', from a trigger; add_copies adds more.
+"""
+
+
+def create_copies_schema(cursor):
+    """Copies, CopyCounts and their triggers; backfills one copy per book and links open loans to it"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Copies (
+            Barcode TEXT PRIMARY KEY,
+            ISBN TEXT NOT NULL,
+            Location TEXT,
+            State TEXT NOT NULL DEFAULT 'available',
+            AddedDate DATE DEFAULT (date('now')),
+            FOREIGN KEY (ISBN) REFERENCES Books (ISBN)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_copies_isbn_state ON Copies(ISBN, State, Barcode)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CopyCounts (
+            ISBN TEXT PRIMARY KEY,
+            TotalCount INTEGER NOT NULL DEFAULT 0,
+            AvailableCount INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_copy_counts_available ON CopyCounts(AvailableCount)')
+    cursor.execute('PRAGMA table_info(Loans)')
+    if 'CopyBarcode' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE Loans ADD COLUMN CopyBarcode TEXT')
+
+    # Counts follow the copies
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_copies_insert AFTER INSERT ON Copies BEGIN
+            INSERT INTO CopyCounts (ISBN, TotalCount, AvailableCount) VALUES (NEW.ISBN, 1, NEW.State = 'available')
+            ON CONFLICT (ISBN) DO UPDATE SET TotalCount = TotalCount + 1,
+                                             AvailableCount = AvailableCount + excluded.AvailableCount;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_copies_delete AFTER DELETE ON Copies BEGIN
+            UPDATE CopyCounts SET TotalCount = TotalCount - 1, AvailableCount = AvailableCount - (OLD.State = 'available')
+            WHERE ISBN = OLD.ISBN;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_copies_update AFTER UPDATE OF ISBN, State ON Copies
+        WHEN OLD.ISBN IS NOT NEW.ISBN OR OLD.State IS NOT NEW.State BEGIN
+            UPDATE CopyCounts SET TotalCount = TotalCount - 1, AvailableCount = AvailableCount - (OLD.State = 'available')
+            WHERE ISBN = OLD.ISBN;
+            INSERT INTO CopyCounts (ISBN, TotalCount, AvailableCount) VALUES (NEW.ISBN, 1, NEW.State = 'available')
+            ON CONFLICT (ISBN) DO UPDATE SET TotalCount = TotalCount + 1,
+                                             AvailableCount = AvailableCount + excluded.AvailableCount;
+        END
+    ''')
+
+    # The title's status follows its counts; Books is only written when it actually flips
+    for event in ('INSERT', 'UPDATE OF AvailableCount'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_copy_counts_status_{event.split()[0].lower()} AFTER {event} ON CopyCounts
+            BEGIN
+                UPDATE Books SET AvailabilityStatus = CASE WHEN NEW.AvailableCount > 0 THEN 'Available' ELSE 'Loaned' END
+                WHERE ISBN = NEW.ISBN
+                  AND AvailabilityStatus IS NOT CASE WHEN NEW.AvailableCount > 0 THEN 'Available' ELSE 'Loaned' END;
+            END
+        ''')
+
+    # Every title starts with one copy; deleting a title removes its copies
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_books_first_copy AFTER INSERT ON Books BEGIN
+            INSERT OR IGNORE INTO Copies (Barcode, ISBN, State)
+            VALUES (NEW.ISBN || '-1', NEW.ISBN,
+                    CASE WHEN NEW.AvailabilityStatus = 'Available' THEN 'available' ELSE 'loaned' END);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_books_delete_copies AFTER DELETE ON Books BEGIN
+            DELETE FROM Copies WHERE ISBN = OLD.ISBN;
+            DELETE FROM CopyCounts WHERE ISBN = OLD.ISBN;
+        END
+    ''')
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO Copies (Barcode, ISBN, State)
+        SELECT ISBN || '-1', ISBN, CASE WHEN AvailabilityStatus = 'Available' THEN 'available' ELSE 'loaned' END
+        FROM Books
+    ''')
+    cursor.execute("UPDATE Loans SET CopyBarcode = BookID || '-1' WHERE ReturnDate IS NULL AND CopyBarcode IS NULL")
+
+
+def checkout_copy(cursor, isbn):
+    """Take an available copy of `isbn` off the shelf; returns its barcode, or None if none is available"""
+    cursor.execute('''
+        UPDATE Copies SET State = 'loaned'
+        WHERE Barcode = (SELECT Barcode FROM Copies WHERE ISBN = ? AND State = 'available' ORDER BY Barcode LIMIT 1)
+        RETURNING Barcode
+    ''', (isbn,))
+    rows = cursor.fetchall()
+    return rows[0][0] if rows else None
+
+
+def close_loan(cursor, loan_id):
+    """Return an open loan: put its copy back on the shelf and set ReturnDate; False if it wasn't open"""
+    cursor.execute('''
+        UPDATE Copies SET State = 'available'
+        WHERE Barcode = (SELECT CopyBarcode FROM Loans WHERE LoanID = ? AND ReturnDate IS NULL) AND State = 'loaned'
+    ''', (loan_id,))
+    cursor.execute("UPDATE Loans SET ReturnDate = date('now') WHERE LoanID = ? AND ReturnDate IS NULL", (loan_id,))
+    return cursor.rowcount == 1
+
+
+def add_copies(cursor, isbn, count, location=None):
+    """Add `count` copies of `isbn`, barcoded <ISBN>-<n> after its highest existing number"""
+    cursor.execute('''
+        SELECT COALESCE(MAX(CAST(substr(Barcode, length(ISBN) + 2) AS INTEGER)), 0)
+        FROM Copies WHERE ISBN = ?
+    ''', (isbn,))
+    first = cursor.fetchone()[0] + 1
+    barcodes = [f'{isbn}-{number}' for number in range(first, first + count)]
+    cursor.executemany('INSERT INTO Copies (Barcode, ISBN, Location) VALUES (?, ?, ?)',
+                       [(barcode, isbn, location) for barcode in barcodes])
+    return barcodes
+
+
+def copy_counts(conn, isbn):
+    """(available, total) copies of `isbn`"""
+    row = conn.execute('SELECT AvailableCount, TotalCount FROM CopyCounts WHERE ISBN = ?', (isbn,)).fetchone()
+    return row if row else (0, 0)
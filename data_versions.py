@@ -0,0 +1,56 @@
+"""
+Table Versions
+==============
+
+TableVersions holds one counter per table that triggers bump on every
+INSERT, UPDATE and DELETE. Reading the counters of the tables a JSON
+endpoint depends on is a single primary-key lookup, so the endpoint can
+answer a conditional GET (If-None-Match) with 304 Not Modified without
+running its queries. The counters live in the database file, so every
+gunicorn worker computes the same ETag for the same data (PRAGMA
+data_version, by contrast, is private to each connection).
+
+The tag also covers date('now'), because overdue flags and "last 7 days"
+windows change at midnight without any write.
+"""
+
+import hashlib
+
+TRACKED_TABLES = ('Books', 'Members', 'Loans', 'BookReservations', 'Fines', 'Messages', 'MessageRecipients',
+                  'Users')
+
+
+def create_version_triggers(cursor):
+    """Create TableVersions and the triggers that bump it"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS TableVersions (
+            Name TEXT PRIMARY KEY,
+            Version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in TRACKED_TABLES:
+        cursor.execute('INSERT OR IGNORE INTO TableVersions (Name, Version) VALUES (?, 0)', (table,))
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{operation.lower()} AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE TableVersions SET Version = Version + 1 WHERE Name = '{table}';
+                END
+            ''')
+
+
+def read_versions(conn, tables):
+    """(date('now'), {table: version}) for the given tables"""
+    placeholders = ', '.join('?' * len(tables))
+    versions = dict(conn.execute(f'''
+        SELECT Name, Version FROM TableVersions WHERE Name IN ({placeholders})
+        UNION ALL SELECT '', date('now')
+    ''', tables).fetchall())
+    return versions.pop(''), versions
+
+
+def make_etag(conn, tables, *extra):
+    """Opaque tag for the current versions of `tables`, today's date and any extra key parts"""
+    today, versions = read_versions(conn, tables)
+    key = repr((today, [versions.get(table) for table in tables], extra))
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
@@ -0,0 +1,377 @@
+"""
+SQLite Connection Pool
+======================
+
+Shared connection layer for LibraryManager and the Flask routes.
+
+Connections are opened once and handed out again instead of running
+sqlite3.connect() / close() for every query. The pool is:
+
+- per-worker: a gunicorn worker that was forked from a parent holding
+  connections throws the inherited ones away and starts fresh
+- per-thread friendly: idle connections are reused LIFO, so a thread that
+  releases a connection and asks again straight away gets the same one back
+- bounded: at most `max_size` connections are open; callers beyond that wait
+- health checked: connections idle longer than `health_check_interval`
+  are pinged with SELECT 1 before being handed out
+
+Existing code keeps working unchanged: `conn.close()` on a pooled connection
+returns it to the pool instead of closing it.
+
+Every new connection gets the storage-engine profile applied (WAL journal,
+synchronous level, cache/mmap sizes, temp_store, busy_timeout). Defaults are
+in STORAGE_PROFILE and each can be overridden with an environment variable,
+e.g. LIBRARY_DB_SYNCHRONOUS=FULL or LIBRARY_DB_BUSY_TIMEOUT=10000.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Storage-engine profile applied to every pooled connection
+STORAGE_PROFILE = {
+    'journal_mode': 'WAL',      # readers never block the writer and vice versa
+    'synchronous': 'NORMAL',    # durable across app crashes; fsync only on checkpoint in WAL
+    'cache_size': -16000,       # negative = KiB, so ~16 MB page cache per connection
+    'mmap_size': 134217728,     # 128 MB memory-mapped reads
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,       # ms to wait on a locked database before "database is locked"
+}
+
+# Values PRAGMA reports back as numbers
+_PRAGMA_NAMES = {
+    'synchronous': {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'},
+    'temp_store': {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'},
+}
+
+
+def load_storage_profile(overrides=None):
+    """Return the storage profile with LIBRARY_DB_<SETTING> env vars and overrides applied"""
+    profile = dict(STORAGE_PROFILE)
+    for key, default in STORAGE_PROFILE.items():
+        value = os.environ.get(f'LIBRARY_DB_{key.upper()}')
+        if value is not None:
+            profile[key] = int(value) if isinstance(default, int) else value.upper()
+    if overrides:
+        profile.update(overrides)
+    return profile
+
+
+def apply_storage_profile(conn, profile):
+    """Apply a storage profile to an open connection"""
+    # busy_timeout first so switching journal mode can itself wait for a lock
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    if conn.execute('PRAGMA journal_mode').fetchone()[0].upper() != str(profile['journal_mode']).upper():
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+
+
+def read_storage_settings(conn):
+    """Read back the storage settings actually in effect on a connection"""
+    settings = {}
+    for key in STORAGE_PROFILE:
+        value = conn.execute(f'PRAGMA {key}').fetchone()[0]
+        settings[key] = _PRAGMA_NAMES.get(key, {}).get(value, value)
+    if isinstance(settings['journal_mode'], str):
+        settings['journal_mode'] = settings['journal_mode'].upper()
+    return settings
+
+
+def check_storage_profile(pool):
+    """Startup check: compare requested profile with what SQLite reports
+
+    Returns (ok, report) where report maps each setting to
+    {'requested': ..., 'effective': ...}. mmap_size may legitimately be
+    capped by the SQLite build, so it never fails the check.
+    """
+    with pool.connection() as conn:
+        effective = read_storage_settings(conn)
+    report = {}
+    ok = True
+    for key, requested in pool.profile.items():
+        wanted = str(requested).upper() if isinstance(requested, str) else requested
+        report[key] = {'requested': wanted, 'effective': effective[key]}
+        if key != 'mmap_size' and effective[key] != wanted:
+            ok = False
+    return ok, report
+
+
+def run_immediate(conn, work, retries=3, backoff=0.05):
+    """Run work(cursor) in a BEGIN IMMEDIATE transaction, commit, and return its result
+
+    BEGIN IMMEDIATE takes the write lock before anything is read (waiting up to
+    busy_timeout for it), so whatever work() checks stays true until it commits.
+    If the database is still locked the transaction is rolled back and retried
+    after a jittered backoff, at most `retries` more times. Any other error
+    rolls back and propagates.
+    """
+    for attempt in range(retries + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            result = work(cursor)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if attempt == retries or ('locked' not in str(e) and 'busy' not in str(e)):
+                raise
+        except BaseException:
+            conn.rollback()
+            raise
+        time.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no connection became free within the checkout timeout"""
+
+
+class PooledConnection:
+    """Proxy around a sqlite3.Connection that releases to its pool on close()"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        setattr(conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Same semantics as sqlite3.Connection: commit or roll back, keep open
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def raw(self):
+        """The underlying sqlite3.Connection"""
+        return self._conn
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)"""
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        self._pool._release(conn)
+
+    def __del__(self):
+        # Safety net for code paths that raise before reaching conn.close()
+        try:
+            conn = object.__getattribute__(self, '_conn')
+        except AttributeError:
+            return
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool._release(conn, reclaimed=True)
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections for one database file"""
+
+    def __init__(self, db_name, max_size=8, timeout=10.0, health_check_interval=30.0, profile=None):
+        self.db_name = db_name
+        self.profile = profile if profile is not None else load_storage_profile()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        # Re-entrant so a PooledConnection reclaimed by the GC mid-acquire can't deadlock
+        self._lock = threading.Condition(threading.RLock())
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []          # [(sqlite3.Connection, released_at)], most recent last
+        self._open_count = 0
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'opens': 0,
+            'closes': 0,
+            'health_check_failures': 0,
+            'reclaimed': 0,
+        }
+
+    def _check_fork(self):
+        # A forked worker must never share SQLite handles with its parent
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False,
+                               timeout=self.profile['busy_timeout'] / 1000.0)
+        try:
+            apply_storage_profile(conn, self.profile)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._metrics['closes'] += 1
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up"""
+        deadline = None
+        waited_since = None
+        with self._lock:
+            self._check_fork()
+            while True:
+                while self._idle:
+                    conn, released_at = self._idle.pop()
+                    if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(conn):
+                        break
+                    self._metrics['health_check_failures'] += 1
+                    self._open_count -= 1
+                    self._discard(conn)
+                else:
+                    conn = None
+
+                if conn is not None:
+                    return self._check_out(conn, waited_since)
+
+                if self._open_count < self.max_size:
+                    # Reserve the slot and open the connection outside the lock: setting the
+                    # journal mode can wait out busy_timeout, and nobody else should wait with it
+                    self._open_count += 1
+                    break
+
+                # Pool exhausted: wait for a release
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    waited_since = now
+                    self._metrics['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection available after {self.timeout}s '
+                        f'({self.max_size} in use)')
+                self._lock.wait(remaining)
+
+        try:
+            conn = self._open()
+        except Exception:
+            with self._lock:
+                self._open_count -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._metrics['opens'] += 1
+            return self._check_out(conn, waited_since)
+
+    def _check_out(self, conn, waited_since):
+        """Called with the lock held: count a checkout and wrap conn"""
+        self._metrics['checkouts'] += 1
+        if waited_since is not None:
+            self._metrics['wait_time'] += time.monotonic() - waited_since
+        return PooledConnection(self, conn)
+
+    def _release(self, conn, reclaimed=False):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited from the parent process; just drop the reference
+                return
+            if reclaimed:
+                self._metrics['reclaimed'] += 1
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.row_factory = None
+            except sqlite3.Error:
+                self._open_count -= 1
+                self._discard(conn)
+                self._lock.notify()
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always releases it"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close_all(self):
+        """Close every idle connection; checked-out connections are left alone"""
+        with self._lock:
+            self._check_fork()
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._open_count -= 1
+                self._discard(conn)
+
+    def stats(self):
+        """Snapshot of pool metrics"""
+        with self._lock:
+            self._check_fork()
+            stats = dict(self._metrics)
+            stats['wait_time'] = round(stats['wait_time'], 6)
+            stats['open'] = self._open_count
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open_count - len(self._idle)
+            stats['max_size'] = self.max_size
+            return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name='library.db'):
+    """Return the process-wide pool for a database file, creating it on first use"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else db_name
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                db_name,
+                max_size=int(os.environ.get('LIBRARY_DB_POOL_SIZE', 8)),
+                timeout=float(os.environ.get('LIBRARY_DB_POOL_TIMEOUT', 10.0)),
+            )
+            _pools[key] = pool
+        return pool
+
+
+if __name__ == '__main__':
+    import sys
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'library.db'
+    ok, report = check_storage_profile(get_pool(db_path))
+    for key, value in report.items():
+        marker = '✅' if value['requested'] == value['effective'] or key == 'mmap_size' else '❌'
+        print(f"{marker} {key:<13} requested={value['requested']!s:<10} effective={value['effective']}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,307 @@
+"""
+Live Events
+===========
+
+Pages that used to poll (dashboard stats, inboxes, audit log, announcements,
+reservations) hold one Server-Sent Events stream, /api/events, and are
+pushed an event only when the data behind them has changed.
+
+- EventHub is the in-process bus: publish() appends to a short replay ring
+  and wakes the open streams, each of which forwards the events addressed
+  to its user ('all', their user type, or 'user:<id>'). A reconnecting
+  EventSource sends Last-Event-ID and is replayed what it missed, as long
+  as it lands on the same worker and the ring still holds it.
+- A watcher thread (one per worker process, only while streams are open)
+  holds its own connection and reads PRAGMA data_version every `interval`
+  seconds. That value moves whenever any other connection commits, this
+  worker's or another's, so changes made in any gunicorn worker reach the
+  streams held by every worker. Only on a change does it diff a small
+  snapshot (StatCounters plus the newest Messages, Announcements and
+  AuditLogs ids) and publish:
+
+    stats          changed dashboard figures only             librarians
+    message        per recipient, with their unread count     user:<id>
+    announcement   new active announcements                   TargetAudience
+    audit          newest LogID                               librarians
+    return         one per 'Book returned' audit entry        librarians
+
+Each open stream parks one worker thread, so run gunicorn with the gthread
+worker (gunicorn.conf.py) and keep LIBRARY_EVENTS_MAX_STREAMS below its
+thread count. Streams end after LIBRARY_EVENTS_STREAM_SECONDS and the
+browser reconnects, so they rebalance across workers. The watcher polls
+every LIBRARY_EVENTS_INTERVAL seconds.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from db_pool import apply_storage_profile
+from stat_counters import read_dashboard_stats
+
+NEWEST_IDS_SQL = '''
+    SELECT (SELECT COALESCE(MAX(MessageID), 0) FROM Messages),
+           (SELECT COALESCE(MAX(AnnouncementID), 0) FROM Announcements),
+           (SELECT COALESCE(MAX(LogID), 0) FROM AuditLogs)
+'''
+
+NEW_DELIVERIES_SQL = '''
+    SELECT r.UserID, m.MessageID, m.Subject, m.MessageType, m.Priority, u.Name,
+           COALESCE(c.Unread, 0)
+    FROM Messages m
+    JOIN MessageRecipients r ON r.MessageID = m.MessageID
+    LEFT JOIN Users u ON u.UserID = m.FromUserID
+    LEFT JOIN UserUnreadCounts c ON c.UserID = r.UserID
+    WHERE m.MessageID > ? AND m.MessageID <= ?
+    ORDER BY m.MessageID
+'''
+
+NEW_ANNOUNCEMENTS_SQL = '''
+    SELECT AnnouncementID, Title, Priority, COALESCE(TargetAudience, 'all')
+    FROM Announcements
+    WHERE AnnouncementID > ? AND AnnouncementID <= ? AND Status = 'active'
+    ORDER BY AnnouncementID
+'''
+
+NEW_RETURNS_SQL = '''
+    SELECT LogID, Action, Timestamp FROM AuditLogs
+    WHERE LogID > ? AND LogID <= ? AND Action LIKE 'Book returned%'
+    ORDER BY LogID
+'''
+
+
+class EventStream:
+    """One client's SSE body; close() (called by the WSGI server) frees its slot even if never iterated"""
+
+    def __init__(self, hub, audiences, after):
+        self.hub = hub
+        self.audiences = audiences
+        self.after = after
+        self._closed = False
+
+    def __iter__(self):
+        hub = self.hub
+        try:
+            yield f'retry: {hub.retry_ms}\n\n'
+            deadline = time.monotonic() + hub.stream_seconds
+            while not self._closed and time.monotonic() < deadline:
+                events = hub.wait(self.after, min(hub.heartbeat, max(deadline - time.monotonic(), 0)))
+                if not events:
+                    # Comment line: keeps proxies from timing out, and finds dead clients
+                    yield ': keep-alive\n\n'
+                    continue
+                for event_id, kind, data, audience in events:
+                    self.after = event_id
+                    if audience in self.audiences:
+                        yield f'id: {hub.token}-{event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.hub._release_stream()
+
+
+class EventHub:
+    """Per-process event bus for one database, fed by a data_version watcher thread"""
+
+    def __init__(self, db_name, profile, interval=0.5, replay=256, max_streams=24, heartbeat=15.0,
+                 stream_seconds=300.0, retry_ms=3000):
+        self.db_name = db_name
+        self.profile = profile
+        self.interval = interval
+        self.replay = replay
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.stream_seconds = stream_seconds
+        self.retry_ms = retry_ms
+        self._cond = threading.Condition()
+        self._check_lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        # Event ids restart in every process, so they're qualified with a per-process token
+        self.token = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=self.replay)   # (id, kind, data, audience)
+        self._next_id = 1
+        self._streams = 0
+        self._thread = None
+        self._conn = None
+        self._version = None
+        self._snapshot = None
+        self._metrics = {
+            'streams_opened': 0,
+            'streams_rejected': 0,
+            'published': 0,
+            'checks': 0,
+            'changes': 0,
+            'errors': 0,
+            'last_error': None,
+        }
+
+    def _check_fork(self):
+        # A forked worker gets no watcher thread and must not reuse the parent's connection
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    # ----- bus -----
+    def publish(self, kind, data, audience='all'):
+        """Queue an event for every open stream whose user it is addressed to"""
+        with self._cond:
+            self._check_fork()
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, kind, data, audience))
+            self._metrics['published'] += 1
+            self._cond.notify_all()
+        return event_id
+
+    def wait(self, after, timeout):
+        """Events newer than `after`, waiting up to `timeout` seconds for the first one"""
+        with self._cond:
+            if not self._events or self._events[-1][0] <= after:
+                self._cond.wait(timeout)
+            return [event for event in self._events if event[0] > after]
+
+    def stream(self, user_id, user_type, last_event_id=None):
+        """An EventStream for one user, or None when this worker has no free stream slot"""
+        with self._cond:
+            self._check_fork()
+            if self._streams >= self.max_streams:
+                self._metrics['streams_rejected'] += 1
+                return None
+            self._streams += 1
+            self._metrics['streams_opened'] += 1
+            newest = self._next_id - 1
+            after = newest
+            token, _, seen = (last_event_id or '').partition('-')
+            if token == self.token and seen.isdigit():
+                after = min(int(seen), newest)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-watcher', daemon=True)
+                self._thread.start()
+        return EventStream(self, {'all', user_type, f'user:{user_id}'}, after)
+
+    def _release_stream(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                self._streams -= 1
+                self._cond.notify_all()
+
+    # ----- watcher -----
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._streams <= 0 or self._pid != os.getpid():
+                    self._thread = None
+                    break
+            self.check()
+            time.sleep(self.interval)
+        with self._check_lock:
+            # Unless a new stream already started the next watcher, which keeps using it
+            if self._thread is None:
+                self._close_connection()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_name, check_same_thread=False,
+                                         timeout=self.profile['busy_timeout'] / 1000.0)
+            apply_storage_profile(self._conn, self.profile)
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._version = None
+        self._snapshot = None
+
+    def check(self):
+        """Publish events for whatever changed since the last check; returns how many"""
+        with self._check_lock:
+            self._metrics['checks'] += 1
+            try:
+                conn = self._connection()
+                version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if version == self._version:
+                    return 0
+                self._version = version
+                snapshot = (read_dashboard_stats(conn), conn.execute(NEWEST_IDS_SQL).fetchone())
+                previous, self._snapshot = self._snapshot, snapshot
+                if previous is None:
+                    return 0
+                self._metrics['changes'] += 1
+                return self._publish_changes(conn, previous, snapshot)
+            except sqlite3.Error as e:
+                # Reopen next time; the next successful check diffs against the last good snapshot
+                self._metrics['errors'] += 1
+                self._metrics['last_error'] = str(e)
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+                self._version = None
+                return 0
+
+    def _publish_changes(self, conn, previous, current):
+        (old_stats, (old_message, old_announcement, old_log)) = previous
+        (stats, (message, announcement, log)) = current
+        published = 0
+
+        changed = {name: value for name, value in stats.items() if old_stats.get(name) != value}
+        if changed:
+            self.publish('stats', changed, 'librarian')
+            published += 1
+
+        if message > old_message:
+            for user_id, message_id, subject, message_type, priority, sender, unread in conn.execute(
+                    NEW_DELIVERIES_SQL, (old_message, message)):
+                self.publish('message', {'message_id': message_id, 'subject': subject,
+                                         'message_type': message_type, 'priority': priority,
+                                         'sender_name': sender, 'unread': unread}, f'user:{user_id}')
+                published += 1
+
+        if announcement > old_announcement:
+            for announcement_id, title, priority, audience in conn.execute(
+                    NEW_ANNOUNCEMENTS_SQL, (old_announcement, announcement)):
+                self.publish('announcement', {'announcement_id': announcement_id, 'title': title,
+                                              'priority': priority}, audience)
+                published += 1
+
+        if log > old_log:
+            for log_id, action, timestamp in conn.execute(NEW_RETURNS_SQL, (old_log, log)):
+                self.publish('return', {'log_id': log_id, 'action': action, 'timestamp': timestamp}, 'librarian')
+                published += 1
+            self.publish('audit', {'latest_id': log}, 'librarian')
+            published += 1
+        return published
+
+    def stats(self):
+        """Open streams, publish/check counts and watcher errors for this worker"""
+        with self._cond:
+            self._check_fork()
+            return dict(self._metrics, streams=self._streams, max_streams=self.max_streams,
+                        watching=self._thread is not None, interval=self.interval)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_event_hub(db_name, profile):
+    """Return the process-wide event hub for a database file, creating it on first use"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else db_name
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is None:
+            hub = EventHub(db_name, profile,
+                           interval=float(os.environ.get('LIBRARY_EVENTS_INTERVAL', 0.5)),
+                           max_streams=int(os.environ.get('LIBRARY_EVENTS_MAX_STREAMS', 24)),
+                           stream_seconds=float(os.environ.get('LIBRARY_EVENTS_STREAM_SECONDS', 300)))
+            _hubs[key] = hub
+        return hub
@@ -0,0 +1,22 @@
+"""
+Gunicorn settings:  gunicorn -c gunicorn.conf.py app:app
+
+/api/events holds each live-update stream open on a worker thread, so the
+workers are gthread: every worker process serves `threads` requests at once,
+and at most LIBRARY_EVENTS_MAX_STREAMS of them are event streams (the rest
+stay free for page loads). A sync worker would block on the first stream.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# gthread workers heartbeat from their main loop, so a long-lived stream doesn't trip this
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+# Each worker imports the app itself: SQLite handles and watcher threads are per process
+preload_app = False
+
+# Stream slots per worker, leaving 8 threads for ordinary requests
+os.environ.setdefault('LIBRARY_EVENTS_MAX_STREAMS', str(max(threads - 8, 1)))
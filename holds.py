@@ -0,0 +1,198 @@
+"""
+Hold Queue
+==========
+
+Active BookReservations rows form a first-come, first-served queue per
+title, ordered by QueueSeq (the ReservationID unless set otherwise). A hold
+is waiting while it has no CopyBarcode, and ready for pickup once a copy has
+been set aside for it (Copies.State = 'held') until its ExpiryDate.
+
+- idx_reservations_queue: (BookID, QueueSeq) over waiting holds only, so the
+  head of a title's queue is one index seek and a hold's position is a count
+  of the index entries in front of it (a range scan as long as the position,
+  not a maintained number)
+- idx_reservations_expiry: (ExpiryDate) over ready holds, for the sweeper,
+  which expires a hold after the pickup date the member was given
+
+Whenever a copy goes back on the shelf (a return, a cancelled or expired
+hold, new copies), allocate_copies hands the title's available copies to its
+waiting holds in queue order, in the caller's transaction.
+"""
+
+QUEUE_POSITION_SQL = '''
+    CASE WHEN r.CopyBarcode IS NULL THEN 1 + (
+        SELECT COUNT(*) FROM BookReservations q
+        WHERE q.BookID = r.BookID AND q.Status = 'active' AND q.CopyBarcode IS NULL AND q.QueueSeq < r.QueueSeq
+    ) ELSE 0 END
+'''
+
+
+def create_hold_queue_schema(cursor):
+    """Queue columns, indexes and trigger; queues existing holds in reservation order and fills them"""
+    cursor.execute('PRAGMA table_info(BookReservations)')
+    existing_columns = [column[1] for column in cursor.fetchall()]
+    for column, definition in (('QueueSeq', 'INTEGER'), ('CopyBarcode', 'TEXT'), ('ReadyDate', 'DATE')):
+        if column not in existing_columns:
+            cursor.execute(f'ALTER TABLE BookReservations ADD COLUMN {column} {definition}')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_queue_seq AFTER INSERT ON BookReservations
+        WHEN NEW.QueueSeq IS NULL BEGIN
+            UPDATE BookReservations SET QueueSeq = NEW.ReservationID WHERE ReservationID = NEW.ReservationID;
+        END
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_queue ON BookReservations(BookID, QueueSeq) '
+                   "WHERE Status = 'active' AND CopyBarcode IS NULL")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_ready ON BookReservations(ReadyDate) '
+                   "WHERE Status = 'active' AND CopyBarcode IS NOT NULL")
+
+    # Holds used to carry a pickup deadline from the day they were placed; waiting ones now have none
+    cursor.execute('UPDATE BookReservations SET QueueSeq = ReservationID WHERE QueueSeq IS NULL')
+    cursor.execute("UPDATE BookReservations SET ExpiryDate = NULL WHERE Status = 'active' AND CopyBarcode IS NULL")
+    hold_days = read_hold_days(cursor)
+    cursor.execute("SELECT DISTINCT BookID FROM BookReservations WHERE Status = 'active' AND CopyBarcode IS NULL")
+    for (isbn,) in cursor.fetchall():
+        allocate_copies(cursor, isbn, hold_days)
+
+
+def read_hold_days(cursor):
+    """The reservation_hold_days setting, for callers without a LibraryManager"""
+    cursor.execute("SELECT SettingValue FROM SystemSettings WHERE SettingKey = 'reservation_hold_days'")
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] else 3
+
+
+def allocate_copies(cursor, isbn, hold_days):
+    """Set aside available copies of `isbn` for its waiting holds, oldest first;
+    returns the (ReservationID, MemberID, Barcode) allocations"""
+    allocations = []
+    while True:
+        cursor.execute('''
+            SELECT ReservationID, MemberID FROM BookReservations
+            WHERE BookID = ? AND Status = 'active' AND CopyBarcode IS NULL
+            ORDER BY QueueSeq LIMIT 1
+        ''', (isbn,))
+        hold = cursor.fetchone()
+        if hold is None:
+            break
+        cursor.execute('''
+            UPDATE Copies SET State = 'held'
+            WHERE Barcode = (SELECT Barcode FROM Copies WHERE ISBN = ? AND State = 'available' ORDER BY Barcode LIMIT 1)
+            RETURNING Barcode
+        ''', (isbn,))
+        copy = cursor.fetchall()
+        if not copy:
+            break
+        cursor.execute('''
+            UPDATE BookReservations SET CopyBarcode = ?, ReadyDate = date('now'), ExpiryDate = date('now', ?)
+            WHERE ReservationID = ?
+        ''', (copy[0][0], f'+{hold_days} days', hold[0]))
+        allocations.append((hold[0], hold[1], copy[0][0]))
+    return allocations
+
+
+def place_hold(cursor, isbn, member_id, hold_days):
+    """Queue a hold for `member_id`, filling it at once if a copy is on the shelf;
+    returns (ReservationID, allocations), or (None, []) if the member already has one on this title"""
+    cursor.execute('''
+        SELECT 1 FROM BookReservations WHERE MemberID = ? AND Status = 'active' AND BookID = ?
+    ''', (member_id, isbn))
+    if cursor.fetchone():
+        return None, []
+    cursor.execute('INSERT INTO BookReservations (BookID, MemberID) VALUES (?, ?)', (isbn, member_id))
+    reservation_id = cursor.lastrowid
+    return reservation_id, allocate_copies(cursor, isbn, hold_days)
+
+
+def claim_held_copy(cursor, isbn, member_id):
+    """Fulfil the member's ready hold on `isbn` and lend them its copy; returns the barcode, or None"""
+    cursor.execute('''
+        UPDATE BookReservations SET Status = 'fulfilled'
+        WHERE ReservationID = (
+            SELECT ReservationID FROM BookReservations
+            WHERE MemberID = ? AND Status = 'active' AND BookID = ? AND CopyBarcode IS NOT NULL
+        )
+        RETURNING CopyBarcode
+    ''', (member_id, isbn))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    cursor.execute("UPDATE Copies SET State = 'loaned' WHERE Barcode = ?", (rows[0][0],))
+    return rows[0][0]
+
+
+def release_hold(cursor, reservation_id, status, hold_days):
+    """End an active hold with `status`, passing any copy set aside for it to the next hold in line;
+    returns the allocations made, or None if the hold wasn't active"""
+    cursor.execute('''
+        UPDATE BookReservations SET Status = ? WHERE ReservationID = ? AND Status = 'active'
+        RETURNING BookID, CopyBarcode
+    ''', (status, reservation_id))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    isbn, barcode = rows[0]
+    if barcode is None:
+        return []
+    cursor.execute("UPDATE Copies SET State = 'available' WHERE Barcode = ? AND State = 'held'", (barcode,))
+    return allocate_copies(cursor, isbn, hold_days)
+
+
+def expire_holds(cursor, hold_days):
+    """Expire ready holds whose ExpiryDate has passed in one statement and re-allocate their copies,
+    held `hold_days` for the next in line; returns (expired, allocations)"""
+    # The stored ExpiryDate, not ReadyDate + the current setting: it is the date the member was given
+    cursor.execute('''
+        UPDATE BookReservations SET Status = 'expired'
+        WHERE Status = 'active' AND CopyBarcode IS NOT NULL AND ExpiryDate < date('now')
+        RETURNING BookID, CopyBarcode
+    ''')
+    expired = cursor.fetchall()
+    cursor.executemany("UPDATE Copies SET State = 'available' WHERE Barcode = ? AND State = 'held'",
+                       [(barcode,) for _, barcode in expired])
+    allocations = []
+    for isbn in sorted({isbn for isbn, _ in expired}):
+        allocations.extend(allocate_copies(cursor, isbn, hold_days))
+    return len(expired), allocations
+
+
+def create_hold_expiry_index(cursor):
+    """Index the sweeper's ExpiryDate range in place of the ReadyDate one"""
+    cursor.execute('DROP INDEX IF EXISTS idx_reservations_ready')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_expiry ON BookReservations(ExpiryDate) '
+                   "WHERE Status = 'active' AND CopyBarcode IS NOT NULL")
+
+
+def notify_ready(cursor, allocations, from_user_id=None):
+    """Tell members with a user account that their hold is ready for pickup"""
+    cursor.executemany('''
+        INSERT INTO Messages (FromUserID, ToUserID, Subject, Message, MessageType, Priority)
+        SELECT ?, u.UserID, 'Hold ready: ' || b.Title,
+               'A copy of "' || b.Title || '" by ' || b.Author || ' is waiting for you at the desk. '
+               || 'Please pick it up by ' || r.ExpiryDate || '.',
+               'hold_ready', 'high'
+        FROM BookReservations r
+        JOIN Books b ON b.ISBN = r.BookID
+        JOIN Users u ON u.MemberID = r.MemberID
+        WHERE r.ReservationID = ?
+    ''', [(from_user_id, reservation_id) for reservation_id, _, _ in allocations])
+
+
+def queue_position(cursor, reservation_id):
+    """(position, ExpiryDate) of an active hold; position is 0 once it is ready"""
+    cursor.execute(f'''
+        SELECT {QUEUE_POSITION_SQL}, r.ExpiryDate FROM BookReservations r WHERE r.ReservationID = ?
+    ''', (reservation_id,))
+    return cursor.fetchone()
+
+
+def member_holds(conn, member_id):
+    """A member's active holds with their queue position (0 once ready):
+    (ReservationID, ISBN, Title, Author, ReservationDate, ExpiryDate, Ready, Position)"""
+    return conn.execute(f'''
+        SELECT r.ReservationID, r.BookID, b.Title, b.Author, r.ReservationDate, r.ExpiryDate,
+               r.CopyBarcode IS NOT NULL, {QUEUE_POSITION_SQL}
+        FROM BookReservations r
+        JOIN Books b ON b.ISBN = r.BookID
+        WHERE r.MemberID = ? AND r.Status = 'active'
+        ORDER BY r.ReservationDate DESC, r.ReservationID DESC
+    ''', (member_id,)).fetchall()
@@ -0,0 +1,163 @@
+"""
+Message Inbox
+=============
+
+Every delivered message has a MessageRecipients row per recipient: direct
+messages get theirs from a trigger on Messages, broadcasts from
+LibraryManager.broadcast_message. The row carries the recipient's read
+state and copies of MessageType/SentDate, so an inbox page is a range scan
+of one of three indexes:
+
+- idx_message_recipients_inbox:  (UserID, SentDate)
+- idx_message_recipients_type:   (UserID, MessageType, SentDate)
+- idx_message_recipients_unread: (UserID, SentDate) WHERE ReadAt IS NULL
+
+UserUnreadCounts keeps each user's unread total exact with triggers on
+MessageRecipients, and marking a message read either way (ReadAt on the
+recipient row, or the legacy Messages.IsRead flag) is mirrored onto the
+other by triggers too.
+"""
+
+# Same columns as Messages.* + sender name, with IsRead from the recipient's own state
+INBOX_SQL = '''
+    SELECT m.MessageID, m.FromUserID, m.ToUserID, m.ToUserType, m.Subject, m.Message, m.SentDate,
+           r.ReadAt IS NOT NULL AS IsRead, m.MessageType, m.Priority, u.Name AS SenderName
+    FROM MessageRecipients r
+    JOIN Messages m ON m.MessageID = r.MessageID
+    LEFT JOIN Users u ON u.UserID = m.FromUserID
+    WHERE r.UserID = ?
+'''
+
+
+def create_inbox_schema(cursor):
+    """Inbox columns, indexes and triggers; backfills recipients of direct messages and the counters"""
+    cursor.execute('ALTER TABLE MessageRecipients ADD COLUMN MessageType TEXT')
+    cursor.execute('ALTER TABLE MessageRecipients ADD COLUMN SentDate DATETIME')
+    cursor.execute('''
+        UPDATE MessageRecipients SET MessageType = m.MessageType, SentDate = m.SentDate
+        FROM Messages m WHERE m.MessageID = MessageRecipients.MessageID
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO MessageRecipients (UserID, MessageID, DeliveredAt, ReadAt, MessageType, SentDate)
+        SELECT ToUserID, MessageID, SentDate, CASE WHEN IsRead THEN SentDate END, MessageType, SentDate
+        FROM Messages WHERE ToUserID IS NOT NULL
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_recipients_inbox ON MessageRecipients(UserID, SentDate)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_recipients_type '
+                   'ON MessageRecipients(UserID, MessageType, SentDate)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_recipients_unread '
+                   'ON MessageRecipients(UserID, SentDate) WHERE ReadAt IS NULL')
+
+    # Deliveries and read state
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_direct_recipient AFTER INSERT ON Messages
+        WHEN NEW.ToUserID IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO MessageRecipients (UserID, MessageID, ReadAt, MessageType, SentDate)
+            VALUES (NEW.ToUserID, NEW.MessageID, CASE WHEN NEW.IsRead THEN CURRENT_TIMESTAMP END,
+                    NEW.MessageType, NEW.SentDate);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_delete_recipients AFTER DELETE ON Messages BEGIN
+            DELETE FROM MessageRecipients WHERE MessageID = OLD.MessageID;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_read_recipient AFTER UPDATE OF IsRead ON Messages
+        WHEN NEW.IsRead AND NOT OLD.IsRead AND NEW.ToUserID IS NOT NULL BEGIN
+            UPDATE MessageRecipients SET ReadAt = CURRENT_TIMESTAMP
+            WHERE UserID = NEW.ToUserID AND MessageID = NEW.MessageID AND ReadAt IS NULL;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_recipients_read_message AFTER UPDATE OF ReadAt ON MessageRecipients
+        WHEN OLD.ReadAt IS NULL AND NEW.ReadAt IS NOT NULL BEGIN
+            UPDATE Messages SET IsRead = 1 WHERE MessageID = NEW.MessageID AND NOT IsRead;
+        END
+    ''')
+
+    # Per-user unread totals
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS UserUnreadCounts (
+            UserID INTEGER PRIMARY KEY,
+            Unread INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_unread_insert AFTER INSERT ON MessageRecipients
+        WHEN NEW.ReadAt IS NULL BEGIN
+            INSERT INTO UserUnreadCounts (UserID, Unread) VALUES (NEW.UserID, 1)
+            ON CONFLICT (UserID) DO UPDATE SET Unread = Unread + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_unread_delete AFTER DELETE ON MessageRecipients
+        WHEN OLD.ReadAt IS NULL BEGIN
+            UPDATE UserUnreadCounts SET Unread = Unread - 1 WHERE UserID = OLD.UserID;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_unread_update AFTER UPDATE OF ReadAt ON MessageRecipients
+        WHEN (OLD.ReadAt IS NULL) != (NEW.ReadAt IS NULL) BEGIN
+            INSERT INTO UserUnreadCounts (UserID, Unread) VALUES (NEW.UserID, NEW.ReadAt IS NULL)
+            ON CONFLICT (UserID) DO UPDATE SET Unread = Unread + 2 * (NEW.ReadAt IS NULL) - 1;
+        END
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO UserUnreadCounts (UserID, Unread)
+        SELECT UserID, COUNT(*) FROM MessageRecipients WHERE ReadAt IS NULL GROUP BY UserID
+    ''')
+
+
+def fetch_inbox(conn, user_id, message_type=None, unread_only=False, limit=None):
+    """A user's messages, newest first, filtered and limited in SQL"""
+    query = INBOX_SQL
+    params = [user_id]
+    if message_type:
+        query += ' AND r.MessageType = ?'
+        params.append(message_type)
+    if unread_only:
+        query += ' AND r.ReadAt IS NULL'
+    query += ' ORDER BY r.SentDate DESC, r.MessageID DESC LIMIT ?'
+    params.append(-1 if limit is None else limit)
+    return conn.execute(query, params).fetchall()
+
+
+def unread_count(conn, user_id):
+    row = conn.execute('SELECT Unread FROM UserUnreadCounts WHERE UserID = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def mark_all_read(conn, user_id, message_type=None):
+    """Mark every unread message of a user read in one statement; returns how many changed"""
+    query = 'UPDATE MessageRecipients SET ReadAt = CURRENT_TIMESTAMP WHERE UserID = ? AND ReadAt IS NULL'
+    params = [user_id]
+    if message_type:
+        query += ' AND MessageType = ?'
+        params.append(message_type)
+    return conn.execute(query, params).rowcount
+
+
+def reconcile_unread(conn, repair=False):
+    """{user_id: (stored, actual)} for every unread counter that drifted; repair=True resets them"""
+    drift = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''
+            SELECT UserID, MAX(stored), MAX(actual) FROM (
+                SELECT UserID, Unread AS stored, 0 AS actual FROM UserUnreadCounts
+                UNION ALL
+                SELECT UserID, 0, COUNT(*) FROM MessageRecipients WHERE ReadAt IS NULL GROUP BY UserID
+            ) GROUP BY UserID
+        ''').fetchall()
+        for user_id, stored, actual in rows:
+            if stored != actual:
+                drift[user_id] = (stored, actual)
+                if repair:
+                    conn.execute('INSERT OR REPLACE INTO UserUnreadCounts (UserID, Unread) VALUES (?, ?)',
+                                 (user_id, actual))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return drift
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Scheduled Jobs
+==============
+
+Maintenance work that used to run inside request handlers (fine accrual on
+every /fines view) runs here instead, from cron or a long-running scheduler
+process:
+
+    python jobs.py run-pending          # run every job that is due, then exit (cron)
+    python jobs.py serve [--poll 60]    # keep running due jobs
+    python jobs.py run accrue_fines [--force]
+    python jobs.py history
+
+Every run is recorded in the JobRuns table with its duration and result. A
+run is identified by (JobName, RunKey): the key is the day for daily jobs
+and the interval slot for the others, and claiming it is a single upsert,
+so two schedulers (or a scheduler and a manual run) never execute the same
+slot twice. Failed runs, and runs whose process died mid-way, can be
+claimed again.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# A 'running' row older than this belongs to a scheduler that died
+STALE_RUN_SECONDS = 3600
+
+
+def _accrue_fines(library):
+    return library.accrue_overdue_fines()
+
+
+def _reconcile_counters(library):
+    return {name: list(values) for name, values in library.reconcile_dashboard_counters().items()}
+
+
+def _reconcile_unread(library):
+    return {str(user_id): list(values) for user_id, values in library.reconcile_unread_counters().items()}
+
+
+def _refresh_popularity(library):
+    from popularity import WINDOWS, refresh_snapshot
+    conn = library.get_connection()
+    try:
+        for window in WINDOWS:
+            refresh_snapshot(conn, window)
+    finally:
+        conn.close()
+    return {'windows': list(WINDOWS)}
+
+
+def _archive_audit_logs(library):
+    return library.archive_audit_logs()
+
+
+def _expire_holds(library):
+    return library.expire_stale_holds()
+
+
+def _deliver_outbox(library):
+    return library.deliver_outbox()
+
+
+# name -> (function(library) returning a JSON-serialisable result, 'daily' or interval in seconds)
+JOBS = {
+    'accrue_fines': (_accrue_fines, 'daily'),
+    'reconcile_counters': (_reconcile_counters, 'daily'),
+    'reconcile_unread': (_reconcile_unread, 'daily'),
+    'refresh_popularity': (_refresh_popularity, 600),
+    'archive_audit_logs': (_archive_audit_logs, 'daily'),
+    'expire_holds': (_expire_holds, 'daily'),
+    'deliver_outbox': (_deliver_outbox, 60),
+}
+
+
+def run_key(schedule, now=None):
+    """Identifier of the schedule slot `now` falls in"""
+    now = time.time() if now is None else now
+    if schedule == 'daily':
+        return datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+    return str(int(now // schedule))
+
+
+def _claim(conn, name, key, now):
+    cursor = conn.execute('''
+        INSERT INTO JobRuns (JobName, RunKey, Status, StartedAt) VALUES (?, ?, 'running', ?)
+        ON CONFLICT (JobName, RunKey) DO UPDATE SET
+            Status = 'running', StartedAt = excluded.StartedAt,
+            FinishedAt = NULL, DurationMs = NULL, Result = NULL, Error = NULL
+        WHERE Status = 'failed' OR (Status = 'running' AND StartedAt < ?)
+        RETURNING RunID
+    ''', (name, key, now, now - STALE_RUN_SECONDS))
+    row = cursor.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def run_job(library, name, force=False):
+    """Run one job for its current slot; returns the JobRuns row as a dict, or None if already done
+
+    force=True runs it even if the slot has already run (recorded under a manual key).
+    """
+    fn, schedule = JOBS[name]
+    now = time.time()
+    key = f'manual-{now:.6f}' if force else run_key(schedule, now)
+
+    conn = library.get_connection()
+    try:
+        run_id = _claim(conn, name, key, now)
+    finally:
+        conn.close()
+    if run_id is None:
+        return None
+
+    start = time.perf_counter()
+    result = error = None
+    try:
+        result = fn(library)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    conn = library.get_connection()
+    try:
+        conn.execute('''
+            UPDATE JobRuns SET Status = ?, FinishedAt = ?, DurationMs = ?, Result = ?, Error = ?
+            WHERE RunID = ?
+        ''', ('failed' if error else 'succeeded', time.time(), round(duration_ms, 3),
+              json.dumps(result) if result is not None else None, error, run_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"{'❌' if error else '✅'} {name} [{key}] {duration_ms:.1f} ms: {error or result}")
+    return {'run_id': run_id, 'job': name, 'run_key': key, 'status': 'failed' if error else 'succeeded',
+            'duration_ms': round(duration_ms, 3), 'result': result, 'error': error}
+
+
+def run_pending(library):
+    """Run every job whose current slot hasn't run yet"""
+    return [run for run in (run_job(library, name) for name in JOBS) if run is not None]
+
+
+def job_history(library, limit=20, name=None):
+    """Most recent runs, newest first"""
+    conn = library.get_connection()
+    try:
+        query = '''
+            SELECT RunID, JobName, RunKey, Status, StartedAt, DurationMs, Result, Error
+            FROM JobRuns
+        '''
+        params = []
+        if name:
+            query += ' WHERE JobName = ?'
+            params.append(name)
+        query += ' ORDER BY StartedAt DESC LIMIT ?'
+        params.append(limit)
+        runs = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Library scheduled jobs')
+    parser.add_argument('--db', default=os.environ.get('LIBRARY_DB', 'library.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run-pending', help='Run every due job once and exit')
+    serve = sub.add_parser('serve', help='Run due jobs forever')
+    serve.add_argument('--poll', type=float, default=60)
+    run = sub.add_parser('run', help='Run one job now')
+    run.add_argument('job', choices=sorted(JOBS))
+    run.add_argument('--force', action='store_true', help='Run even if this slot already ran')
+    history = sub.add_parser('history', help='Show recent runs')
+    history.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    from app import LibraryManager
+    from migrations import migrate
+    migrate(args.db)
+    library = LibraryManager(args.db)
+
+    if args.command == 'run-pending':
+        runs = run_pending(library)
+        sys.exit(1 if any(run['error'] for run in runs) else 0)
+    elif args.command == 'serve':
+        print(f'Job scheduler running every {args.poll:g}s: {", ".join(JOBS)}')
+        while True:
+            run_pending(library)
+            time.sleep(args.poll)
+    elif args.command == 'run':
+        run = run_job(library, args.job, force=args.force)
+        if run is None:
+            print(f'{args.job} already ran for this slot (use --force to run again)')
+        sys.exit(1 if run and run['error'] else 0)
+    else:
+        for run_id, job, key, status, started, duration, result, error in job_history(library, args.limit):
+            started = datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')
+            print(f'{run_id:>5} {started} {job:<20} {key:<20} {status:<10} '
+                  f'{duration or 0:>9.1f} ms  {error or result or ""}')
+
+
+if __name__ == '__main__':
+    main()
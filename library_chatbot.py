@@ -1,9 +1,33 @@
+import argparse
 import sqlite3
-import smtplib
-from email.message import EmailMessage
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-import os
+import time
+from db_pool import apply_storage_profile, load_storage_profile
+from mailer import Mailer, load_email_config
+
+REMINDER_FOOTER = """You can return books during our library hours:
+Monday - Friday: 9:00 AM - 8:00 PM
+Saturday: 10:00 AM - 6:00 PM
+Sunday: 12:00 PM - 5:00 PM
+
+If you need to extend your loan, please contact us immediately.
+
+Thank you for using our library services!
+
+Best regards,
+Library Management System
+"""
+
+# A loan is reminded once per stage; its stage follows from how many days overdue it is
+FINAL_NOTICE_DAYS = 14
+REMINDER_STAGE_SQL = f'''
+    CASE WHEN julianday(:today) - julianday(l.DueDate) >= {FINAL_NOTICE_DAYS} THEN 'final_notice'
+         WHEN l.DueDate < :today THEN 'overdue'
+         ELSE 'due_soon' END
+'''
+# A running reminder run that hasn't recorded progress for this long has died
+REMINDER_STALE_SECONDS = 300
 
 class LibraryChatbot:
     def __init__(self, db_name='library.db'):
@@ -11,16 +35,16 @@ class LibraryChatbot:
         self.email_config = self.load_email_config()
     
     def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_name)
+        """Get database connection with the web app's storage profile (WAL, busy timeout)"""
+        conn = sqlite3.connect(self.db_name)
+        apply_storage_profile(conn, load_storage_profile())
+        return conn
     
     def load_email_config(self):
         """Load email configuration from config file or environment variables"""
-        config_file = 'email_config.json'
-        
-        if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                return json.load(f)
+        config = load_email_config()
+        if config:
+            return config
         else:
             # Default configuration - you'll need to update these
             return {
@@ -64,7 +88,6 @@ class LibraryChatbot:
         cursor = conn.cursor()
         
         today = datetime.now().strftime('%Y-%m-%d')
-        from datetime import timedelta
         future_date = (datetime.now().replace(hour=23, minute=59, second=59) + 
                       timedelta(days=days_ahead)).strftime('%Y-%m-%d')
         
@@ -106,39 +129,122 @@ class LibraryChatbot:
 📅 Due Date: {due_date}
 {urgency}
 
-You can return the book during our library hours:
-Monday - Friday: 9:00 AM - 8:00 PM
-Saturday: 10:00 AM - 6:00 PM
-Sunday: 12:00 PM - 5:00 PM
+{REMINDER_FOOTER}"""
+        return subject, message_body
+    
+    def iter_reminder_digests(self, days_ahead=3, batch_size=500, run_id=None):
+        """Yield (MemberID, Name, ContactInfo, loans) for every member with overdue or soon-due books
+        
+        Loans are grouped per member in SQL; each loan is (title, author, due date,
+        days overdue, loan ID), most overdue first. Members are read batch_size at a
+        time, each batch on a connection that is closed again before its digests
+        are yielded, so no read stays open while they are being sent. With run_id,
+        only the loans that reminder run has claimed in ReminderLedger are included.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        horizon = (datetime.now() + timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+        after = -1
+        
+        while True:
+            conn = self.get_connection()
+            try:
+                rows = conn.execute('''
+                    SELECT m.MemberID, m.Name, m.ContactInfo,
+                           json_group_array(json_array(b.Title, b.Author, l.DueDate,
+                               CAST(julianday(:today) - julianday(l.DueDate) AS INTEGER), l.LoanID))
+                    FROM Loans l
+                    JOIN Books b ON l.BookID = b.ISBN
+                    JOIN Members m ON l.MemberID = m.MemberID
+                    WHERE l.ReturnDate IS NULL AND l.DueDate <= :horizon AND m.MemberID > :after
+                      AND (:run_id IS NULL OR l.LoanID IN (
+                          SELECT LoanID FROM ReminderLedger WHERE RunID = :run_id AND Status = 'sending'))
+                    GROUP BY m.MemberID
+                    ORDER BY m.MemberID
+                    LIMIT :batch_size
+                ''', {'today': today, 'horizon': horizon, 'run_id': run_id, 'after': after,
+                      'batch_size': batch_size}).fetchall()
+            finally:
+                conn.close()
+            for member_id, name, contact_info, loans in rows:
+                # json_group_array keeps no particular order, so the loans are sorted here
+                yield member_id, name, contact_info, sorted((tuple(loan) for loan in json.loads(loans)),
+                                                            key=lambda loan: (loan[2], loan[4]))
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+    
+    def create_digest_email(self, member_name, loans):
+        """Create one reminder email covering all of a member's overdue and soon-due books"""
+        overdue = [loan for loan in loans if loan[3] > 0]
+        due_soon = [loan for loan in loans if loan[3] <= 0]
+        
+        if overdue:
+            subject = f"OVERDUE: {len(overdue)} library book{'s' if len(overdue) > 1 else ''} to return"
+        else:
+            subject = f"Library Books Due Soon - {len(due_soon)} book{'s' if len(due_soon) > 1 else ''}"
+        
+        sections = []
+        if overdue:
+            lines = [f"📚 {title} by {author} - due {due_date} ({days} days overdue)"
+                     for title, author, due_date, days, *_ in overdue]
+            sections.append("⚠️ OVERDUE - please return these as soon as possible to avoid late fees:\n"
+                            + "\n".join(lines))
+        if due_soon:
+            lines = [f"📚 {title} by {author} - due {due_date}" for title, author, due_date, *_ in due_soon]
+            sections.append("📅 Due soon - please return these by their due date:\n" + "\n".join(lines))
+        
+        details = "\n\n".join(sections)
+        message_body = f"""Dear {member_name},
 
-If you need to extend your loan, please contact us immediately.
+This is a reminder about the library books you currently have on loan.
 
-Thank you for using our library services!
+{details}
 
-Best regards,
-Library Management System
-"""
+{REMINDER_FOOTER}"""
         return subject, message_body
     
+    def get_mailer(self):
+        """Mailer for the current email settings (persistent SMTP sessions, concurrent senders)"""
+        return Mailer(self.email_config)
+    
     def send_email(self, recipient_email, subject, message_body):
-        """Send email using SMTP"""
-        try:
-            msg = EmailMessage()
-            msg.set_content(message_body)
-            msg['Subject'] = subject
-            msg['From'] = self.email_config['sender_email']
-            msg['To'] = recipient_email
-            
-            # Connect to SMTP server and send email
-            with smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port']) as server:
-                server.starttls()  # Enable encryption
-                server.login(self.email_config['sender_email'], self.email_config['sender_password'])
-                server.send_message(msg)
-            
+        """Send a single email using SMTP"""
+        success, error = self.get_mailer().send(recipient_email, subject, message_body)
+        if success:
             return True, "Email sent successfully"
+        return False, f"Failed to send email: {error}"
+    
+    def send_reminders(self, loans, is_overdue, describe):
+        """Send one reminder per loan concurrently; describe(loan) completes the success line"""
+        mailer = self.get_mailer()
+        pending = {}
+        no_email = []
         
-        except Exception as e:
-            return False, f"Failed to send email: {str(e)}"
+        def messages():
+            for loan in loans:
+                loan_id, title, author, member_name, contact_info, due_date = loan[:6]
+                email = self.extract_email(contact_info)
+                if not email:
+                    print(f"❌ No valid email found for {member_name} (Contact: {contact_info})")
+                    no_email.append(loan_id)
+                    continue
+                subject, message_body = self.create_reminder_email(
+                    member_name, title, author, due_date, is_overdue=is_overdue
+                )
+                pending[loan_id] = (loan, email)
+                yield loan_id, mailer.message(email, subject, message_body)
+        
+        def on_result(loan_id, error):
+            loan, email = pending.pop(loan_id)
+            if error is None:
+                print(f"✅ {describe(loan, email)}")
+            else:
+                print(f"❌ Failed to send to {loan[3]} ({email}): {error}")
+        
+        report = mailer.send_all(messages(), on_result)
+        print(f"\n📊 Summary: {report.sent} emails sent, {report.failed + len(no_email)} failed")
+        print(f"⏱️ {report.summary()}")
+        return report
     
     def send_overdue_reminders(self):
         """Send reminder emails for all overdue books"""
@@ -149,35 +255,10 @@ Library Management System
             return
         
         print(f"📧 Found {len(overdue_loans)} overdue loans. Sending reminders...")
-        
-        sent_count = 0
-        failed_count = 0
-        
-        for loan in overdue_loans:
-            loan_id, title, author, member_name, contact_info, due_date, days_overdue = loan
-            
-            # Extract email from contact info (assuming it contains email)
-            email = self.extract_email(contact_info)
-            
-            if not email:
-                print(f"❌ No valid email found for {member_name} (Contact: {contact_info})")
-                failed_count += 1
-                continue
-            
-            subject, message_body = self.create_reminder_email(
-                member_name, title, author, due_date, is_overdue=True
-            )
-            
-            success, result = self.send_email(email, subject, message_body)
-            
-            if success:
-                print(f"✅ Reminder sent to {member_name} ({email}) for '{title}' - {int(days_overdue)} days overdue")
-                sent_count += 1
-            else:
-                print(f"❌ Failed to send to {member_name} ({email}): {result}")
-                failed_count += 1
-        
-        print(f"\n📊 Summary: {sent_count} emails sent, {failed_count} failed")
+        return self.send_reminders(
+            overdue_loans, True,
+            lambda loan, email: f"Reminder sent to {loan[3]} ({email}) for '{loan[1]}' - {int(loan[6])} days overdue"
+        )
     
     def send_upcoming_due_reminders(self, days_ahead=3):
         """Send reminder emails for books due soon"""
@@ -188,34 +269,195 @@ Library Management System
             return
         
         print(f"📧 Found {len(upcoming_loans)} books due within {days_ahead} days. Sending reminders...")
+        return self.send_reminders(
+            upcoming_loans, False,
+            lambda loan, email: f"Due soon reminder sent to {loan[3]} ({email}) for '{loan[1]}' - due {loan[5]}"
+        )
+    
+    def send_reminder_digests(self, days_ahead=3):
+        """Send one combined reminder per member for all their overdue and soon-due books"""
+        mailer = self.get_mailer()
+        pending = {}
+        no_email = []
+        loan_count = [0]
         
-        sent_count = 0
-        failed_count = 0
+        def messages():
+            for member_id, member_name, contact_info, loans in self.iter_reminder_digests(days_ahead):
+                loan_count[0] += len(loans)
+                email = self.extract_email(contact_info)
+                if not email:
+                    print(f"❌ No valid email found for {member_name} (Contact: {contact_info})")
+                    no_email.append(member_id)
+                    continue
+                subject, message_body = self.create_digest_email(member_name, loans)
+                pending[member_id] = (member_name, email, len(loans))
+                yield member_id, mailer.message(email, subject, message_body)
         
-        for loan in upcoming_loans:
-            loan_id, title, author, member_name, contact_info, due_date = loan
-            
-            email = self.extract_email(contact_info)
-            
-            if not email:
-                print(f"❌ No valid email found for {member_name} (Contact: {contact_info})")
-                failed_count += 1
-                continue
+        def on_result(member_id, error):
+            member_name, email, count = pending.pop(member_id)
+            if error is None:
+                print(f"✅ Digest sent to {member_name} ({email}) covering {count} book{'s' if count > 1 else ''}")
+            else:
+                print(f"❌ Failed to send to {member_name} ({email}): {error}")
+        
+        report = mailer.send_all(messages(), on_result)
+        if not loan_count[0]:
+            print(f"✅ No books overdue or due within {days_ahead} days!")
+            return report
+        print(f"\n📊 Summary: {loan_count[0]} loans covered by {report.sent + report.failed + len(no_email)} "
+              f"digests; {report.sent} emails sent, {report.failed + len(no_email)} failed")
+        print(f"⏱️ {report.summary()}")
+        return report
+    
+    # ===== UNATTENDED REMINDER RUNS =====
+    def claim_reminders(self, run_id, days_ahead=3):
+        """Claim every loan owed a reminder at its current stage for run_id; returns (claimed, resumed)
+        
+        Claims are rows in ReminderLedger, unique per (loan, stage), so a loan is
+        never reminded twice for the same stage however often the run repeats.
+        Claims left behind by a run that died mid-way are taken over.
+        """
+        now = time.time()
+        today = datetime.now().strftime('%Y-%m-%d')
+        horizon = (datetime.now() + timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('''
+                UPDATE ReminderRuns SET Status = 'interrupted', FinishedAt = ?
+                WHERE Status = 'running' AND RunID != ? AND HeartbeatAt < ?
+            ''', (now, run_id, now - REMINDER_STALE_SECONDS))
+            cursor.execute('''
+                UPDATE ReminderLedger SET RunID = ?, ClaimedAt = ?
+                WHERE Status = 'sending'
+                  AND RunID IN (SELECT RunID FROM ReminderRuns WHERE Status = 'interrupted')
+            ''', (run_id, now))
+            resumed = cursor.rowcount
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO ReminderLedger (LoanID, Kind, RunID, Status, ClaimedAt)
+                SELECT l.LoanID, {REMINDER_STAGE_SQL}, :run_id, 'sending', :now
+                FROM Loans l
+                WHERE l.ReturnDate IS NULL AND l.DueDate <= :horizon
+            ''', {'today': today, 'horizon': horizon, 'run_id': run_id, 'now': now})
+            claimed = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return claimed, resumed
+    
+    def record_reminder_result(self, run_id, loan_ids, sent):
+        """Mark a digest's claims sent, or release them so a later run tries again"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if sent:
+            cursor.execute('''
+                UPDATE ReminderLedger SET Status = 'sent', SentAt = ?
+                WHERE RunID = ? AND LoanID IN (SELECT value FROM json_each(?))
+            ''', (time.time(), run_id, json.dumps(loan_ids)))
+        else:
+            cursor.execute('''
+                DELETE FROM ReminderLedger
+                WHERE RunID = ? AND Status = 'sending' AND LoanID IN (SELECT value FROM json_each(?))
+            ''', (run_id, json.dumps(loan_ids)))
+        cursor.execute('UPDATE ReminderRuns SET HeartbeatAt = ? WHERE RunID = ?', (time.time(), run_id))
+        conn.commit()
+        conn.close()
+    
+    def run_reminders(self, days_ahead=3):
+        """One unattended reminder run: claim due reminders, send them as digests, record the stats"""
+        start = time.time()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO ReminderRuns (StartedAt, HeartbeatAt, Status) VALUES (?, ?, 'running')",
+                       (start, start))
+        run_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        stats = {'run_id': run_id, 'claimed': 0, 'resumed': 0, 'digests': 0, 'sent': 0, 'failed': 0,
+                 'no_email': 0, 'retries': 0, 'sessions': 0}
+        status, error = 'completed', None
+        try:
+            stats['claimed'], stats['resumed'] = self.claim_reminders(run_id, days_ahead)
+            mailer = self.get_mailer()
+            pending = {}
             
-            subject, message_body = self.create_reminder_email(
-                member_name, title, author, due_date, is_overdue=False
-            )
+            def messages():
+                for member_id, member_name, contact_info, loans in self.iter_reminder_digests(days_ahead, run_id=run_id):
+                    stats['digests'] += 1
+                    loan_ids = [loan[4] for loan in loans]
+                    email = self.extract_email(contact_info)
+                    if not email:
+                        stats['no_email'] += 1
+                        self.record_reminder_result(run_id, loan_ids, sent=False)
+                        continue
+                    subject, message_body = self.create_digest_email(member_name, loans)
+                    pending[member_id] = loan_ids
+                    yield member_id, mailer.message(email, subject, message_body)
             
-            success, result = self.send_email(email, subject, message_body)
+            def on_result(member_id, error):
+                self.record_reminder_result(run_id, pending.pop(member_id), sent=error is None)
             
-            if success:
-                print(f"✅ Due soon reminder sent to {member_name} ({email}) for '{title}' - due {due_date}")
-                sent_count += 1
-            else:
-                print(f"❌ Failed to send to {member_name} ({email}): {result}")
-                failed_count += 1
+            report = mailer.send_all(messages(), on_result)
+            stats.update(sent=report.sent, failed=report.failed, retries=report.retries, sessions=report.sessions)
+            if report.callback_errors:
+                # Sent but not recorded: the claims are released below and may be reminded again
+                status, error = 'failed', (f'{len(report.callback_errors)} results not recorded: '
+                                           f'{report.callback_errors[0][1]}')
+        except Exception as e:
+            status, error = 'failed', f'{type(e).__name__}: {e}'
         
-        print(f"\n📊 Summary: {sent_count} emails sent, {failed_count} failed")
+        # Claims not sent by now (e.g. the loan was returned meanwhile) go back to the pool
+        stats['duration_ms'] = round((time.time() - start) * 1000, 3)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM ReminderLedger WHERE RunID = ? AND Status = 'sending'", (run_id,))
+        cursor.execute('''
+            UPDATE ReminderRuns SET Status = ?, FinishedAt = ?, HeartbeatAt = ?, Claimed = ?, Resumed = ?,
+                Digests = ?, Sent = ?, Failed = ?, NoEmail = ?, Retries = ?, Sessions = ?, DurationMs = ?, Error = ?
+            WHERE RunID = ?
+        ''', (status, time.time(), time.time(), stats['claimed'], stats['resumed'], stats['digests'],
+              stats['sent'], stats['failed'], stats['no_email'], stats['retries'], stats['sessions'],
+              stats['duration_ms'], error, run_id))
+        conn.commit()
+        conn.close()
+        
+        icon = '❌' if error else '⚠️' if stats['failed'] or stats['no_email'] else '✅'
+        print(f"{icon} Reminder run {run_id}: {stats['claimed']} reminders claimed "
+              f"({stats['resumed']} resumed), {stats['digests']} digests, {stats['sent']} sent, "
+              f"{stats['failed']} failed, {stats['no_email']} without email, "
+              f"{stats['duration_ms'] / 1000:.1f}s{f' - {error}' if error else ''}")
+        stats['status'], stats['error'] = status, error
+        return stats
+    
+    def run_reminder_daemon(self, interval=3600, days_ahead=3):
+        """Run reminders every `interval` seconds until interrupted"""
+        print(f"🤖 Reminder daemon started: every {interval:g}s, due-soon window {days_ahead} days")
+        try:
+            while True:
+                self.run_reminders(days_ahead)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("👋 Reminder daemon stopped")
+    
+    def get_reminder_runs(self, limit=20):
+        """Most recent reminder runs, newest first"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT RunID, StartedAt, Status, Claimed, Resumed, Digests, Sent, Failed, NoEmail, DurationMs, Error
+            FROM ReminderRuns
+            ORDER BY RunID DESC
+            LIMIT ?
+        ''', (limit,))
+        runs = cursor.fetchall()
+        conn.close()
+        return runs
     
     def extract_email(self, contact_info):
         """Extract email address from contact info string"""
@@ -223,7 +465,7 @@ Library Management System
         
         # Simple email regex pattern
         email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        emails = re.findall(email_pattern, contact_info)
+        emails = re.findall(email_pattern, contact_info or '')
         
         return emails[0] if emails else None
     
@@ -257,11 +499,12 @@ Library Management System
             print("1. 📋 View overdue books report")
             print("2. 📧 Send overdue reminders")
             print("3. 📅 Send due soon reminders")
-            print("4. ⚙️ Configure email settings")
-            print("5. 🧪 Test email configuration")
-            print("6. 🚪 Exit")
+            print("4. 📬 Send reminder digests (one email per member)")
+            print("5. ⚙️ Configure email settings")
+            print("6. 🧪 Test email configuration")
+            print("7. 🚪 Exit")
             
-            choice = input("\nEnter your choice (1-6): ").strip()
+            choice = input("\nEnter your choice (1-7): ").strip()
             
             if choice == '1':
                 self.display_overdue_report()
@@ -279,12 +522,19 @@ Library Management System
                     self.send_upcoming_due_reminders(days)
             
             elif choice == '4':
-                self.configure_email()
+                days = input("Include books due within how many days? (default: 3): ").strip()
+                days = int(days) if days.isdigit() else 3
+                confirm = input(f"Send one reminder per member for overdue books and books due within {days} days? (y/n): ")
+                if confirm.lower() == 'y':
+                    self.send_reminder_digests(days)
             
             elif choice == '5':
-                self.test_email_config()
+                self.configure_email()
             
             elif choice == '6':
+                self.test_email_config()
+            
+            elif choice == '7':
                 print("👋 Thank you for using the Library Reminder Chatbot!")
                 break
             
@@ -321,10 +571,42 @@ Library Management System
         else:
             print(f"❌ Test failed: {result}")
 
+def reminder_run_exit_code(run):
+    """Process exit status for a reminder run: 0 if clean, 1 if the run failed or every send
+    failed, 2 if only some sends failed"""
+    if run['error'] or (run['failed'] and not run['sent']):
+        return 1
+    return 2 if run['failed'] else 0
+
 def main():
+    parser = argparse.ArgumentParser(description='Library reminder chatbot')
+    parser.add_argument('--db', default='library.db')
+    parser.add_argument('--daemon', action='store_true', help='Send reminders on a schedule, without the menu')
+    parser.add_argument('--once', action='store_true',
+                        help='Do one unattended reminder run and exit (1 if it failed or sent nothing it tried to, '
+                             '2 if some sends failed)')
+    parser.add_argument('--interval', type=float, default=3600, help='Seconds between daemon runs')
+    parser.add_argument('--days-ahead', type=int, default=3)
+    parser.add_argument('--stats', action='store_true', help='Show recent reminder runs')
+    args = parser.parse_args()
+    
+    from migrations import migrate
+    migrate(args.db)
     # Initialize the chatbot with your existing database
-    chatbot = LibraryChatbot('library.db')
-    chatbot.chat_interface()
+    chatbot = LibraryChatbot(args.db)
+    if args.daemon:
+        chatbot.run_reminder_daemon(args.interval, args.days_ahead)
+    elif args.once:
+        run = chatbot.run_reminders(args.days_ahead)
+        raise SystemExit(reminder_run_exit_code(run))
+    elif args.stats:
+        for run_id, started, status, claimed, resumed, digests, sent, failed, no_email, duration, error in chatbot.get_reminder_runs():
+            started = datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{run_id:>5} {started} {status:<12} claimed {claimed or 0:>6} (resumed {resumed or 0}) "
+                  f"digests {digests or 0:>6} sent {sent or 0:>6} failed {failed or 0:>4} no email {no_email or 0:>4} "
+                  f"{(duration or 0) / 1000:>8.1f}s  {error or ''}")
+    else:
+        chatbot.chat_interface()
 
 if __name__ == "__main__":
     main()
@@ -1,27 +1,22 @@
-import sqlite3
-import smtplib
-from email.message import EmailMessage
+"""
+Unattended reminder run against the library database.
 
-# Connect to the database
-conn = sqlite3.connect('library.db')
-cursor = conn.cursor()
+Each run only reminds loans not yet notified at their current stage (due
+soon, overdue, final notice); see LibraryChatbot.run_reminders. Exits 1
+if the run failed or every send failed, 2 if some sends failed. For a
+long-running scheduler use:
 
-# Query database for loans due
-cursor.execute("SELECT students.email, loans.book_title FROM loans JOIN students ON loans.student_id = students.student_id WHERE loans.due_date < CURRENT_DATE")
-due_loans = cursor.fetchall()
+    python library_chatbot.py --daemon --interval 3600
+"""
+import os
+import sys
 
-# Send reminder emails
-for email, book_title in due_loans:
-    msg = EmailMessage()
-    msg.set_content(f"Reminder: Please return the book '{book_title}'.")
-    msg['Subject'] = 'Book Return Reminder'
-    msg['From'] = 'library@example.com'
-    msg['To'] = email
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-    # Send the message
-    with smtplib.SMTP('smtp.example.com') as server:
-        server.send_message(msg)
-
-# Close the database connection
-conn.close()
+from library_chatbot import LibraryChatbot, reminder_run_exit_code
+from migrations import migrate
 
+db_path = sys.argv[1] if len(sys.argv) > 1 else 'library.db'
+migrate(db_path)
+run = LibraryChatbot(db_path).run_reminders()
+sys.exit(reminder_run_exit_code(run))
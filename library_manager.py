@@ -1,6 +1,9 @@
 import sqlite3
 from datetime import datetime, timedelta
 
+from copies import checkout_copy, close_loan
+from holds import allocate_copies, claim_held_copy, read_hold_days
+
 class User:
     def __init__(self, username, password, role, name, email):
         self.username = username
@@ -60,8 +63,8 @@ class LibraryManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Check if book is available
-        cursor.execute('SELECT AvailabilityStatus FROM Books WHERE ISBN = ?', (isbn,))
+        # Check if book exists
+        cursor.execute('SELECT 1 FROM Books WHERE ISBN = ?', (isbn,))
         result = cursor.fetchone()
         
         if not result:
@@ -69,11 +72,6 @@ class LibraryManager:
             conn.close()
             return
         
-        if result[0] != 'Available':
-            print("Error: Book is not available!")
-            conn.close()
-            return
-        
         # Check if member exists
         cursor.execute('SELECT Name FROM Members WHERE MemberID = ?', (member_id,))
         member = cursor.fetchone()
@@ -83,19 +81,22 @@ class LibraryManager:
             conn.close()
             return
         
+        # The copy held for the member, else an available one off the shelf (the book's counts and status follow)
+        barcode = claim_held_copy(cursor, isbn, member_id) or checkout_copy(cursor, isbn)
+        if barcode is None:
+            print("Error: Book is not available!")
+            conn.rollback()
+            conn.close()
+            return
+        
         # Create loan record
         loan_date = datetime.now().strftime('%Y-%m-%d')
         due_date = (datetime.now() + timedelta(days=loan_days)).strftime('%Y-%m-%d')
         
         cursor.execute('''
-            INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate)
-            VALUES (?, ?, ?, ?)
-        ''', (isbn, member_id, loan_date, due_date))
-        
-        # Update book availability
-        cursor.execute('''
-            UPDATE Books SET AvailabilityStatus = 'Loaned' WHERE ISBN = ?
-        ''', (isbn,))
+            INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, CopyBarcode)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (isbn, member_id, loan_date, due_date, barcode))
         
         conn.commit()
         print(f"Book loaned successfully to {member[0]}. Due date: {due_date}")
@@ -119,16 +120,14 @@ class LibraryManager:
             conn.close()
             return
         
-        # Update loan record
-        return_date = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-            UPDATE Loans SET ReturnDate = ? WHERE LoanID = ?
-        ''', (return_date, loan[0]))
-        
-        # Update book availability
-        cursor.execute('''
-            UPDATE Books SET AvailabilityStatus = 'Available' WHERE ISBN = ?
-        ''', (isbn,))
+        # Put the copy back on the shelf and close the loan, unless someone else just did; the next hold
+        # in line gets the copy
+        if not close_loan(cursor, loan[0]):
+            print("Error: No active loan found for this book!")
+            conn.rollback()
+            conn.close()
+            return
+        allocate_copies(cursor, isbn, read_hold_days(cursor))
         
         conn.commit()
         print("Book returned successfully!")
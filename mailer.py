@@ -0,0 +1,242 @@
+"""
+Reminder Mail Delivery
+======================
+
+Sends batches of email over a small pool of long-lived SMTP sessions
+instead of connecting, doing STARTTLS and logging in once per message:
+
+- `workers` sender threads each own one session and reuse it for every
+  message they send (reconnecting after MAX_MESSAGES_PER_SESSION messages,
+  or when the server drops the connection)
+- messages are handed to the workers through a bounded queue, so a batch
+  can be a generator and is never materialised in full
+- transient failures (connection drops, timeouts, 4xx replies) are retried
+  with exponential backoff; permanent ones (5xx, bad addresses) are not
+- send_all returns a DeliveryReport with counts, retries, sessions opened
+  and messages/sec; an exception raised by its on_result callback is
+  recorded there and doesn't stop the worker that called it
+
+Configured by the same dict as LibraryChatbot.email_config (read from
+email_config.json by load_email_config): smtp_server, smtp_port,
+sender_email, sender_password, plus optional use_tls (default true),
+workers, max_retries and timeout.
+"""
+
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+MAX_MESSAGES_PER_SESSION = 100
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+# Refusals that smtplib answers with RSET, leaving the session usable
+SESSION_SAFE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def is_transient(error):
+    """Whether a failed send is worth retrying"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def load_email_config(path='email_config.json'):
+    """The SMTP settings in email_config.json, or None if there is no such file"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def build_message(sender, recipient, subject, body):
+    msg = EmailMessage()
+    msg.set_content(body)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    return msg
+
+
+class SMTPSession:
+    """One SMTP connection, opened on first use and reused until it fails or hits its message limit"""
+
+    def __init__(self, config, timeout=30, on_connect=None):
+        self.config = config
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.smtp = None
+        self.sent = 0
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'], timeout=self.timeout)
+        try:
+            if self.config.get('use_tls', True):
+                smtp.starttls()
+            if self.config.get('sender_password'):
+                smtp.login(self.config['sender_email'], self.config['sender_password'])
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.sent = 0
+        if self.on_connect:
+            self.on_connect()
+
+    def send(self, msg):
+        if self.smtp is None:
+            self.connect()
+        self.smtp.send_message(msg)
+        self.sent += 1
+        if self.sent >= MAX_MESSAGES_PER_SESSION:
+            self.close()
+
+    def discard_if_broken(self, error):
+        """Drop the connection after a failure that may have left it unusable"""
+        # smtplib closes the socket itself on a 421 reply
+        if not isinstance(error, SESSION_SAFE_ERRORS) or (self.smtp is not None and self.smtp.sock is None):
+            self.close()
+
+    def close(self):
+        """QUIT politely; a session that is already broken is just dropped"""
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+        self.smtp = None
+
+
+class DeliveryReport:
+    """Outcome of a send_all batch"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.sessions = 0
+        self.failures = []      # (key, error message)
+        self.callback_errors = []   # (key, error message) raised by on_result
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def count(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def add_failure(self, key, error):
+        with self._lock:
+            self.failed += 1
+            self.failures.append((key, f'{type(error).__name__}: {error}'))
+
+    def add_callback_error(self, key, error):
+        with self._lock:
+            self.callback_errors.append((key, f'{type(error).__name__}: {error}'))
+
+    @property
+    def messages_per_sec(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'sessions': self.sessions,
+            'callback_errors': len(self.callback_errors),
+            'elapsed_s': round(self.elapsed, 3),
+            'messages_per_sec': round(self.messages_per_sec, 1),
+        }
+
+    def summary(self):
+        return (f'{self.sent} emails sent, {self.failed} failed, {self.retries} retries over '
+                f'{self.sessions} SMTP sessions ({self.elapsed:.1f}s, {self.messages_per_sec:.1f} emails/s)')
+
+
+class Mailer:
+    """Concurrent SMTP delivery over persistent sessions with retry and backoff"""
+
+    def __init__(self, config, workers=None, max_retries=None, backoff=0.5, timeout=None):
+        self.config = config
+        self.workers = max(1, int(workers or config.get('workers', 4)))
+        self.max_retries = int(config.get('max_retries', 3) if max_retries is None else max_retries)
+        self.backoff = backoff
+        self.timeout = timeout or config.get('timeout', 30)
+
+    def message(self, recipient, subject, body):
+        return build_message(self.config['sender_email'], recipient, subject, body)
+
+    def _deliver(self, session, msg, report):
+        """Send one message, retrying transient failures; returns None or the final error"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                session.send(msg)
+                return None
+            except Exception as e:
+                session.discard_if_broken(e)
+                if attempt == self.max_retries or not is_transient(e):
+                    return e
+                report.count('retries')
+                # Exponential backoff with jitter so the workers don't retry in lockstep
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _worker(self, jobs, report, on_result):
+        session = SMTPSession(self.config, self.timeout, on_connect=lambda: report.count('sessions'))
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                key, msg = job
+                error = self._deliver(session, msg, report)
+                if error is None:
+                    report.count('sent')
+                else:
+                    report.add_failure(key, error)
+                if on_result:
+                    # A worker that died here would leave send_all blocked on the full queue
+                    try:
+                        on_result(key, error)
+                    except Exception as e:
+                        report.add_callback_error(key, e)
+        finally:
+            session.close()
+
+    def send_all(self, messages, on_result=None):
+        """Deliver (key, EmailMessage) pairs; on_result(key, error or None) is called as each one finishes
+
+        Exceptions from on_result end up in the report's callback_errors.
+        """
+        report = DeliveryReport()
+        start = time.perf_counter()
+        jobs = queue.Queue(maxsize=self.workers * 2)
+        threads = [threading.Thread(target=self._worker, args=(jobs, report, on_result), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for job in messages:
+                jobs.put(job)
+        finally:
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+            report.elapsed = time.perf_counter() - start
+        return report
+
+    def send(self, recipient, subject, body):
+        """Send a single message; returns (success, error message or None)"""
+        report = DeliveryReport()
+        session = SMTPSession(self.config, self.timeout)
+        try:
+            error = self._deliver(session, self.message(recipient, subject, body), report)
+        finally:
+            session.close()
+        return error is None, None if error is None else str(error)
@@ -0,0 +1,606 @@
+"""
+Versioned Schema Migrations
+===========================
+
+Each migration is (version, name, function). The runner records applied
+versions in the `schema_version` table and only runs the ones that are
+missing, in version order, inside a single BEGIN IMMEDIATE transaction so
+concurrent gunicorn workers starting at the same time cannot both apply
+the same migration.
+
+Version 0 is the baseline schema. It is written to be a no-op against a
+database that already has those tables, so existing library.db files adopt
+the runner without any manual step.
+
+Migrations run once per deploy/startup (app.py calls migrate() at import,
+before creating the shared LibraryManager); constructing a LibraryManager
+never touches DDL. Run them by hand with:
+    python migrations.py [library.db]
+"""
+
+import sqlite3
+import sys
+
+from copies import create_copies_schema
+from data_versions import create_version_triggers
+from holds import create_hold_expiry_index, create_hold_queue_schema
+from inbox import create_inbox_schema
+from outbox import create_outbox_schema
+from popularity import create_popularity_tables
+from stat_counters import create_counter_triggers
+
+
+# ===== MIGRATIONS =====
+def _baseline_schema(cursor):
+    """Tables and seed data previously created by LibraryManager.__init__ on every construction"""
+    # Core tables (originally created by database.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Books (
+            ISBN TEXT PRIMARY KEY,
+            Title TEXT NOT NULL,
+            Author TEXT NOT NULL,
+            Genre TEXT,
+            PublicationYear INT,
+            AvailabilityStatus TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Members (
+            MemberID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name TEXT NOT NULL,
+            ContactInfo TEXT,
+            RegistrationDate DATE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Loans (
+            LoanID INTEGER PRIMARY KEY AUTOINCREMENT,
+            BookID TEXT NOT NULL,
+            MemberID INT NOT NULL,
+            LoanDate DATE,
+            DueDate DATE,
+            ReturnDate DATE,
+            FOREIGN KEY (BookID) REFERENCES Books(ISBN),
+            FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
+        )
+    ''')
+
+    # Create Users table for authentication
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Users (
+            UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Username TEXT UNIQUE NOT NULL,
+            Password TEXT NOT NULL,
+            UserType TEXT NOT NULL,  -- 'student' or 'librarian'
+            MemberID INTEGER,  -- Link to Members table for students
+            Name TEXT NOT NULL,
+            Email TEXT,
+            CreatedDate DATE DEFAULT CURRENT_DATE,
+            FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
+        )
+    ''')
+
+    # Create default users if they don't exist
+    cursor.execute('SELECT COUNT(*) FROM Users')
+    if cursor.fetchone()[0] == 0:
+        # Default librarian
+        cursor.execute('''
+            INSERT INTO Users (Username, Password, UserType, Name, Email)
+            VALUES ('librarian', 'admin123', 'librarian', 'Library Administrator', 'admin@library.com')
+        ''')
+        
+        # Default student (will be linked to member after member creation)
+        cursor.execute('''
+            INSERT INTO Users (Username, Password, UserType, Name, Email)
+            VALUES ('student', 'student123', 'student', 'John Doe', 'john.doe@student.edu')
+        ''')
+
+    # Enhanced Messages table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Messages (
+            MessageID INTEGER PRIMARY KEY AUTOINCREMENT,
+            FromUserID INTEGER,
+            ToUserID INTEGER,
+            ToUserType TEXT,
+            Subject TEXT,
+            Message TEXT,
+            SentDate DATETIME DEFAULT CURRENT_TIMESTAMP,
+            IsRead BOOLEAN DEFAULT 0,
+            MessageType TEXT DEFAULT 'general',
+            Priority TEXT DEFAULT 'normal',
+            FOREIGN KEY (FromUserID) REFERENCES Users(UserID),
+            FOREIGN KEY (ToUserID) REFERENCES Users(UserID)
+        )
+    ''')
+
+    # Book Categories/Genres management
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BookCategories (
+            CategoryID INTEGER PRIMARY KEY AUTOINCREMENT,
+            CategoryName TEXT UNIQUE NOT NULL,
+            Description TEXT,
+            CreatedDate DATE DEFAULT CURRENT_DATE
+        )
+    ''')
+
+    # Book Reservations
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BookReservations (
+            ReservationID INTEGER PRIMARY KEY AUTOINCREMENT,
+            BookID TEXT NOT NULL,
+            MemberID INTEGER NOT NULL,
+            ReservationDate DATE DEFAULT CURRENT_DATE,
+            ExpiryDate DATE,
+            Status TEXT DEFAULT 'active',
+            FOREIGN KEY (BookID) REFERENCES Books(ISBN),
+            FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
+        )
+    ''')
+
+    # Member Tiers/Categories
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS MemberTiers (
+            TierID INTEGER PRIMARY KEY AUTOINCREMENT,
+            TierName TEXT UNIQUE NOT NULL,
+            MaxBooks INTEGER DEFAULT 3,
+            LoanPeriodDays INTEGER DEFAULT 14,
+            FinePerDay DECIMAL(5,2) DEFAULT 0.50,
+            Description TEXT
+        )
+    ''')
+
+    # Enhanced Members table (add columns if not exist)
+    cursor.execute('PRAGMA table_info(Members)')
+    existing_columns = [column[1] for column in cursor.fetchall()]
+
+    if 'MembershipTier' not in existing_columns:
+        cursor.execute('ALTER TABLE Members ADD COLUMN MembershipTier INTEGER DEFAULT 1')
+    if 'Address' not in existing_columns:
+        cursor.execute('ALTER TABLE Members ADD COLUMN Address TEXT')
+    if 'DateOfBirth' not in existing_columns:
+        cursor.execute('ALTER TABLE Members ADD COLUMN DateOfBirth DATE')
+    if 'Status' not in existing_columns:
+        cursor.execute('ALTER TABLE Members ADD COLUMN Status TEXT DEFAULT "active"')
+    if 'PhotoPath' not in existing_columns:
+        cursor.execute('ALTER TABLE Members ADD COLUMN PhotoPath TEXT')
+
+    # Fines and Fees
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Fines (
+            FineID INTEGER PRIMARY KEY AUTOINCREMENT,
+            MemberID INTEGER NOT NULL,
+            LoanID INTEGER,
+            FineType TEXT NOT NULL,
+            Amount DECIMAL(10,2) NOT NULL,
+            IssueDate DATE DEFAULT CURRENT_DATE,
+            DueDate DATE,
+            PaidDate DATE,
+            Status TEXT DEFAULT 'unpaid',
+            Description TEXT,
+            FOREIGN KEY (MemberID) REFERENCES Members(MemberID),
+            FOREIGN KEY (LoanID) REFERENCES Loans(LoanID)
+        )
+    ''')
+
+    # System Settings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS SystemSettings (
+            SettingID INTEGER PRIMARY KEY AUTOINCREMENT,
+            SettingKey TEXT UNIQUE NOT NULL,
+            SettingValue TEXT,
+            Description TEXT,
+            LastModified DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Audit Logs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS AuditLogs (
+            LogID INTEGER PRIMARY KEY AUTOINCREMENT,
+            UserID INTEGER,
+            Action TEXT NOT NULL,
+            TableName TEXT,
+            RecordID INTEGER,
+            OldValues TEXT,
+            NewValues TEXT,
+            Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            IPAddress TEXT,
+            FOREIGN KEY (UserID) REFERENCES Users(UserID)
+        )
+    ''')
+
+    # Announcements
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Announcements (
+            AnnouncementID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Title TEXT NOT NULL,
+            Content TEXT NOT NULL,
+            CreatedBy INTEGER NOT NULL,
+            CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ExpiryDate DATE,
+            Priority TEXT DEFAULT 'normal',
+            Status TEXT DEFAULT 'active',
+            TargetAudience TEXT DEFAULT 'all',
+            FOREIGN KEY (CreatedBy) REFERENCES Users(UserID)
+        )
+    ''')
+
+    # Book Reviews/Ratings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BookReviews (
+            ReviewID INTEGER PRIMARY KEY AUTOINCREMENT,
+            BookID TEXT NOT NULL,
+            MemberID INTEGER NOT NULL,
+            Rating INTEGER CHECK(Rating >= 1 AND Rating <= 5),
+            Review TEXT,
+            ReviewDate DATE DEFAULT CURRENT_DATE,
+            FOREIGN KEY (BookID) REFERENCES Books(ISBN),
+            FOREIGN KEY (MemberID) REFERENCES Members(MemberID)
+        )
+    ''')
+
+    # Insert default data
+    cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
+                  ('Standard', 3, 14, 0.50, 'Standard membership with basic privileges'))
+    cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
+                  ('Premium', 5, 21, 0.25, 'Premium membership with extended privileges'))
+    cursor.execute('INSERT OR IGNORE INTO MemberTiers (TierName, MaxBooks, LoanPeriodDays, FinePerDay, Description) VALUES (?, ?, ?, ?, ?)',
+                  ('Student', 4, 30, 0.10, 'Student membership with educational benefits'))
+
+    # Insert default book categories
+    categories = ['Fiction', 'Non-Fiction', 'Science', 'Technology', 'History', 'Biography', 
+                 'Romance', 'Mystery', 'Fantasy', 'Educational', 'Reference', 'Children']
+    for category in categories:
+        cursor.execute('INSERT OR IGNORE INTO BookCategories (CategoryName) VALUES (?)', (category,))
+
+    # Insert default system settings
+    settings = [
+        ('default_loan_period', '14', 'Default loan period in days'),
+        ('max_renewals', '2', 'Maximum number of renewals allowed'),
+        ('fine_per_day', '0.50', 'Fine amount per day for overdue books'),
+        ('max_books_per_member', '3', 'Maximum books a member can borrow'),
+        ('library_name', 'Lancaster University Library', 'Name of the library'),
+        ('library_email', 'info@citylibrary.com', 'Library contact email'),
+        ('library_phone', '(555) 123-4567', 'Library contact phone'),
+        ('reservation_hold_days', '3', 'Days to hold a reserved book')
+    ]
+
+    for key, value, desc in settings:
+        cursor.execute('INSERT OR IGNORE INTO SystemSettings (SettingKey, SettingValue, Description) VALUES (?, ?, ?)',
+                      (key, value, desc))
+
+
+def _hot_path_indexes(cursor):
+    """Secondary indexes for the Loans, Fines, Messages, BookReservations and AuditLogs hot paths"""
+    statements = [
+        # get_student_loans / get_student_recent_returns: WHERE MemberID = ? ORDER BY LoanDate
+        'CREATE INDEX IF NOT EXISTS idx_loans_member_loandate ON Loans(MemberID, LoanDate)',
+        # Per-member active/overdue counts (member_loan_details, remove_member): covering
+        'CREATE INDEX IF NOT EXISTS idx_loans_member_active ON Loans(MemberID, ReturnDate, DueDate)',
+        # get_overdue_loans / get_active_loans / overdue counts: open loans only
+        'CREATE INDEX IF NOT EXISTS idx_loans_open_duedate ON Loans(DueDate) WHERE ReturnDate IS NULL',
+        # /api/recent_returns: latest returns first
+        'CREATE INDEX IF NOT EXISTS idx_loans_returned ON Loans(ReturnDate) WHERE ReturnDate IS NOT NULL',
+        # Joins from Books into Loans (popular books, FK lookups)
+        'CREATE INDEX IF NOT EXISTS idx_loans_book ON Loans(BookID)',
+
+        # get_member_fines: WHERE MemberID = ? ORDER BY IssueDate DESC
+        'CREATE INDEX IF NOT EXISTS idx_fines_member_issued ON Fines(MemberID, IssueDate)',
+        # calculate_overdue_fines NOT EXISTS probe and the Loans join on /fines
+        'CREATE INDEX IF NOT EXISTS idx_fines_loan_type ON Fines(LoanID, FineType)',
+        # /fines page: unpaid fines newest first
+        "CREATE INDEX IF NOT EXISTS idx_fines_unpaid_issued ON Fines(IssueDate) WHERE Status = 'unpaid'",
+
+        # get_user_messages: direct and role-addressed inboxes, newest first
+        'CREATE INDEX IF NOT EXISTS idx_messages_to_user_sent ON Messages(ToUserID, SentDate)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_to_type_sent ON Messages(ToUserType, SentDate)',
+
+        # create_reservation duplicate check / get_member_reservations
+        'CREATE INDEX IF NOT EXISTS idx_reservations_book_status ON BookReservations(BookID, Status)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_member_status '
+        'ON BookReservations(MemberID, Status, ReservationDate)',
+
+        # get_audit_logs: ORDER BY Timestamp DESC, optionally per user
+        'CREATE INDEX IF NOT EXISTS idx_auditlogs_timestamp ON AuditLogs(Timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_auditlogs_user_timestamp ON AuditLogs(UserID, Timestamp)',
+
+        # Users looked up by member (return_book, notifications) and by role (librarian fan-out)
+        'CREATE INDEX IF NOT EXISTS idx_users_member ON Users(MemberID)',
+        'CREATE INDEX IF NOT EXISTS idx_users_type ON Users(UserType)',
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _books_fulltext_index(cursor):
+    """FTS5 catalog index over Books (see catalog_search.py), kept in sync by triggers"""
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS BooksFTS USING fts5(
+            Title, Author, Genre,
+            content='Books', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_books_fts_insert AFTER INSERT ON Books BEGIN
+            INSERT INTO BooksFTS (rowid, Title, Author, Genre)
+            VALUES (new.rowid, new.Title, new.Author, new.Genre);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_books_fts_delete AFTER DELETE ON Books BEGIN
+            INSERT INTO BooksFTS (BooksFTS, rowid, Title, Author, Genre)
+            VALUES ('delete', old.rowid, old.Title, old.Author, old.Genre);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_books_fts_update
+        AFTER UPDATE OF Title, Author, Genre ON Books BEGIN
+            INSERT INTO BooksFTS (BooksFTS, rowid, Title, Author, Genre)
+            VALUES ('delete', old.rowid, old.Title, old.Author, old.Genre);
+            INSERT INTO BooksFTS (rowid, Title, Author, Genre)
+            VALUES (new.rowid, new.Title, new.Author, new.Genre);
+        END
+    ''')
+    cursor.execute("INSERT INTO BooksFTS (BooksFTS) VALUES ('rebuild')")
+
+
+def _keyset_pagination_indexes(cursor):
+    """Indexes matching the sort keys of the keyset-paginated listings (see pagination.py)"""
+    statements = [
+        # /books and /api/books: ORDER BY Title, ISBN seeking on (Title, ISBN)
+        'CREATE INDEX IF NOT EXISTS idx_books_title_isbn ON Books(Title, ISBN)',
+        # Student dashboard/catalog: available books only
+        'CREATE INDEX IF NOT EXISTS idx_books_available_title_isbn ON Books(Title, ISBN) '
+        "WHERE AvailabilityStatus = 'Available'",
+        # /members and /api/members
+        'CREATE INDEX IF NOT EXISTS idx_members_name_id ON Members(Name, MemberID)',
+        # Loans (DueDate, LoanID) and unpaid Fines (IssueDate, FineID) are already served by
+        # idx_loans_open_duedate / idx_fines_unpaid_issued: the rowid is their trailing column
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def _dashboard_counters(cursor):
+    """Trigger-maintained StatCounters for get_dashboard_stats (see stat_counters.py)"""
+    # new_members_month is a range count over RegistrationDate
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_registration ON Members(RegistrationDate)')
+    create_counter_triggers(cursor)
+
+
+def _book_popularity(cursor):
+    """Trigger-maintained BookPopularity / BookLoanDaily for get_popular_books (see popularity.py)"""
+    create_popularity_tables(cursor)
+
+
+def _fine_accrual_and_job_runs(cursor):
+    """Fines.AccruedThrough for incremental fine accrual, and the JobRuns ledger used by jobs.py"""
+    cursor.execute('PRAGMA table_info(Fines)')
+    if 'AccruedThrough' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE Fines ADD COLUMN AccruedThrough DATE')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS JobRuns (
+            RunID INTEGER PRIMARY KEY AUTOINCREMENT,
+            JobName TEXT NOT NULL,
+            RunKey TEXT NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'running',
+            StartedAt REAL NOT NULL,
+            FinishedAt REAL,
+            DurationMs REAL,
+            Result TEXT,
+            Error TEXT,
+            UNIQUE (JobName, RunKey)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobruns_job_started ON JobRuns(JobName, StartedAt)')
+
+
+def _import_runs(cursor):
+    """ImportRuns: one row per bulk import with its totals and first errors (see bulk_import.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ImportRuns (
+            ImportID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ImportType TEXT NOT NULL,
+            FileName TEXT,
+            ImportedBy INTEGER,
+            StartedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            Processed INTEGER NOT NULL DEFAULT 0,
+            Inserted INTEGER NOT NULL DEFAULT 0,
+            Updated INTEGER NOT NULL DEFAULT 0,
+            Skipped INTEGER NOT NULL DEFAULT 0,
+            Failed INTEGER NOT NULL DEFAULT 0,
+            DurationMs REAL,
+            Errors TEXT,
+            FOREIGN KEY (ImportedBy) REFERENCES Users(UserID)
+        )
+    ''')
+
+
+def _reminder_ledger(cursor):
+    """ReminderLedger / ReminderRuns for unattended reminder runs (see LibraryChatbot.run_reminders)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ReminderLedger (
+            LoanID INTEGER NOT NULL,
+            Kind TEXT NOT NULL,
+            RunID INTEGER NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'sending',
+            ClaimedAt REAL NOT NULL,
+            SentAt REAL,
+            PRIMARY KEY (LoanID, Kind),
+            FOREIGN KEY (LoanID) REFERENCES Loans(LoanID)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminder_ledger_run ON ReminderLedger(RunID, Status)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ReminderRuns (
+            RunID INTEGER PRIMARY KEY AUTOINCREMENT,
+            StartedAt REAL NOT NULL,
+            HeartbeatAt REAL NOT NULL,
+            FinishedAt REAL,
+            Status TEXT NOT NULL DEFAULT 'running',
+            Claimed INTEGER,
+            Resumed INTEGER,
+            Digests INTEGER,
+            Sent INTEGER,
+            Failed INTEGER,
+            NoEmail INTEGER,
+            Retries INTEGER,
+            Sessions INTEGER,
+            DurationMs REAL,
+            Error TEXT
+        )
+    ''')
+
+
+def _audit_retention(cursor):
+    """Action prefix index and retention window for the audit archive (see audit_archive.py)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_auditlogs_action ON AuditLogs(lower(Action))')
+    cursor.execute('INSERT OR IGNORE INTO SystemSettings (SettingKey, SettingValue, Description) VALUES (?, ?, ?)',
+                   ('audit_retention_days', '90', 'Days audit logs stay in the database before being archived'))
+
+
+def _message_recipients(cursor):
+    """MessageRecipients: per-recipient delivery/read state of role-addressed (broadcast) messages"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS MessageRecipients (
+            UserID INTEGER NOT NULL,
+            MessageID INTEGER NOT NULL,
+            DeliveredAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ReadAt DATETIME,
+            PRIMARY KEY (UserID, MessageID),
+            FOREIGN KEY (UserID) REFERENCES Users(UserID),
+            FOREIGN KEY (MessageID) REFERENCES Messages(MessageID)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_recipients_message ON MessageRecipients(MessageID)')
+    # Existing role-addressed messages go to everyone currently in that role
+    cursor.execute('''
+        INSERT OR IGNORE INTO MessageRecipients (UserID, MessageID, DeliveredAt, ReadAt)
+        SELECT u.UserID, m.MessageID, m.SentDate, CASE WHEN m.IsRead THEN m.SentDate END
+        FROM Messages m
+        JOIN Users u ON u.UserType = m.ToUserType
+        WHERE m.ToUserID IS NULL
+    ''')
+
+
+def _message_inbox(cursor):
+    """Per-recipient inbox rows for direct messages too, inbox indexes and unread counters"""
+    create_inbox_schema(cursor)
+
+
+def _table_versions(cursor):
+    """Per-table change counters behind the JSON endpoints' ETags"""
+    create_version_triggers(cursor)
+
+
+def _book_copies(cursor):
+    """Per-copy inventory with maintained per-ISBN availability counts"""
+    create_copies_schema(cursor)
+
+
+def _hold_queue(cursor):
+    """FIFO hold queue per title with copies allocated to it"""
+    create_hold_queue_schema(cursor)
+
+
+def _open_loan_copies(cursor):
+    """Find the open loan of a scanned copy by barcode"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_loans_open_copy ON Loans(CopyBarcode) WHERE ReturnDate IS NULL')
+
+
+def _notification_outbox(cursor):
+    """Outbox for notifications queued with the change they describe (see outbox.py)"""
+    create_outbox_schema(cursor)
+
+
+def _hold_expiry_index(cursor):
+    """Sweep ready holds by their stored ExpiryDate"""
+    create_hold_expiry_index(cursor)
+
+
+MIGRATIONS = [
+    (0, 'baseline schema and seed data', _baseline_schema),
+    (1, 'hot-path secondary indexes', _hot_path_indexes),
+    (2, 'FTS5 full-text index for the book catalog', _books_fulltext_index),
+    (3, 'keyset pagination indexes', _keyset_pagination_indexes),
+    (4, 'trigger-maintained dashboard counters', _dashboard_counters),
+    (5, 'precomputed book popularity', _book_popularity),
+    (6, 'incremental fine accrual and job runs', _fine_accrual_and_job_runs),
+    (7, 'bulk import history', _import_runs),
+    (8, 'reminder ledger and runs', _reminder_ledger),
+    (9, 'audit log retention', _audit_retention),
+    (10, 'broadcast message recipients', _message_recipients),
+    (11, 'indexed inbox and unread counters', _message_inbox),
+    (12, 'table versions for conditional GETs', _table_versions),
+    (13, 'book copies and availability counts', _book_copies),
+    (14, 'hold queue', _hold_queue),
+    (15, 'open loans by copy barcode', _open_loan_copies),
+    (16, 'notification outbox', _notification_outbox),
+    (17, 'hold expiry index', _hold_expiry_index),
+]
+
+
+# ===== RUNNER =====
+def ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            Version INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL,
+            AppliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def applied_versions(conn):
+    """Set of migration versions recorded in schema_version"""
+    try:
+        return {row[0] for row in conn.execute('SELECT Version FROM schema_version')}
+    except sqlite3.OperationalError:
+        return set()
+
+
+def pending_migrations(conn, migrations=None):
+    migrations = MIGRATIONS if migrations is None else migrations
+    done = applied_versions(conn)
+    return [m for m in sorted(migrations, key=lambda m: m[0]) if m[0] not in done]
+
+
+def migrate(db_name='library.db', migrations=None, verbose=False):
+    """Apply every pending migration; returns the list of (version, name) applied"""
+    migrations = MIGRATIONS if migrations is None else migrations
+    conn = sqlite3.connect(db_name, timeout=30)
+    conn.isolation_level = None  # transactions are managed explicitly below
+    cursor = conn.cursor()
+    applied = []
+    try:
+        # Cheap check first so an up-to-date database never takes the write lock
+        if not pending_migrations(conn, migrations):
+            return applied
+
+        cursor.execute('BEGIN IMMEDIATE')
+        ensure_version_table(cursor)
+        for version, name, apply in pending_migrations(conn, migrations):
+            if verbose:
+                print(f'Applying migration {version}: {name}')
+            apply(cursor)
+            cursor.execute('INSERT INTO schema_version (Version, Name) VALUES (?, ?)', (version, name))
+            applied.append((version, name))
+        cursor.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return applied
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'library.db'
+    done = migrate(db_path, verbose=True)
+    if not done:
+        print('✅ Schema is up to date')
+    else:
+        print(f'✅ Applied {len(done)} migration(s)')
@@ -0,0 +1,392 @@
+"""
+Notification Outbox
+===================
+
+Request handlers don't render or send notifications any more. They call
+enqueue() with the cursor of the transaction that makes the change, so the
+Outbox row commits (or rolls back) together with it, and return. Rendering
+and delivery happen in deliver_pending(), run by:
+
+- OutboxWorker, a background thread per web worker, woken with wake() after
+  a commit that queued something and otherwise polling every `poll_interval`
+  seconds
+- the 'deliver_outbox' job (jobs.py), for rows left behind by a worker that
+  stopped
+
+Each notification gets one row per channel: 'inbox' rows become Messages,
+'email' rows are sent through Mailer with the same settings as the reminder
+emails (email_config.json). A worker claims due rows with one conditional
+UPDATE ... RETURNING, so two workers never deliver the same row; a claim
+older than CLAIM_TIMEOUT belongs to a worker that died and is taken over.
+
+- inbox delivery is exactly-once: the Messages row carries the OutboxID
+  (unique) and is inserted in the transaction that marks the row sent
+- an email can't join a transaction; the outcomes of a batch's emails are
+  collected as the SMTP server answers and written in one transaction
+  once the batch is done (never from the mail sender threads), and each
+  Message-ID is derived from the OutboxID, so the duplicates possible (a
+  crash in between) are recognisable as such
+- transient failures are retried with exponential backoff and marked
+  'failed' after MAX_ATTEMPTS, permanent ones straight away; email rows are marked 'skipped' while no
+  email settings are configured
+
+Templates are keyed by the row's Kind and render its JSON payload into
+(subject, body, MessageType, Priority).
+"""
+
+import json
+import os
+import threading
+import time
+
+from db_pool import run_immediate
+from mailer import Mailer, is_transient, load_email_config
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30          # seconds before the first retry, doubling after each attempt
+CLAIM_TIMEOUT = 600         # seconds a claim is held before another worker may take it over
+
+NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+
+INSERT_SQL = '''
+    INSERT INTO Outbox (Kind, Channel, FromUserID, ToUserID, Email, Payload)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+# The email copy of a user's notification, if their account has an address
+INSERT_USER_EMAIL_SQL = '''
+    INSERT INTO Outbox (Kind, Channel, FromUserID, ToUserID, Email, Payload)
+    SELECT ?, 'email', ?, UserID, Email, ? FROM Users WHERE UserID = ? AND Email LIKE '%_@_%'
+'''
+
+
+def create_outbox_schema(cursor):
+    """Outbox table and indexes; Messages.OutboxID, unique, for exactly-once inbox delivery"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            OutboxID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Kind TEXT NOT NULL,
+            Channel TEXT NOT NULL,
+            FromUserID INTEGER,
+            ToUserID INTEGER,
+            Email TEXT,
+            Payload TEXT NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'pending',
+            Attempts INTEGER NOT NULL DEFAULT 0,
+            NextAttemptAt REAL NOT NULL DEFAULT {NOW_SQL},
+            ClaimedBy TEXT,
+            ClaimedAt REAL,
+            CreatedAt REAL NOT NULL DEFAULT {NOW_SQL},
+            SentAt REAL,
+            LastError TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON Outbox(NextAttemptAt) WHERE Status = 'pending'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_claimed ON Outbox(ClaimedAt) WHERE Status = 'sending'")
+    cursor.execute('PRAGMA table_info(Messages)')
+    if 'OutboxID' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE Messages ADD COLUMN OutboxID INTEGER')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_outbox ON Messages(OutboxID) '
+                   'WHERE OutboxID IS NOT NULL')
+
+
+# ===== TEMPLATES =====
+def _return_confirmation(payload):
+    message = f"""Book Return Confirmation
+
+Dear {payload['member_name']},
+
+Your book has been successfully returned to the library:
+
+📚 Book Details:
+            - Title: "{payload['title']}"
+            - Author: {payload['author']}
+            - ISBN: {payload['isbn']}
+            - Return Date: {payload['return_date']}
+
+Thank you for returning your book on time!
+
+Best regards,
+            Library Staff"""
+    return f"Book Return Confirmation: {payload['title']}", message, 'return_confirmation', 'normal'
+
+
+def _request_approved(payload):
+    message = (f'Good news! Your requested book "{payload["title"]}" by {payload["author"]} has been added to our '
+               f'library and is now loaned to you. Please visit the library to collect it.')
+    return f"Book Request Approved: {payload['title']}", message, 'librarian_reply', 'high'
+
+
+# Kind -> function(payload) returning (subject, body, MessageType, Priority)
+TEMPLATES = {
+    'return_confirmation': _return_confirmation,
+    'request_approved': _request_approved,
+}
+
+
+def render(kind, payload):
+    return TEMPLATES[kind](payload)
+
+
+# ===== ENQUEUE =====
+def enqueue_many(cursor, notifications):
+    """Queue (kind, payload, to_user_id, email, from_user_id) notifications in the caller's transaction:
+    one row for the inbox of to_user_id, plus one for its account's email address, or for `email` if given"""
+    rows, user_emails = [], []
+    for kind, payload, to_user_id, email, from_user_id in notifications:
+        if kind not in TEMPLATES:
+            raise ValueError(f'Unknown notification kind: {kind}')
+        data = json.dumps(payload)
+        if to_user_id:
+            rows.append((kind, 'inbox', from_user_id, to_user_id, None, data))
+        if email:
+            rows.append((kind, 'email', from_user_id, to_user_id, email, data))
+        elif to_user_id:
+            user_emails.append((kind, from_user_id, data, to_user_id))
+    cursor.executemany(INSERT_SQL, rows)
+    cursor.executemany(INSERT_USER_EMAIL_SQL, user_emails)
+
+
+def enqueue(cursor, kind, payload, to_user_id=None, email=None, from_user_id=None):
+    """Queue one notification in the caller's transaction (see enqueue_many)"""
+    return enqueue_many(cursor, [(kind, payload, to_user_id, email, from_user_id)])
+
+
+# ===== DELIVERY =====
+def claim_due(conn, worker_id, limit=BATCH_SIZE):
+    """Claim up to `limit` due rows (and rows whose claim timed out) for worker_id"""
+    now = time.time()
+    rows = conn.execute('''
+        UPDATE Outbox SET Status = 'sending', ClaimedBy = ?, ClaimedAt = ?, Attempts = Attempts + 1
+        WHERE OutboxID IN (
+            SELECT OutboxID FROM Outbox WHERE Status = 'pending' AND NextAttemptAt <= ?
+            UNION ALL
+            SELECT OutboxID FROM Outbox WHERE Status = 'sending' AND ClaimedAt < ?
+            ORDER BY 1 LIMIT ?
+        )
+        RETURNING OutboxID, Kind, Channel, FromUserID, ToUserID, Email, Payload, Attempts
+    ''', (worker_id, now, now, now - CLAIM_TIMEOUT, limit)).fetchall()
+    conn.commit()
+    return sorted(rows)
+
+
+def _outcome(outbox_id, attempts, error=None, permanent=False):
+    """(OutboxID, Attempts, new Status, error) for a delivery attempt"""
+    if error is None:
+        return outbox_id, attempts, 'sent', None
+    return outbox_id, attempts, 'failed' if permanent or attempts >= MAX_ATTEMPTS else 'pending', error
+
+
+def _finish(cursor, worker_id, outcomes):
+    """Record outcomes of rows worker_id still holds; rows to retry wait out their backoff"""
+    now = time.time()
+    cursor.executemany('''
+        UPDATE Outbox SET Status = ?, SentAt = ?, NextAttemptAt = ?, LastError = ?, ClaimedBy = NULL
+        WHERE OutboxID = ? AND Status = 'sending' AND ClaimedBy = ?
+    ''', [(status, now if status == 'sent' else None, now + RETRY_BACKOFF * 2 ** (attempts - 1), error,
+           outbox_id, worker_id) for outbox_id, attempts, status, error in outcomes])
+
+
+def _render(row):
+    """(subject, body, MessageType, Priority) of a claimed row, or the error that stopped it rendering"""
+    try:
+        return render(row[1], json.loads(row[6])), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _deliver_inbox(conn, worker_id, rows):
+    """Insert the Messages of claimed inbox rows and mark them sent, in one transaction"""
+    messages, outcomes = [], []
+    for row in rows:
+        outbox_id, _, _, from_user_id, to_user_id, _, _, attempts = row
+        rendered, error = _render(row)
+        if error:
+            outcomes.append(_outcome(outbox_id, attempts, error, permanent=True))
+            continue
+        subject, body, message_type, priority = rendered
+        messages.append((from_user_id, to_user_id, subject, body, message_type, priority, outbox_id))
+        outcomes.append(_outcome(outbox_id, attempts))
+
+    def work(cursor):
+        # A row delivered by a worker whose claim then timed out already has its message: never a second one
+        cursor.executemany('''
+            INSERT INTO Messages (FromUserID, ToUserID, Subject, Message, MessageType, Priority, OutboxID)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+        ''', messages)
+        _finish(cursor, worker_id, outcomes)
+
+    if rows:
+        run_immediate(conn, work)
+    return outcomes
+
+
+def _deliver_email(pool, worker_id, rows, mail_config):
+    """Send claimed email rows, then record what the server answered for each in one transaction"""
+    if not mail_config:
+        outcomes = [(row[0], row[7], 'skipped', 'Email delivery is not configured') for row in rows]
+    else:
+        outcomes = _send_emails(rows, mail_config)
+    if outcomes:
+        with pool.connection() as conn:
+            run_immediate(conn, lambda cursor: _finish(cursor, worker_id, outcomes))
+    return outcomes
+
+
+def _send_emails(rows, mail_config):
+    """Send claimed email rows; returns their outcomes, touching no database from the sender threads"""
+    mailer = Mailer(mail_config)
+    domain = mail_config['sender_email'].rpartition('@')[2] or 'library'
+    attempts = {row[0]: row[7] for row in rows}
+    outcomes = []
+    lock = threading.Lock()
+
+    def record(outbox_id, error, permanent=False):
+        with lock:
+            outcomes.append(_outcome(outbox_id, attempts[outbox_id], error, permanent))
+
+    def messages():
+        for row in rows:
+            rendered, error = _render(row)
+            if error:
+                record(row[0], error, permanent=True)
+                continue
+            msg = mailer.message(row[5], rendered[0], rendered[1])
+            msg['Message-ID'] = f'<outbox-{row[0]}@{domain}>'
+            yield row[0], msg
+
+    def on_result(outbox_id, error):
+        if error is None:
+            record(outbox_id, None)
+        else:
+            # A refused address won't be accepted on a later attempt either
+            record(outbox_id, f'{type(error).__name__}: {error}', permanent=not is_transient(error))
+
+    mailer.send_all(messages(), on_result)
+    return outcomes
+
+
+def deliver_pending(pool, worker_id, mail_config=None, limit=BATCH_SIZE):
+    """Claim and deliver one batch of due rows; returns how many were claimed and what became of them"""
+    with pool.connection() as conn:
+        rows = claim_due(conn, worker_id, limit)
+        outcomes = _deliver_inbox(conn, worker_id, [row for row in rows if row[2] == 'inbox'])
+    outcomes += _deliver_email(pool, worker_id, [row for row in rows if row[2] == 'email'], mail_config)
+    counts = {'claimed': len(rows), 'sent': 0, 'pending': 0, 'failed': 0, 'skipped': 0}
+    for _, _, status, _ in outcomes:
+        counts[status] += 1
+    return counts
+
+
+def outbox_stats(conn):
+    """Row counts by status and the age in seconds of the oldest undelivered row"""
+    stats = {status: count for status, count in conn.execute('SELECT Status, COUNT(*) FROM Outbox GROUP BY Status')}
+    oldest = conn.execute("SELECT MIN(CreatedAt) FROM Outbox WHERE Status IN ('pending', 'sending')").fetchone()[0]
+    stats['oldest_pending_s'] = round(time.time() - oldest, 3) if oldest else None
+    return stats
+
+
+class OutboxWorker:
+    """Background thread that drains the outbox of one database for this process"""
+
+    def __init__(self, pool, mail_config=None, poll_interval=5.0, batch_size=BATCH_SIZE):
+        self.pool = pool
+        self.mail_config = mail_config
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()           # one delivery cycle at a time in this process
+        self._state_lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self.worker_id = f'{os.getpid()}-{id(self):x}'
+        self._metrics = {'cycles': 0, 'claimed': 0, 'sent': 0, 'pending': 0, 'failed': 0, 'skipped': 0,
+                         'errors': 0, 'last_error': None}
+
+    def _check_fork(self):
+        # A forked worker gets its own thread and claims
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def wake(self):
+        """Deliver soon: called after committing a transaction that queued notifications"""
+        with self._state_lock:
+            self._check_fork()
+            if self._stopped:
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+                self._thread.start()
+            self._wakeup.set()
+
+    def drain(self):
+        """Deliver every due row now, in the calling thread; returns the summed counts"""
+        totals = {}
+        while True:
+            counts = self._cycle()
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+            if counts['claimed'] < self.batch_size:
+                return totals
+
+    def _cycle(self):
+        with self._lock:
+            try:
+                counts = deliver_pending(self.pool, self.worker_id, self.mail_config, self.batch_size)
+            except Exception as e:
+                with self._state_lock:
+                    self._metrics['errors'] += 1
+                    self._metrics['last_error'] = f'{type(e).__name__}: {e}'
+                raise
+        with self._state_lock:
+            self._metrics['cycles'] += 1
+            for key, value in counts.items():
+                self._metrics[key] += value
+        return counts
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception:
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        """Stop the background thread; rows still queued stay in the Outbox for the next worker"""
+        with self._state_lock:
+            self._stopped = True
+            self._wakeup.set()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    def stats(self):
+        with self._state_lock:
+            stats = dict(self._metrics)
+        with self.pool.connection() as conn:
+            stats.update(outbox_stats(conn))
+        return stats
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_outbox_worker(db_name, pool):
+    """Return the process-wide outbox worker for a database file, creating it on first use"""
+    key = os.path.abspath(db_name) if db_name != ':memory:' else db_name
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is None:
+            worker = OutboxWorker(pool, load_email_config(),
+                                  poll_interval=float(os.environ.get('LIBRARY_OUTBOX_POLL', 5.0)),
+                                  batch_size=int(os.environ.get('LIBRARY_OUTBOX_BATCH', BATCH_SIZE)))
+            _workers[key] = worker
+        return worker
@@ -0,0 +1,62 @@
+"""
+Keyset (Seek) Pagination
+========================
+
+Listings are paged by the value of their sort key instead of OFFSET, so
+page 500 costs the same as page 1: the query seeks into the index at the
+last key the client saw, e.g.
+
+    WHERE (Title, ISBN) > (?, ?) ORDER BY Title, ISBN LIMIT 51
+
+Cursors handed to clients are opaque: URL-safe base64 of the listing name
+plus the last row's sort key. Asking for one row more than the page size
+tells us whether there is a next page without a COUNT(*).
+"""
+
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that is malformed or belongs to another listing"""
+
+
+def encode_cursor(listing, key):
+    payload = json.dumps([listing, list(key)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(listing, cursor, key_length):
+    """Return the sort key stored in a cursor, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        name, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Malformed page cursor')
+    if name != listing or not isinstance(key, list) or len(key) != key_length:
+        raise InvalidCursor('Page cursor does not belong to this listing')
+    return key
+
+
+def clamp_page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def split_page(listing, rows, limit, key):
+    """Trim the look-ahead row and build the next cursor from the last row kept
+
+    `key` maps a row to its sort key tuple.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(listing, key(rows[-1]))
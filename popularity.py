@@ -0,0 +1,240 @@
+"""
+Popular Books Ranking
+=====================
+
+Popularity is precomputed instead of grouping Books x Loans x BookReviews on
+every request (which also multiplied each book's loan count by its number
+of reviews). Triggers created in migrations.py keep two tables current:
+
+- BookPopularity: one row per book with its all-time loan count and rating
+  aggregates; the all-time top-N is a walk down idx_popularity_rank
+- BookLoanDaily: loans per book per day, the source for time windows
+
+Windowed rankings (7d, 30d) are snapshots of the top SNAPSHOT_SIZE books
+built from the daily buckets and stored in PopularitySnapshots (one row
+set per period). They are rebuilt by the 'refresh_popularity' job
+(jobs.py); a read serves the stored snapshot as it is and never writes,
+at most starting a background rebuild when it is missing or older than
+SNAPSHOT_MAX_AGE seconds.
+"""
+
+import sqlite3
+import threading
+import time
+
+# Window name -> days; 'all' is served straight from BookPopularity
+WINDOWS = {'7d': 7, '30d': 30}
+SNAPSHOT_SIZE = 100
+SNAPSHOT_MAX_AGE = 600
+
+
+def _bump_loans(book, day, delta):
+    return f'''
+        INSERT INTO BookPopularity (BookID, LoanCount) VALUES ({book}, {delta})
+        ON CONFLICT(BookID) DO UPDATE SET LoanCount = LoanCount + {delta};
+        INSERT INTO BookLoanDaily (BookID, Day, Loans) VALUES ({book}, {day}, {delta})
+        ON CONFLICT(BookID, Day) DO UPDATE SET Loans = Loans + {delta};
+    '''
+
+
+def _bump_rating(book, rating, delta):
+    # SET expressions see the row before the update, hence the repeated sums
+    return f'''
+        INSERT INTO BookPopularity (BookID, RatingSum, RatingCount, AvgRating)
+        VALUES ({book}, {delta} * {rating}, {delta}, {rating})
+        ON CONFLICT(BookID) DO UPDATE SET
+            RatingSum = RatingSum + {delta} * {rating},
+            RatingCount = RatingCount + {delta},
+            AvgRating = CASE WHEN RatingCount + {delta} > 0
+                             THEN (RatingSum + {delta} * {rating}) * 1.0 / (RatingCount + {delta})
+                             ELSE 0 END;
+    '''
+
+
+def create_popularity_tables(cursor):
+    """Create the popularity tables and triggers, and backfill them from Loans and BookReviews"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BookPopularity (
+            BookID TEXT PRIMARY KEY,
+            LoanCount INTEGER NOT NULL DEFAULT 0,
+            RatingSum INTEGER NOT NULL DEFAULT 0,
+            RatingCount INTEGER NOT NULL DEFAULT 0,
+            AvgRating REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_popularity_rank '
+                   'ON BookPopularity(LoanCount DESC, AvgRating DESC)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BookLoanDaily (
+            Day DATE NOT NULL,
+            BookID TEXT NOT NULL,
+            Loans INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (Day, BookID)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS PopularitySnapshots (
+            Period TEXT NOT NULL,
+            Rank INTEGER NOT NULL,
+            BookID TEXT NOT NULL,
+            LoanCount INTEGER NOT NULL,
+            PRIMARY KEY (Period, Rank)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS PopularityPeriods (
+            Period TEXT PRIMARY KEY,
+            RefreshedAt REAL NOT NULL
+        )
+    ''')
+
+    loan_day = "date(COALESCE({row}.LoanDate, 'now'))"
+    triggers = {
+        # Every book is ranked, with zero loans until it is borrowed
+        'trg_popularity_book_insert': '''AFTER INSERT ON Books BEGIN
+            INSERT OR IGNORE INTO BookPopularity (BookID) VALUES (NEW.ISBN);
+        END''',
+        'trg_popularity_book_delete': '''AFTER DELETE ON Books BEGIN
+            DELETE FROM BookPopularity WHERE BookID = OLD.ISBN;
+        END''',
+        'trg_popularity_loan_insert': f'''AFTER INSERT ON Loans BEGIN
+            {_bump_loans('NEW.BookID', loan_day.format(row='NEW'), 1)}
+        END''',
+        'trg_popularity_loan_delete': f'''AFTER DELETE ON Loans BEGIN
+            {_bump_loans('OLD.BookID', loan_day.format(row='OLD'), -1)}
+        END''',
+        'trg_popularity_loan_update': f'''AFTER UPDATE OF BookID, LoanDate ON Loans BEGIN
+            {_bump_loans('OLD.BookID', loan_day.format(row='OLD'), -1)}
+            {_bump_loans('NEW.BookID', loan_day.format(row='NEW'), 1)}
+        END''',
+        'trg_popularity_review_insert': f'''AFTER INSERT ON BookReviews
+        WHEN NEW.Rating IS NOT NULL BEGIN
+            {_bump_rating('NEW.BookID', 'NEW.Rating', 1)}
+        END''',
+        'trg_popularity_review_delete': f'''AFTER DELETE ON BookReviews
+        WHEN OLD.Rating IS NOT NULL BEGIN
+            {_bump_rating('OLD.BookID', 'OLD.Rating', -1)}
+        END''',
+        # A rating change is the old rating leaving and the new one arriving
+        'trg_popularity_review_update_old': f'''AFTER UPDATE OF BookID, Rating ON BookReviews
+        WHEN OLD.Rating IS NOT NULL BEGIN
+            {_bump_rating('OLD.BookID', 'OLD.Rating', -1)}
+        END''',
+        'trg_popularity_review_update_new': f'''AFTER UPDATE OF BookID, Rating ON BookReviews
+        WHEN NEW.Rating IS NOT NULL BEGIN
+            {_bump_rating('NEW.BookID', 'NEW.Rating', 1)}
+        END''',
+    }
+    for name, body in triggers.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+    cursor.execute('DELETE FROM BookPopularity')
+    cursor.execute('''
+        INSERT INTO BookPopularity (BookID, LoanCount, RatingSum, RatingCount, AvgRating)
+        SELECT b.ISBN,
+               (SELECT COUNT(*) FROM Loans l WHERE l.BookID = b.ISBN),
+               COALESCE(r.RatingSum, 0), COALESCE(r.RatingCount, 0), COALESCE(r.AvgRating, 0)
+        FROM Books b
+        LEFT JOIN (SELECT BookID, SUM(Rating) AS RatingSum, COUNT(Rating) AS RatingCount,
+                          AVG(Rating) AS AvgRating
+                   FROM BookReviews GROUP BY BookID) r ON r.BookID = b.ISBN
+    ''')
+    cursor.execute('DELETE FROM BookLoanDaily')
+    cursor.execute('''
+        INSERT INTO BookLoanDaily (Day, BookID, Loans)
+        SELECT date(COALESCE(LoanDate, 'now')), BookID, COUNT(*) FROM Loans GROUP BY 1, 2
+    ''')
+
+
+TOP_ALL_TIME_SQL = '''
+    SELECT b.ISBN, b.Title, b.Author, p.LoanCount, p.AvgRating
+    FROM BookPopularity p
+    JOIN Books b ON b.ISBN = p.BookID
+    ORDER BY p.LoanCount DESC, p.AvgRating DESC
+    LIMIT ?
+'''
+
+TOP_WINDOW_SQL = '''
+    SELECT b.ISBN, b.Title, b.Author, s.LoanCount, COALESCE(p.AvgRating, 0)
+    FROM PopularitySnapshots s
+    JOIN Books b ON b.ISBN = s.BookID
+    LEFT JOIN BookPopularity p ON p.BookID = s.BookID
+    WHERE s.Period = ?
+    ORDER BY s.Rank
+    LIMIT ?
+'''
+
+
+def refresh_snapshot(conn, window):
+    """Rebuild the top-SNAPSHOT_SIZE ranking for a window from the daily buckets"""
+    days = WINDOWS[window]
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM PopularitySnapshots WHERE Period = ?', (window,))
+        conn.execute(f'''
+            INSERT INTO PopularitySnapshots (Period, Rank, BookID, LoanCount)
+            SELECT ?, ROW_NUMBER() OVER (ORDER BY w.Loans DESC, COALESCE(p.AvgRating, 0) DESC, w.BookID),
+                   w.BookID, w.Loans
+            FROM (SELECT BookID, SUM(Loans) AS Loans
+                  FROM BookLoanDaily
+                  WHERE Day > date('now', '-{int(days)} days')
+                  GROUP BY BookID
+                  HAVING SUM(Loans) > 0) w
+            LEFT JOIN BookPopularity p ON p.BookID = w.BookID
+            ORDER BY 2
+            LIMIT {SNAPSHOT_SIZE}
+        ''', (window,))
+        conn.execute('INSERT OR REPLACE INTO PopularityPeriods (Period, RefreshedAt) VALUES (?, ?)',
+                     (window, time.time()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# (key, window) pairs with a background rebuild running
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def refresh_in_background(connect, window, key=None):
+    """Rebuild a window's snapshot on a daemon thread with a connection from connect();
+    does nothing while a rebuild of the same (key, window) is already running"""
+    token = (key, window)
+    with _refreshing_lock:
+        if token in _refreshing:
+            return False
+        _refreshing.add(token)
+
+    def run():
+        try:
+            conn = connect()
+            try:
+                refresh_snapshot(conn, window)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass  # the next read or the refresh_popularity job tries again
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(token)
+
+    threading.Thread(target=run, name=f'popularity-{window}', daemon=True).start()
+    return True
+
+
+def top_books(conn, limit=10, window='all', on_stale=None):
+    """Top-N books as (ISBN, Title, Author, loan count, average rating)
+
+    Windowed rankings stop at SNAPSHOT_SIZE books and come from the last
+    snapshot as it is; on_stale(window) is called if that is missing or
+    older than SNAPSHOT_MAX_AGE.
+    """
+    if window == 'all':
+        return conn.execute(TOP_ALL_TIME_SQL, (limit,)).fetchall()
+    if window not in WINDOWS:
+        raise ValueError(f'Unknown popularity window: {window}')
+    row = conn.execute('SELECT RefreshedAt FROM PopularityPeriods WHERE Period = ?', (window,)).fetchone()
+    if on_stale is not None and (row is None or time.time() - row[0] > SNAPSHOT_MAX_AGE):
+        on_stale(window)
+    return conn.execute(TOP_WINDOW_SQL, (window, limit)).fetchall()
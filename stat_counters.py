@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Dashboard Counters
+==================
+
+The librarian dashboard shows row counts over Books, Members, Loans,
+BookReservations, Fines and Messages. Instead of running COUNT(*) over each
+table on every render, the counts live in the StatCounters table and are
+kept exact by triggers (created in migrations.py) that add or subtract 1
+whenever a row enters or leaves a counter's condition.
+
+Two dashboard figures depend on the current date and can't be maintained by
+triggers (a loan becomes overdue without any write); they are read as
+indexed range counts in the same statement.
+
+reconcile() recomputes every counter from scratch and reports drift, e.g.
+after rows were edited with triggers disabled or by an older build:
+
+    python stat_counters.py library.db [--repair]
+"""
+
+import sqlite3
+import sys
+
+# name -> (table, condition on the row); `{row}` is NEW or OLD inside triggers
+COUNTERS = {
+    'total_books': ('Books', '1'),
+    'available_books': ('Books', "{row}.AvailabilityStatus = 'Available'"),
+    'total_members': ('Members', "({row}.Status = 'active' OR {row}.Status IS NULL)"),
+    'active_loans': ('Loans', '{row}.ReturnDate IS NULL'),
+    'active_reservations': ('BookReservations', "{row}.Status = 'active'"),
+    'unpaid_fines': ('Fines', "{row}.Status = 'unpaid'"),
+    'unread_messages': ('Messages', '{row}.IsRead = 0'),
+}
+
+# Date-dependent figures, answered from idx_loans_open_duedate / idx_members_registration
+RANGE_COUNTS = {
+    'overdue_loans': "SELECT COUNT(*) FROM Loans WHERE DueDate < date('now') AND ReturnDate IS NULL",
+    'new_members_month': "SELECT COUNT(*) FROM Members WHERE RegistrationDate >= date('now', '-30 days')",
+}
+
+DASHBOARD_STATS_SQL = ' UNION ALL '.join(
+    ['SELECT Name, Value FROM StatCounters'] +
+    [f"SELECT '{name}', ({query})" for name, query in RANGE_COUNTS.items()])
+
+
+def _flag(condition, row):
+    return f'(CASE WHEN {condition.format(row=row)} THEN 1 ELSE 0 END)'
+
+
+def count_sql(name):
+    """COUNT(*) that recomputes a counter from its table"""
+    table, condition = COUNTERS[name]
+    return f'SELECT COUNT(*) FROM {table} WHERE {condition.format(row=table)}'
+
+
+def create_counter_triggers(cursor):
+    """Create StatCounters, its maintenance triggers, and seed it from the current rows"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS StatCounters (
+            Name TEXT PRIMARY KEY,
+            Value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for name, (table, condition) in COUNTERS.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_insert AFTER INSERT ON {table}
+            WHEN {_flag(condition, 'NEW')} BEGIN
+                UPDATE StatCounters SET Value = Value + 1 WHERE Name = '{name}';
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_delete AFTER DELETE ON {table}
+            WHEN {_flag(condition, 'OLD')} BEGIN
+                UPDATE StatCounters SET Value = Value - 1 WHERE Name = '{name}';
+            END
+        ''')
+        if condition != '1':
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_counter_{name}_update AFTER UPDATE ON {table}
+                WHEN {_flag(condition, 'NEW')} != {_flag(condition, 'OLD')} BEGIN
+                    UPDATE StatCounters SET Value = Value + 2 * {_flag(condition, 'NEW')} - 1
+                    WHERE Name = '{name}';
+                END
+            ''')
+        cursor.execute(f'INSERT OR REPLACE INTO StatCounters (Name, Value) VALUES (?, ({count_sql(name)}))',
+                       (name,))
+
+
+def read_dashboard_stats(conn):
+    """All dashboard figures in one statement"""
+    return dict(conn.execute(DASHBOARD_STATS_SQL).fetchall())
+
+
+def reconcile(conn, repair=False):
+    """Recompute every counter and return {name: (stored, actual)} for those that drifted
+
+    Runs under a write lock so no trigger can move a counter between the
+    recount and the comparison. With repair=True drifted counters are reset.
+    """
+    drift = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        stored = dict(conn.execute('SELECT Name, Value FROM StatCounters').fetchall())
+        for name in COUNTERS:
+            actual = conn.execute(count_sql(name)).fetchone()[0]
+            if stored.get(name) != actual:
+                drift[name] = (stored.get(name), actual)
+                if repair:
+                    conn.execute('INSERT OR REPLACE INTO StatCounters (Name, Value) VALUES (?, ?)',
+                                 (name, actual))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return drift
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else 'library.db'
+    repair = '--repair' in sys.argv
+    from migrations import migrate
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    drift = reconcile(conn, repair=repair)
+    conn.close()
+    if not drift:
+        print('✅ All dashboard counters match their tables')
+    for name, (stored, actual) in drift.items():
+        print(f"{'🔧' if repair else '❌'} {name:<20} stored={stored} actual={actual}")
+    sys.exit(0 if repair or not drift else 1)
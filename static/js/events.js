@@ -0,0 +1,47 @@
+// Live updates over Server-Sent Events (/api/events)
+// Pages register handlers with LibraryEvents.on('stats', fn); the stream opens on the first one
+const LibraryEvents = (function () {
+    const handlers = {};
+    let source = null;
+    let retryDelay = 5000;
+
+    function listen(kind) {
+        source.addEventListener(kind, function (event) {
+            const data = JSON.parse(event.data);
+            handlers[kind].forEach(fn => fn(data));
+        });
+    }
+
+    function connect() {
+        source = new EventSource('/api/events');
+        Object.keys(handlers).forEach(listen);
+        source.onopen = function () {
+            retryDelay = 5000;
+        };
+        source.onerror = function () {
+            // EventSource reconnects by itself, except when the server refused the stream (e.g. 503)
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, retryDelay);
+                retryDelay = Math.min(retryDelay * 2, 300000);
+            }
+        };
+    }
+
+    return {
+        on: function (kind, fn) {
+            if (!window.EventSource) {
+                return;
+            }
+            if (!handlers[kind]) {
+                handlers[kind] = [];
+                if (source) {
+                    listen(kind);
+                }
+            }
+            handlers[kind].push(fn);
+            if (!source) {
+                connect();
+            }
+        }
+    };
+})();
@@ -150,3 +150,31 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 });
+
+// "Load more" buttons on paginated listings: fetch the next page as rendered
+// rows and append them. The button carries data-url (JSON endpoint with
+// render=<partial>), data-cursor (next page cursor) and data-target (selector).
+function loadMore(button) {
+    const url = new URL(button.dataset.url, window.location.origin);
+    url.searchParams.set('cursor', button.dataset.cursor);
+    button.disabled = true;
+
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || 'Could not load more results');
+            }
+            document.querySelector(button.dataset.target).insertAdjacentHTML('beforeend', data.html);
+            if (data.next_cursor) {
+                button.dataset.cursor = data.next_cursor;
+                button.disabled = false;
+            } else {
+                button.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error loading more results:', error);
+            button.disabled = false;
+        });
+}
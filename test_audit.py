@@ -0,0 +1,109 @@
+"""
+Tests for the group-commit audit log writer
+"""
+import threading
+import time
+
+import pytest
+
+from app import LibraryManager
+from audit import AuditWriter
+from db_pool import ConnectionPool
+from migrations import migrate
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'library.db')
+    migrate(path)
+    return path
+
+
+def audit_actions(pool):
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT Action FROM AuditLogs ORDER BY LogID')]
+
+
+def test_audit_rows_commit_and_roll_back_with_the_callers_transaction(db_path):
+    library = LibraryManager(db_path)
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Books VALUES ('B1', 'Book', 'Author', 'Fiction', 2000, 'Available')")
+        conn.execute("INSERT INTO Members (MemberID, Name) VALUES (1, 'Ann')")
+        conn.commit()
+
+    success, _ = library.loan_book('B1', 1, audit={'user_id': 1, 'action': 'Quick loan: B1 to member 1'})
+    assert success
+    assert audit_actions(library.pool) == ['Quick loan: B1 to member 1']
+
+    with library.connection() as conn:
+        conn.execute("UPDATE Books SET Title = 'Renamed' WHERE ISBN = 'B1'")
+        library.log_audit(1, 'Renamed B1', 'Books', 'B1', conn=conn)
+        conn.rollback()
+    stats = library.get_audit_stats()
+    assert (stats['joined'], stats['enqueued'], stats['queue_depth']) == (2, 0, 0)
+    assert audit_actions(library.pool) == ['Quick loan: B1 to member 1']
+
+
+def test_buffered_rows_flush_on_batch_size_and_age(db_path):
+    pool = ConnectionPool(db_path, max_size=2)
+    writer = AuditWriter(pool, max_batch=3, max_delay=0.2)
+    for i in range(4):
+        writer.write(1, f'action {i}', old_values={'i': i})
+    deadline = time.monotonic() + 2
+    while writer.stats()['flushed'] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = writer.stats()
+    assert (stats['flushed'], stats['batches'], stats['queue_depth']) == (3, 1, 1)
+    assert stats['oldest_age_ms'] is not None
+
+    while writer.stats()['queue_depth'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert audit_actions(pool) == [f'action {i}' for i in range(4)]
+    with pool.connection() as conn:
+        assert conn.execute('SELECT OldValues FROM AuditLogs ORDER BY LogID DESC').fetchone()[0] == '{"i": 3}'
+    writer.close()
+
+
+def test_close_drains_the_buffer_and_later_writes_go_straight_through(db_path):
+    pool = ConnectionPool(db_path, max_size=2)
+    writer = AuditWriter(pool, max_batch=1000, max_delay=60)
+    for i in range(250):
+        writer.write(1, f'action {i}')
+    assert writer.stats()['queue_depth'] == 250
+    assert writer.close()
+    assert len(audit_actions(pool)) == 250
+
+    writer.write(1, 'after shutdown')
+    assert audit_actions(pool)[-1] == 'after shutdown'
+    assert writer.stats()['queue_depth'] == 0
+
+
+def test_a_late_write_waiting_on_the_pool_does_not_hold_the_writer_lock(db_path):
+    pool = ConnectionPool(db_path, max_size=1)
+    writer = AuditWriter(pool)
+    assert writer.close()
+    held = pool.acquire()
+    late = threading.Thread(target=writer.write, args=(1, 'after shutdown'))
+    late.start()
+    time.sleep(0.05)
+    stats_taken = threading.Event()
+    threading.Thread(target=lambda: (writer.stats(), stats_taken.set()), daemon=True).start()
+    assert stats_taken.wait(1)
+    held.close()
+    late.join(2)
+    assert audit_actions(pool) == ['after shutdown']
+
+
+def test_failed_flush_keeps_rows_for_the_next_attempt(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'empty.db'), max_size=2)
+    writer = AuditWriter(pool, max_batch=100, max_delay=60)
+    writer.write(1, 'kept')
+    assert not writer.flush()
+    stats = writer.stats()
+    assert (stats['flush_errors'], stats['queue_depth']) == (1, 1)
+    assert 'AuditLogs' in stats['last_error']
+
+    migrate(str(tmp_path / 'empty.db'))
+    assert writer.flush()
+    assert audit_actions(pool) == ['kept']
+    writer.close()
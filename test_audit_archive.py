@@ -0,0 +1,119 @@
+"""
+Tests for audit log retention and the monthly archive files
+"""
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import audit_archive
+from jobs import run_job
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType) "
+                     "VALUES (7, 'ann', 'x', 'Ann Librarian', 'librarian')")
+        conn.executemany('INSERT INTO AuditLogs (UserID, Action, NewValues, Timestamp) VALUES (?, ?, ?, ?)', [
+            (7 if i % 2 else None, f"{'Quick loan' if i % 3 else 'Book returned'}: item {i}",
+             json.dumps({'item': i}), days_ago(i * 10 + 1))
+            for i in range(40)])
+        conn.commit()
+    return library
+
+
+def hot_count(library):
+    with library.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM AuditLogs').fetchone()[0]
+
+
+def test_old_rows_move_to_compressed_monthly_files(library):
+    result = library.archive_audit_logs(retention_days=90)
+    assert result['archived'] == 31
+    assert hot_count(library) == result['hot_rows'] == 9
+    assert result['archive_months'] == sorted({days_ago(i * 10 + 1)[:7] for i in range(9, 40)})
+
+    archive = audit_archive.ArchiveFile(library.audit_archive_dir, result['archive_months'][-1])
+    stored = [row[0] for row in archive.conn.execute('SELECT NewValues FROM AuditLogs')]
+    assert stored and all(isinstance(blob, bytes) for blob in stored)
+    assert json.loads(archive.unpack(stored[0]))['item'] >= 9
+    assert archive.pack('{}') == '{}'
+    archive.close()
+
+    assert library.archive_audit_logs(retention_days=90)['archived'] == 0
+
+
+class FailingDelete:
+    """A connection that dies between copying a batch to the archive and deleting it"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql.startswith('DELETE FROM AuditLogs'):
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.conn.execute(sql, *args)
+
+    def commit(self):
+        self.conn.commit()
+
+
+def test_interrupted_archive_run_is_finished_without_duplicates(library):
+    with library.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            audit_archive.archive_audit_logs(FailingDelete(conn), library.audit_archive_dir, 90)
+    assert hot_count(library) == 40
+    logs = library.get_audit_logs(limit=100)
+    assert len(logs) == 40 == len({log[0] for log in logs})
+
+    assert library.archive_audit_logs(retention_days=90)['archived'] == 31
+    logs = library.get_audit_logs(limit=100)
+    assert len(logs) == 40 == len({log[0] for log in logs})
+
+
+def test_queries_span_hot_and_archived_rows(library):
+    library.archive_audit_logs(retention_days=90)
+
+    logs = library.get_audit_logs(limit=15)
+    assert [json.loads(log[6])['item'] for log in logs] == list(range(15))
+    assert [log[9] for log in logs[:2]] == [None, 'Ann Librarian']
+
+    for action_match in ('contains', 'prefix'):
+        logs = library.get_audit_logs(limit=100, user_id=7, action='quick LOAN',
+                                      start=days_ago(300)[:10], end=days_ago(95)[:10], action_match=action_match)
+        items = [json.loads(log[6])['item'] for log in logs]
+        assert items == [i for i in range(10, 30) if i % 2 and i % 3]
+
+    # By default the term is found anywhere in the action, in both places
+    logs = library.get_audit_logs(limit=100, action='RETURNED')
+    assert [json.loads(log[6])['item'] for log in logs] == list(range(0, 40, 3))
+    assert library.get_audit_logs(limit=100, action='returned', action_match='prefix') == []
+
+
+def test_prefix_search_finds_actions_continuing_outside_the_bmp(library):
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO AuditLogs (UserID, Action, NewValues, Timestamp) VALUES (?, ?, ?, ?)', [
+            (7, 'Title changed:\U0001F600 Tales', json.dumps({'item': 'emoji'}), days_ago(0)),
+            (7, 'Title changed: Plain', json.dumps({'item': 'plain'}), days_ago(200))])
+        conn.commit()
+    library.archive_audit_logs(retention_days=90)
+
+    logs = library.get_audit_logs(limit=100, action='Title changed:', action_match='prefix')
+    assert [json.loads(log[6])['item'] for log in logs] == ['emoji', 'plain']
+    assert audit_archive._prefix_successor('ab\U0010ffff') == 'ac'
+    assert audit_archive._prefix_successor('\ud7ff') == '\ue000'
+
+
+def test_archive_job_uses_the_retention_setting(library):
+    library.update_system_setting('audit_retention_days', '200')
+    run = run_job(library, 'archive_audit_logs', force=True)
+    assert run['status'] == 'succeeded'
+    assert run['result']['archived'] == 20
+    assert hot_count(library) == 20
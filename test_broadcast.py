@@ -0,0 +1,86 @@
+"""
+Tests for role-addressed (broadcast) messages and the cached user roster
+"""
+import pytest
+
+from app import LibraryManager
+from migrations import migrate
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType) VALUES (?, ?, 'x', ?, ?)", [
+            (101, 'lib1', 'Librarian One', 'librarian'),
+            (102, 'lib2', 'Librarian Two', 'librarian'),
+            (201, 'stu1', 'Student One', 'student'),
+        ])
+        conn.commit()
+    return library
+
+
+def librarian_ids(library):
+    return set(library.get_user_ids_by_type('librarian'))
+
+
+def recipients(library, message_id):
+    with library.connection() as conn:
+        return dict(conn.execute('SELECT UserID, ReadAt IS NOT NULL FROM MessageRecipients WHERE MessageID = ?',
+                                 (message_id,)).fetchall())
+
+
+def test_broadcast_is_stored_once_with_a_recipient_row_each(library):
+    roster = librarian_ids(library)
+    assert {101, 102} <= roster
+    assert library.broadcast_message(201, 'librarian', 'Hello', 'Is the atlas in?', 'student_inquiry') == len(roster)
+
+    with library.connection() as conn:
+        messages = conn.execute("SELECT MessageID, ToUserID, ToUserType FROM Messages WHERE Subject = 'Hello'").fetchall()
+    assert len(messages) == 1 and messages[0][1:] == (None, 'librarian')
+    assert set(recipients(library, messages[0][0])) == roster
+    inbox = [message[0] for message in library.get_user_messages(101)]
+    assert inbox.count(messages[0][0]) == 1
+
+    assert library.broadcast_message(201, 'nobody', 'Hello', 'Anyone?') == 0
+
+
+def test_read_state_is_per_recipient(library):
+    library.broadcast_message(201, 'librarian', 'Book Request', 'Please order it', 'book_request')
+    with library.connection() as conn:
+        message_id = conn.execute("SELECT MessageID FROM Messages WHERE Subject = 'Book Request'").fetchone()[0]
+
+    library.mark_message_read(message_id, 101)
+    state = recipients(library, message_id)
+    assert state[101] == 1 and state[102] == 0
+
+
+def test_roster_is_cached_until_users_change(library):
+    librarian_ids(library)
+    hits = library.get_cache_stats()['hits']
+    librarian_ids(library)
+    assert library.get_cache_stats()['hits'] == hits + 1
+
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType) "
+                     "VALUES (103, 'lib3', 'x', 'Librarian Three', 'librarian')")
+        conn.commit()
+    assert 103 not in librarian_ids(library)
+    library.cache.invalidate('users')
+    assert 103 in librarian_ids(library)
+
+
+def test_migration_backfills_recipients_of_existing_role_messages(tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    library = LibraryManager(db_path)
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType) "
+                     "VALUES (101, 'lib1', 'x', 'Librarian One', 'librarian')")
+        message_id = conn.execute("INSERT INTO Messages (FromUserID, ToUserType, Subject, Message, IsRead) "
+                                  "VALUES (201, 'librarian', 'Old inquiry', 'Hi', 1)").lastrowid
+        conn.execute('DELETE FROM MessageRecipients')
+        conn.execute('DELETE FROM schema_version WHERE Version = 10')
+        conn.commit()
+    migrate(db_path)
+    assert recipients(library, message_id)[101] == 1
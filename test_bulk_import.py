@@ -0,0 +1,82 @@
+"""
+Tests for the streaming bulk catalog importer
+"""
+import io
+import json
+
+import pytest
+
+import bulk_import
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Books VALUES ('978-0134685991', 'Effective Java', 'Joshua Bloch', "
+                     "'Technology', 2017, 'Loaned')")
+        conn.commit()
+    return library
+
+
+def book(library, isbn):
+    with library.connection() as conn:
+        return conn.execute('SELECT Title, Genre, PublicationYear, AvailabilityStatus FROM Books WHERE ISBN = ?',
+                            (isbn,)).fetchone()
+
+
+def run_import(library, text, fmt='csv', **kwargs):
+    return library.import_catalog(bulk_import.text_stream(io.BytesIO(text.encode('utf-8'))), fmt, **kwargs)
+
+
+def test_csv_rows_are_validated_and_reported_by_line(library):
+    report = run_import(library, (
+        '\ufeffISBN,Title,Author,Genre,Publication_Year,Publisher\n'
+        '9781000000001,First,Someone,Fiction,2001,Ignored\n'
+        '9781000000002,,Someone,Fiction,2001,\n'
+        'not-an-isbn,Third,Someone,Fiction,2001,\n'
+        '9781000000004,"Multi\nline",Someone,,1999,\n'
+        '9781000000005,Fifth,Someone,Fiction,year,\n'
+    ), chunk_size=2)
+    assert (report.processed, report.inserted, report.failed) == (5, 2, 3)
+    assert [line for line, _ in report.errors] == [3, 4, 7]
+    assert book(library, '9781000000004') == ('Multi\nline', None, 1999, 'Available')
+
+
+def test_upsert_updates_catalog_fields_but_not_availability(library):
+    lines = [json.dumps({'isbn': '978-0134685991', 'title': 'Effective Java, 3rd ed.', 'author': 'Joshua Bloch',
+                         'genre': 'Technology', 'publication_year': 2018}),
+             json.dumps({'isbn': '9781000000009', 'title': 'New', 'author': 'Someone'}),
+             json.dumps({'isbn': '9781000000009', 'title': 'New, revised', 'author': 'Someone'}),
+             '{"isbn": truncated',
+             '']
+    report = run_import(library, '\n'.join(lines), 'jsonl')
+    assert (report.processed, report.inserted, report.updated, report.failed) == (4, 1, 2, 1)
+    assert book(library, '978-0134685991') == ('Effective Java, 3rd ed.', 'Technology', 2018, 'Loaned')
+    assert book(library, '9781000000009')[0] == 'New, revised'
+
+    report = run_import(library, lines[0].replace('3rd', '4th'), 'jsonl', skip_duplicates=True)
+    assert (report.inserted, report.skipped) == (0, 1)
+    assert book(library, '978-0134685991')[0] == 'Effective Java, 3rd ed.'
+
+
+def test_imports_are_recorded_and_visible_to_search(library):
+    progress = []
+    report = run_import(library, 'isbn,title,author\n' + ''.join(
+        f'97810000{i:05d},Zanzibar Atlas {i},Cartographer\n' for i in range(25)),
+        filename='atlases.csv', chunk_size=10, progress=lambda r: progress.append(r.processed))
+    assert progress == [10, 20, 25]
+    assert report.inserted == 25
+    assert library.get_import_history()[0][1:3] == ('books', 'atlases.csv')
+    assert len(library.search_books('zanzibar')) == 25
+
+
+def test_legacy_bulk_import_books_skips_existing(library):
+    count, errors = library.bulk_import_books([
+        ('978-0134685991', 'Duplicate', 'Someone', 'Fiction', 2000),
+        ('9781000000010', 'Fresh', 'Someone', 'Fiction', 2000),
+        ('9781000000011', '', 'Someone', 'Fiction', 2000),
+    ])
+    assert count == 1
+    assert errors == ['Row 3: missing title']
+    assert book(library, '978-0134685991')[0] != 'Duplicate'
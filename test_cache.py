@@ -0,0 +1,73 @@
+"""
+Tests for the query result cache
+"""
+import multiprocessing
+
+import cache as cache_module
+from cache import QueryCache, SharedGenerations
+
+
+def test_ttl_expiry_and_lru_eviction(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: clock[0])
+    cache = QueryCache(max_entries=2)
+    loads = []
+
+    def load(key, ttl=10):
+        return cache.get_or_load(key, lambda: loads.append(key) or key, ttl)
+
+    load('a'), load('b'), load('a')     # a is now most recently used
+    load('c')                           # evicts b
+    load('a'), load('b')
+    assert loads == ['a', 'b', 'c', 'b']
+
+    clock[0] += 11
+    load('b')
+    assert loads[-1] == 'b'
+    stats = cache.stats()
+    assert (stats['hits'], stats['evictions'], stats['expired']) == (2, 2, 1)
+
+
+def test_invalidation_is_per_tag():
+    cache = QueryCache()
+    calls = []
+    for tag in ('setting:a', 'setting:b'):
+        cache.get_or_load(tag, lambda: calls.append(tag), 60, (tag,))
+    cache.invalidate('setting:a')
+    for tag in ('setting:a', 'setting:b'):
+        cache.get_or_load(tag, lambda: calls.append(tag), 60, (tag,))
+    assert calls == ['setting:a', 'setting:b', 'setting:a']
+    assert cache.stats()['stale'] == 1
+
+
+def _bump(path, tag):
+    SharedGenerations(path).bump(tag)
+
+
+def test_shared_generations_reach_other_processes(tmp_path):
+    path = str(tmp_path / 'generations')
+    cache = QueryCache(generations=SharedGenerations(path))
+    assert cache.get_or_load('k', lambda: 'old', 60, ('categories',)) == 'old'
+
+    proc = multiprocessing.get_context('fork').Process(target=_bump, args=(path, 'categories'))
+    proc.start()
+    proc.join()
+
+    assert cache.get_or_load('k', lambda: 'new', 60, ('categories',)) == 'new'
+
+
+def test_manager_writes_invalidate_cached_reads(migrated_library):
+    library = migrated_library
+    categories = library.get_book_categories()
+    assert library.get_book_categories() == categories
+    library.add_book_category('Cartography')
+    assert len(library.get_book_categories()) == len(categories) + 1
+
+    library.get_system_setting('max_renewals')
+    library.get_system_setting('reservation_hold_days')
+    library.update_system_setting('reservation_hold_days', '5')
+    assert library.get_system_setting('reservation_hold_days') == '5'
+    assert library.get_system_setting('max_renewals') is not None
+
+    stats = library.get_cache_stats()
+    assert stats['hits'] == 2 and stats['stale'] == 2
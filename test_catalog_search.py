@@ -0,0 +1,68 @@
+"""
+Tests for the FTS5 catalog search
+"""
+import pytest
+
+from catalog_search import match_expression, render_highlight
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    for isbn, title, author, genre in [
+        ('111', 'Les Misérables', 'Victor Hugo', 'Fiction'),
+        ('222', 'Jane Eyre', 'Charlotte Brontë', 'Romance'),
+        ('333', 'Harry Potter and the Chamber of Secrets', 'J.K. Rowling', 'Fantasy'),
+        ('444', 'Potter Studies', 'A. Harrison', 'Reference'),
+        ('555', 'The Romance of the Rose', 'Guillaume de Lorris', 'Poetry'),
+    ]:
+        library.add_book(isbn, title, author, genre, 2000)
+    return library
+
+
+def isbns(rows):
+    return [row[0] for row in rows]
+
+
+def test_diacritics_are_folded(library):
+    assert isbns(library.search_books('miserables')) == ['111']
+    assert isbns(library.search_books('bronte')) == ['222']
+    assert isbns(library.search_books('Brontë')) == ['222']
+
+
+def test_prefix_query_matches_across_columns(library):
+    # "harr" is in the title of 333 but in the author of 444
+    assert sorted(isbns(library.search_books('harr pot'))) == ['333', '444']
+
+
+def test_title_hits_rank_above_genre_hits(library):
+    assert isbns(library.search_books('romance')) == ['555', '222']
+
+
+def test_index_follows_updates_and_deletes(library):
+    with library.connection() as conn:
+        conn.execute("UPDATE Books SET Title = 'Les Contemplations' WHERE ISBN = '111'")
+        conn.execute("DELETE FROM Books WHERE ISBN = '222'")
+        conn.commit()
+    assert library.search_books('miserables') == []
+    assert isbns(library.search_books('contemplations')) == ['111']
+    assert library.search_books('eyre') == []
+
+
+def test_available_only_and_advanced_search(library):
+    library.loan_book('333', 1)
+    assert isbns(library.search_books('potter', available_only=True)) == ['444']
+    assert isbns(library.advanced_search_books(author='rowling')) == ['333']
+    assert isbns(library.advanced_search_books(title='potter', availability='Available')) == ['444']
+
+
+def test_user_input_cannot_inject_fts_syntax(library):
+    assert match_expression('') is None
+    assert match_expression('"*') is None
+    assert library.search_books('potter OR NEAR(') == []
+
+
+def test_highlight_is_escaped(library):
+    title_highlight = library.search_books('hugo')[0][7]
+    assert str(render_highlight(title_highlight)) == 'Victor <mark>Hugo</mark>'
+    assert str(render_highlight('<b>\x02x\x03</b>')) == '&lt;b&gt;<mark>x</mark>&lt;/b&gt;'
@@ -0,0 +1,237 @@
+"""
+Tests for atomic checkout and return (BEGIN IMMEDIATE transactions, conditional copy claims, lock retries) and
+batch circulation for desk scanning sessions
+"""
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+import app as app_module
+from app import LibraryManager
+from copies import checkout_copy
+from db_pool import run_immediate
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)',
+                         [(member_id, f'Member {member_id}') for member_id in range(1, 9)])
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType) "
+                     "VALUES (101, 'lib1', 'x', 'Librarian One', 'librarian')")
+        conn.commit()
+    library.add_book('111', 'Atlas', 'Ann Author', 'Maps', 2020)
+    library.add_book('222', 'Birds', 'Bob Author', 'Nature', 2021, copies=2)
+    return library
+
+
+def open_loans(library):
+    with library.connection() as conn:
+        return conn.execute('SELECT LoanID, CopyBarcode FROM Loans WHERE ReturnDate IS NULL ORDER BY LoanID').fetchall()
+
+
+def circulate(client, db_path, member_id, rounds):
+    # A separate worker process: its own manager and pool on the same file
+    library = LibraryManager(db_path)
+    app_module.library = library
+    for n in range(rounds):
+        isbn = '111' if n % 2 else '222'
+        if library.loan_book(isbn, member_id)[0]:
+            with library.connection() as conn:
+                loan_id = conn.execute('SELECT MAX(LoanID) FROM Loans WHERE MemberID = ? AND ReturnDate IS NULL',
+                                       (member_id,)).fetchone()[0]
+            client.get(f'/return_book/{loan_id}')
+
+
+def test_concurrent_workers_never_lend_the_same_copy_twice(library, librarian_client):
+    # A second loan of a copy that is already out fails the worker that made it
+    with library.connection() as conn:
+        conn.execute('''
+            CREATE TRIGGER test_no_double_loan BEFORE INSERT ON Loans
+            WHEN EXISTS (SELECT 1 FROM Loans WHERE CopyBarcode = NEW.CopyBarcode AND ReturnDate IS NULL) BEGIN
+                SELECT RAISE(ABORT, 'copy is already on loan');
+            END
+        ''')
+        conn.commit()
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=circulate, args=(librarian_client, library.db_name, member_id, 40))
+               for member_id in range(1, 9)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(120)
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+
+    with library.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM Loans').fetchone()[0] > 0
+        assert conn.execute('SELECT COUNT(*) FROM Loans WHERE CopyBarcode IS NULL').fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM Copies WHERE State <> 'available'").fetchone()[0] == 0
+    assert open_loans(library) == []
+    assert library.get_copy_counts('111') == (1, 1)
+    assert library.get_copy_counts('222') == (2, 2)
+
+
+def test_last_copy_goes_to_exactly_one_of_many_simultaneous_checkouts(library):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def checkout(member_id):
+        barrier.wait()
+        results.append(library.loan_book('111', member_id))
+
+    threads = [threading.Thread(target=checkout, args=(member_id,)) for member_id in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(success for success, _ in results) == [False] * 7 + [True]
+    assert [barcode for _, barcode in open_loans(library)] == ['111-1']
+    assert library.get_copy_counts('111') == (0, 1)
+
+
+def test_returning_a_loan_twice_only_returns_it_once(library, librarian_client):
+    assert library.loan_book('222', 1)[0]
+    (loan_id, _), = open_loans(library)
+    client = librarian_client
+
+    client.get(f'/return_book/{loan_id}')
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('success', 'Book "Birds" returned successfully by Member 1!')
+        session.pop('_flashes')
+    client.get(f'/return_book/{loan_id}')
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('error', 'This loan has already been returned!')
+    client.get('/return_book/999')
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('error', 'Loan not found!')
+
+    assert library.get_copy_counts('222') == (2, 2)
+    with library.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM Messages WHERE MessageType = 'return_confirmation'").fetchone()[0] \
+            == 0  # Member 1 has no user account
+        assert conn.execute('SELECT COUNT(*) FROM Loans WHERE ReturnDate IS NOT NULL').fetchone()[0] == 1
+
+
+def test_locked_database_is_retried_and_failures_roll_back(library):
+    # A connection that gives up on the lock at once, so the retries do the waiting
+    conn = sqlite3.connect(library.db_name, timeout=0)
+    holder = sqlite3.connect(library.db_name, isolation_level=None, check_same_thread=False)
+    holder.execute('BEGIN IMMEDIATE')
+    with pytest.raises(sqlite3.OperationalError, match='locked'):
+        run_immediate(conn, lambda cursor: checkout_copy(cursor, '111'), retries=0)
+
+    release = threading.Timer(0.1, holder.execute, ('COMMIT',))
+    release.start()
+    assert run_immediate(conn, lambda cursor: checkout_copy(cursor, '111'), retries=6) == '111-1'
+    release.join()
+    assert library.get_copy_counts('111') == (0, 1)
+
+    # Anything going wrong inside the work undoes the claim
+    def failing(cursor):
+        checkout_copy(cursor, '222')
+        raise ValueError('no such member')
+
+    with pytest.raises(ValueError):
+        run_immediate(conn, failing)
+    assert library.get_copy_counts('222') == (2, 2)
+    holder.close()
+    conn.close()
+
+
+def batch(client, *items):
+    response = client.post('/api/circulation/batch', json={'items': [
+        dict(zip(('action', 'code', 'member_id'), item)) for item in items]})
+    return response.status_code, response.get_json()
+
+
+def test_batch_checks_out_and_returns_a_stack_with_per_item_results(library, librarian_client):
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType, MemberID) "
+                     "VALUES (202, 'm2', 'x', 'Member 2', 'student', 2)")
+        conn.commit()
+    client = librarian_client
+    status, body = batch(client,
+                         ('checkout', '111', 1),
+                         ('checkout', '222-2', 2),
+                         ('checkout', '222', 2),
+                         ('checkout', '111', 3),      # the only copy is already out
+                         ('checkout', '222', 99),     # no such member
+                         ('renew', '222', 1),
+                         ('return', '999-1', None))
+    assert status == 200
+    assert (body['loaned'], body['returned'], body['failed']) == (3, 0, 4)
+    assert [(result['success'], result['barcode'], result['message']) for result in body['results'][3:]] == [
+        (False, None, 'Book is not available!'),
+        (False, None, 'Member not found!'),
+        (False, None, 'Unknown action!'),
+        (False, None, 'No open loan found!'),
+    ]
+    assert [result['barcode'] for result in body['results'][:3]] == ['111-1', '222-2', '222-1']
+    assert library.get_copy_counts('222') == (0, 2)
+
+    # Returned by barcode, or by ISBN for a member; the second return of a copy finds no open loan
+    status, body = batch(client, ('return', '222-2', None), ('return', '111', 1), ('return', '222-2', None),
+                         ('return', '222', 1))
+    assert [(result['success'], result['barcode']) for result in body['results']] == [
+        (True, '222-2'), (True, '111-1'), (False, None), (False, None)]
+    assert library.get_copy_counts('111') == (1, 1) and library.get_copy_counts('222') == (1, 2)
+    library.flush_audit_log()
+    library.deliver_outbox()
+    with library.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM Messages WHERE MessageType = 'return_confirmation' "
+                            "AND ToUserID = 202").fetchone()[0] == 1
+        actions = [row[0] for row in conn.execute('SELECT Action FROM AuditLogs ORDER BY LogID')]
+    assert len([action for action in actions if action.startswith('Batch loan')]) == 3
+    assert len([action for action in actions if action.startswith('Book returned')]) == 2
+
+
+def test_batch_returns_pass_copies_to_holds_and_holders_collect_by_barcode(library, librarian_client):
+    client = librarian_client
+    batch(client, ('checkout', '111', 1))
+    assert library.create_reservation('111', 2)[1] == 'Book reserved. Position 1 in the queue'
+
+    status, body = batch(client, ('return', '111-1', None), ('checkout', '111-1', 3), ('checkout', '111-1', 2))
+    assert [(result['success'], result['message'][:6]) for result in body['results']] == [
+        (True, 'Return'), (False, 'Copy i'), (True, 'Loaned')]
+    assert library.get_member_holds(2) == []
+    assert [barcode for _, barcode in open_loans(library)] == ['111-1']
+
+
+def test_a_failing_batch_leaves_nothing_behind(library, librarian_client, monkeypatch):
+    import circulation
+    client = librarian_client
+    batch(client, ('checkout', '222', 1))
+
+    def broken(cursor, allocations, from_user_id=None):
+        raise sqlite3.IntegrityError('boom')
+
+    monkeypatch.setattr(circulation, 'notify_ready', broken)
+    with pytest.raises(sqlite3.IntegrityError):
+        library.circulate_batch([{'action': 'return', 'code': '222', 'member_id': 1},
+                                 {'action': 'checkout', 'code': '111', 'member_id': 1}], 101)
+    assert [barcode for _, barcode in open_loans(library)] == ['222-1']
+    assert library.get_copy_counts('111') == (1, 1) and library.get_copy_counts('222') == (1, 2)
+
+    with library.connection() as conn:
+        plan = ' '.join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT LoanID FROM Loans WHERE CopyBarcode = '222-1' AND ReturnDate IS NULL"))
+    assert 'idx_loans_open_copy' in plan
+
+
+def test_batch_endpoint_rejects_malformed_or_oversized_requests(library, librarian_client):
+    client = librarian_client
+    assert client.post('/api/circulation/batch', json={}).status_code == 400
+    assert client.post('/api/circulation/batch', json={'items': ['111']}).status_code == 400
+    assert batch(client, *[('checkout', '111', 1)] * 501)[0] == 400
+    assert open_loans(library) == []
+
+    student = app_module.app.test_client()
+    with student.session_transaction() as session:
+        session['user_id'] = 201
+        session['user_type'] = 'student'
+    assert student.post('/api/circulation/batch', json={'items': [{'action': 'checkout', 'code': '111',
+                                                                   'member_id': 1}]}).status_code == 302
+    assert open_loans(library) == []
@@ -0,0 +1,162 @@
+"""
+Tests for the per-copy inventory: Copies, the maintained CopyCounts and the book status derived from them
+"""
+import random
+
+import pytest
+
+import app as app_module
+from app import LibraryManager
+from migrations import MIGRATIONS, migrate
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)', [(1, 'Ann'), (2, 'Bob'), (3, 'Cy')])
+        conn.execute("INSERT INTO Users (UserID, Username, Password, Name, UserType) "
+                     "VALUES (101, 'lib1', 'x', 'Librarian One', 'librarian')")
+        conn.commit()
+    return library
+
+
+def status(library, isbn):
+    with library.connection() as conn:
+        return conn.execute('SELECT AvailabilityStatus FROM Books WHERE ISBN = ?', (isbn,)).fetchone()[0]
+
+
+def assert_counts_match_copies(library):
+    with library.connection() as conn:
+        counted = conn.execute('''
+            SELECT b.ISBN, COUNT(c.Barcode), COALESCE(SUM(c.State = 'available'), 0)
+            FROM Books b LEFT JOIN Copies c ON c.ISBN = b.ISBN GROUP BY b.ISBN ORDER BY b.ISBN
+        ''').fetchall()
+        maintained = conn.execute('''
+            SELECT b.ISBN, COALESCE(n.TotalCount, 0), COALESCE(n.AvailableCount, 0)
+            FROM Books b LEFT JOIN CopyCounts n ON n.ISBN = b.ISBN ORDER BY b.ISBN
+        ''').fetchall()
+        statuses = conn.execute('SELECT ISBN, AvailabilityStatus FROM Books ORDER BY ISBN').fetchall()
+    assert maintained == counted
+    assert statuses == [(isbn, 'Available' if available else 'Loaned') for isbn, _, available in counted]
+
+
+def test_each_loan_takes_its_own_copy_until_none_are_left(library, librarian_client):
+    assert library.add_book('111', 'Atlas', 'Ann Author', 'Maps', 2020, copies=3, location='Stacks A')[0]
+    assert library.get_copy_counts('111') == (3, 3)
+
+    for member_id in (1, 2, 3):
+        assert library.loan_book('111', member_id)[0]
+        # Still on the shelf while any copy is left
+        assert status(library, '111') == ('Available' if member_id < 3 else 'Loaned')
+    assert library.get_copy_counts('111') == (0, 3)
+    assert library.loan_book('111', 1) == (False, 'Book is not available!')
+
+    with library.connection() as conn:
+        loans = conn.execute('SELECT LoanID, CopyBarcode FROM Loans ORDER BY LoanID').fetchall()
+    assert [barcode for _, barcode in loans] == ['111-1', '111-2', '111-3']
+
+    client = librarian_client
+    client.get(f'/return_book/{loans[1][0]}')
+    client.get(f'/return_book/{loans[1][0]}')  # returning twice doesn't free a second copy
+    assert library.get_copy_counts('111') == (1, 3)
+    assert status(library, '111') == 'Available'
+    assert library.loan_book('111', 1)[0]
+    with library.connection() as conn:
+        assert conn.execute('SELECT CopyBarcode FROM Loans ORDER BY LoanID DESC').fetchone()[0] == '111-2'
+
+
+def test_counts_and_status_stay_exact_under_any_copy_change(library):
+    rng = random.Random(7)
+    for n in range(20):
+        library.add_book(f'9{n:02d}', f'Title {n}', 'Author', 'Fiction', 2000, copies=rng.randint(1, 3))
+    for _ in range(300):
+        isbn = f'9{rng.randrange(20):02d}'
+        action = rng.random()
+        if action < 0.4:
+            library.loan_book(isbn, 1)
+        elif action < 0.7:
+            with library.connection() as conn:
+                loan = conn.execute('SELECT LoanID FROM Loans WHERE BookID = ? AND ReturnDate IS NULL',
+                                    (isbn,)).fetchone()
+            if loan:
+                with library.connection() as conn:
+                    conn.execute("UPDATE Copies SET State = 'available' WHERE Barcode = "
+                                 "(SELECT CopyBarcode FROM Loans WHERE LoanID = ?)", loan)
+                    conn.execute("UPDATE Loans SET ReturnDate = date('now') WHERE LoanID = ?", loan)
+                    conn.commit()
+        elif action < 0.8:
+            library.add_book_copies(isbn, 1)
+        elif action < 0.9:
+            with library.connection() as conn:
+                conn.execute("UPDATE Copies SET State = 'lost' WHERE Barcode = "
+                             "(SELECT Barcode FROM Copies WHERE ISBN = ? ORDER BY random() LIMIT 1)", (isbn,))
+                conn.commit()
+        else:
+            with library.connection() as conn:
+                conn.execute('DELETE FROM Copies WHERE Barcode = '
+                             '(SELECT Barcode FROM Copies WHERE ISBN = ? ORDER BY random() LIMIT 1)', (isbn,))
+                conn.commit()
+    assert_counts_match_copies(library)
+
+    with library.connection() as conn:
+        conn.execute("DELETE FROM Books WHERE ISBN = '900'")
+        conn.commit()
+        assert conn.execute("SELECT COUNT(*) FROM Copies WHERE ISBN = '900'").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM CopyCounts WHERE ISBN = '900'").fetchone()[0] == 0
+
+
+def test_low_stock_and_copy_selection_are_index_lookups(library, librarian_client):
+    library.add_book('111', 'Atlas', 'Ann Author', 'Maps', 2020, copies=3)
+    library.add_book('222', 'Birds', 'Bob Author', 'Nature', 2021)
+    library.add_book('333', 'Comets', 'Cy Author', 'Space', 2022, copies=2)
+    library.loan_book('222', 1)
+    library.loan_book('333', 2)
+
+    low = library.get_low_stock_books()
+    assert [(book[0], book[3], book[4], book[5], book[6]) for book in low] == [
+        ('222', 'Loaned', 'Nature', 0, 1),
+        ('333', 'Available', 'Space', 1, 2),
+    ]
+    assert [book[0] for book in library.get_low_stock_books(threshold=0)] == ['222']
+
+    with library.connection() as conn:
+        plan = ' '.join(row[3] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT ISBN FROM CopyCounts WHERE AvailableCount <= 1'))
+        assert 'idx_copy_counts_available' in plan
+        plan = ' '.join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT Barcode FROM Copies WHERE ISBN = '111' AND State = 'available' "
+            'ORDER BY Barcode LIMIT 1'))
+        assert 'idx_copies_isbn_state' in plan and 'TEMP B-TREE' not in plan
+
+    client = librarian_client
+    page = client.get('/inventory_alerts')
+    assert page.status_code == 200
+    assert b'1 of 2 copies available' in page.data and b'All 1 copy on loan' in page.data
+
+
+def test_migration_gives_existing_books_one_copy_and_links_open_loans(tmp_path, monkeypatch, librarian_client):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path, migrations=[migration for migration in MIGRATIONS if migration[0] < 13])
+    library = LibraryManager(db_path)
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Members (MemberID, Name) VALUES (1, 'Ann')")
+        conn.executemany("INSERT INTO Books (ISBN, Title, Author, AvailabilityStatus) VALUES (?, ?, 'A', ?)",
+                         [('111', 'Atlas', 'Available'), ('222', 'Birds', 'Loaned')])
+        conn.executemany('INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, ReturnDate) '
+                         "VALUES (?, 1, '2024-01-01', '2024-01-15', ?)", [('111', '2024-01-10'), ('222', None)])
+        conn.commit()
+
+    migrate(db_path)
+    assert library.get_copy_counts('111') == (1, 1)
+    assert library.get_copy_counts('222') == (0, 1)
+    with library.connection() as conn:
+        assert conn.execute('SELECT BookID, CopyBarcode FROM Loans ORDER BY LoanID').fetchall() == [
+            ('111', None), ('222', '222-1')]
+        loan_id = conn.execute("SELECT LoanID FROM Loans WHERE BookID = '222'").fetchone()[0]
+    assert_counts_match_copies(library)
+
+    client = librarian_client
+    monkeypatch.setattr(app_module, 'library', library)
+    client.get(f'/return_book/{loan_id}')
+    assert library.get_copy_counts('222') == (1, 1) and status(library, '222') == 'Available'
@@ -0,0 +1,91 @@
+"""
+Tests for the TableVersions counters and conditional GETs on the JSON endpoints
+"""
+import sqlite3
+
+import pytest
+
+from app import LibraryManager
+from data_versions import read_versions
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)', [(1, 'Ann'), (2, 'Bob')])
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType, MemberID) "
+                         "VALUES (?, ?, 'x', ?, ?, ?)", [
+                             (101, 'lib1', 'Librarian One', 'librarian', None),
+                             (201, 'ann', 'Ann', 'student', 1),
+                             (202, 'bob', 'Bob', 'student', 2),
+                         ])
+        conn.execute("INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus) "
+                     "VALUES ('9780000000001', 'Atlas', 'Ann Author', 'Maps', 2020, 'Available')")
+        conn.commit()
+    return library
+
+
+def versions(library, *tables):
+    with library.connection() as conn:
+        return read_versions(conn, tables)[1]
+
+
+def test_every_write_bumps_only_its_tables_version(library):
+    before = versions(library, 'Books', 'Loans', 'Fines')
+    library.loan_book('9780000000001', 1)
+    after = versions(library, 'Books', 'Loans', 'Fines')
+    assert after['Loans'] == before['Loans'] + 1
+    assert after['Books'] == before['Books'] + 1  # AvailabilityStatus changed
+    assert after['Fines'] == before['Fines']
+
+    with library.connection() as conn:
+        conn.execute('DELETE FROM Loans')
+        conn.commit()
+    assert versions(library, 'Loans')['Loans'] == after['Loans'] + 1
+
+
+def test_unchanged_data_is_answered_with_304_without_running_the_view(library, librarian_client, monkeypatch):
+    client = librarian_client
+    first = client.get('/api/dashboard_stats')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    calls = []
+    monkeypatch.setattr(library, 'get_dashboard_stats', lambda: calls.append(1) or {})
+    again = client.get('/api/dashboard_stats', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b'' and calls == []
+
+    library.loan_book('9780000000001', 1)
+    changed = client.get('/api/dashboard_stats', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']
+    assert calls == [1]
+
+
+def test_per_user_endpoints_tag_each_user_separately(library, client_for):
+    library.loan_book('9780000000001', 1)
+    ann = client_for(201, 'student', 1).get('/api/student_dashboard_refresh')
+    bob = client_for(202, 'student', 2).get('/api/student_dashboard_refresh')
+    assert len(ann.get_json()['data']['loans']) == 1 and bob.get_json()['data']['loans'] == []
+    assert ann.headers['ETag'] != bob.headers['ETag']
+    assert client_for(202, 'student', 2).get('/api/student_dashboard_refresh',
+                                             headers={'If-None-Match': ann.headers['ETag']}).status_code == 200
+
+    # Failed responses aren't tagged, so a client never revalidates an error into a 304
+    failed = client_for(203, 'student').get('/api/student_dashboard_refresh')
+    assert failed.status_code == 400 and 'ETag' not in failed.headers
+
+
+def test_tags_agree_across_connections_and_processes(library, librarian_client):
+    client = librarian_client
+    etag, _ = client.get('/api/recent_returns').get_etag()
+    # Another worker has its own pool and manager; same file, same tag
+    other = LibraryManager(library.db_name)
+    assert other.get_data_etag(('Loans', 'Books', 'Members'), 'api_recent_returns', b'', None) == etag
+
+    # A commit from an unrelated connection (another worker, a cron job) invalidates it
+    conn = sqlite3.connect(library.db_name)
+    conn.execute("UPDATE Members SET Name = 'Ann B' WHERE MemberID = 1")
+    conn.commit()
+    conn.close()
+    assert client.get('/api/recent_returns', headers={'If-None-Match': f'"{etag}"'}).status_code == 200
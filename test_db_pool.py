@@ -0,0 +1,143 @@
+"""
+Tests for the pooled SQLite connection layer
+"""
+import sqlite3
+import threading
+
+import pytest
+
+from db_pool import (ConnectionPool, PoolTimeout, STORAGE_PROFILE, check_storage_profile,
+                     load_storage_profile, read_storage_settings)
+
+
+def test_close_returns_connection_to_pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2)
+
+    conn = pool.acquire()
+    raw = conn.raw
+    conn.close()
+    conn.close()  # second close is a no-op
+
+    again = pool.acquire()
+    assert again.raw is raw
+    again.close()
+
+    stats = pool.stats()
+    assert stats['opens'] == 1
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 0
+
+
+def test_uncommitted_work_is_rolled_back_on_release(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=1)
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+
+    with pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+
+def test_closed_proxy_refuses_queries(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'))
+    conn = pool.acquire()
+    conn.close()
+    with pytest.raises(Exception):
+        conn.execute('SELECT 1')
+
+
+def test_pool_is_bounded_and_counts_waits(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    released = threading.Timer(0.05, held.close)
+    pool.timeout = 5
+    released.start()
+    conn = pool.acquire()
+    conn.close()
+
+    stats = pool.stats()
+    assert stats['opens'] == 1
+    assert stats['waits'] == 2
+    assert stats['timeouts'] == 1
+
+
+def test_a_slow_open_does_not_hold_up_the_pool(tmp_path, monkeypatch):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2, timeout=5)
+    idle = pool.acquire()
+    idle.close()
+    held = pool.acquire()
+
+    opening, release_open = threading.Event(), threading.Event()
+    real_open = pool._open
+
+    def slow_open():
+        opening.set()
+        release_open.wait(5)
+        return real_open()
+
+    monkeypatch.setattr(pool, '_open', slow_open)
+    opener = threading.Thread(target=lambda: pool.acquire().close())
+    opener.start()
+    assert opening.wait(5)
+    # While the second connection is being opened, the first goes back and out again
+    reused = []
+    desk = threading.Thread(target=lambda: (held.close(), reused.append(pool.acquire())))
+    desk.start()
+    desk.join(1)
+    assert reused and pool.stats()['in_use'] == 2
+    reused[0].close()
+    release_open.set()
+    opener.join(5)
+    assert pool.stats()['opens'] == 2
+
+    # A failed open gives its slot back
+    monkeypatch.setattr(pool, '_open', lambda: (_ for _ in ()).throw(sqlite3.OperationalError('locked')))
+    pool.close_all()
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_dropped_connection_is_reclaimed(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=1, timeout=0.1)
+
+    def leaky():
+        conn = pool.acquire()
+        conn.execute('SELECT 1')
+        # no close(): the proxy goes out of scope
+
+    leaky()
+    conn = pool.acquire()
+    conn.close()
+    assert pool.stats()['reclaimed'] == 1
+
+
+def test_storage_profile_applied_to_every_connection(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2,
+                          profile=load_storage_profile({'synchronous': 'FULL'}))
+    first = pool.acquire()
+    second = pool.acquire()
+    for conn in (first, second):
+        settings = read_storage_settings(conn)
+        assert settings['journal_mode'] == 'WAL'
+        assert settings['synchronous'] == 'FULL'
+        assert settings['temp_store'] == 'MEMORY'
+        assert settings['busy_timeout'] == STORAGE_PROFILE['busy_timeout']
+    first.close()
+    second.close()
+
+    ok, report = check_storage_profile(pool)
+    assert ok
+    assert report['journal_mode'] == {'requested': 'WAL', 'effective': 'WAL'}
+
+
+def test_storage_profile_env_override(monkeypatch):
+    monkeypatch.setenv('LIBRARY_DB_BUSY_TIMEOUT', '12000')
+    monkeypatch.setenv('LIBRARY_DB_SYNCHRONOUS', 'full')
+    profile = load_storage_profile()
+    assert profile['busy_timeout'] == 12000
+    assert profile['synchronous'] == 'FULL'
@@ -0,0 +1,120 @@
+"""
+Tests for the live event hub (change watcher, audiences, replay) and /api/events
+"""
+import json
+import sqlite3
+
+import pytest
+
+from events import EventHub
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType) VALUES (?, ?, 'x', ?, ?)", [
+            (101, 'lib1', 'Librarian One', 'librarian'),
+            (201, 'stu1', 'Student One', 'student'),
+            (202, 'stu2', 'Student Two', 'student'),
+        ])
+        conn.commit()
+    return library
+
+
+@pytest.fixture
+def hub(library):
+    hub = EventHub(library.db_name, library.pool.profile, heartbeat=0.05, stream_seconds=0.3)
+    hub.check()  # baseline
+    return hub
+
+
+def published(hub, after=0):
+    return [(kind, data, audience) for _, kind, data, audience in hub.wait(after, 0)]
+
+
+def parse(chunks):
+    """(id, event, data) for each SSE message in a stream body"""
+    messages = []
+    for chunk in chunks:
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            messages.append((fields['id'], fields['event'], json.loads(fields['data'])))
+    return messages
+
+
+def test_watcher_publishes_only_what_changed(library, hub):
+    assert hub.check() == 0
+
+    library.send_message(101, 201, 'Your hold is in', 'Pick it up at the desk', 'librarian_reply')
+    library.create_announcement('Closed Monday', 'Bank holiday', 101, target_audience='student')
+    # A write from a connection outside this process's pool, as another worker would make
+    conn = sqlite3.connect(library.db_name)
+    conn.execute("INSERT INTO Books (ISBN, Title, Author, Genre, PublicationYear, AvailabilityStatus) "
+                 "VALUES ('9780000000001', 'Atlas', 'Ann Author', 'Maps', 2020, 'Available')")
+    conn.commit()
+    conn.close()
+
+    assert hub.check() > 0
+    events = published(hub)
+    stats = [data for kind, data, _ in events if kind == 'stats']
+    assert stats == [{'total_books': 1, 'available_books': 1, 'unread_messages': 1}]
+    assert ('message', 'user:201') in [(kind, audience) for kind, _, audience in events]
+    message = next(data for kind, data, _ in events if kind == 'message')
+    assert message['subject'] == 'Your hold is in' and message['unread'] == 1
+    assert message['sender_name'] == 'Librarian One'
+    assert [(data['title'], audience) for kind, data, audience in events if kind == 'announcement'] == \
+        [('Closed Monday', 'student')]
+
+    # Nothing committed since: data_version hasn't moved, nothing is queried or published
+    assert hub.check() == 0
+
+
+def test_stream_forwards_only_the_users_events_and_replays_on_reconnect(hub):
+    stream = hub.stream(201, 'student')
+    hub.publish('stats', {'active_loans': 3}, 'librarian')
+    hub.publish('message', {'subject': 'For 202'}, 'user:202')
+    hub.publish('message', {'subject': 'For 201'}, 'user:201')
+    hub.publish('announcement', {'title': 'Everyone'}, 'all')
+    events = parse(stream)
+    assert [(kind, data) for _, kind, data in events] == [('message', {'subject': 'For 201'}),
+                                                         ('announcement', {'title': 'Everyone'})]
+
+    # Reconnecting with Last-Event-ID replays what was published while disconnected
+    hub.publish('message', {'subject': 'While away'}, 'user:201')
+    replayed = parse(hub.stream(201, 'student', last_event_id=events[0][0]))
+    assert [data['title' if kind == 'announcement' else 'subject'] for _, kind, data in replayed] == \
+        ['Everyone', 'While away']
+    # An id from another process (or a restarted one) can't be replayed
+    assert parse(hub.stream(201, 'student', last_event_id='deadbeef-1')) == []
+
+
+def test_stream_slots_are_bounded_and_freed_on_close(hub):
+    hub.max_streams = 2
+    first, second = hub.stream(1, 'librarian'), hub.stream(2, 'librarian')
+    assert hub.stream(3, 'librarian') is None
+    assert hub.stats()['streams_rejected'] == 1
+
+    first.close()  # never iterated: the server closes it when the client is already gone
+    third = hub.stream(3, 'librarian')
+    assert third is not None and hub.stats()['streams'] == 2
+    list(second)
+    third.close()
+    assert hub.stats()['streams'] == 0
+
+
+def test_events_endpoint_streams_and_refuses_when_full(library, client_for):
+    client = client_for(201, 'student')
+    events = library.events
+    saved = events.max_streams
+    try:
+        response = client.get('/api/events', buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert next(response.response).startswith(b'retry:')
+        events.max_streams = events.stats()['streams']
+        assert client.get('/api/events').status_code == 503
+        response.close()
+    finally:
+        events.max_streams = saved
+    assert events.stats()['streams'] == 0
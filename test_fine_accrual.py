@@ -0,0 +1,76 @@
+"""
+Tests for set-based fine accrual and the scheduled job runner
+"""
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        # Standard tier (0.50/day) and Student tier (0.10/day) members
+        standard = conn.execute("INSERT INTO Members (Name, MembershipTier) VALUES ('Standard', 1)").lastrowid
+        student = conn.execute("INSERT INTO Members (Name, MembershipTier) VALUES ('Student', 3)").lastrowid
+        conn.executemany('INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate, ReturnDate) VALUES (?, ?, ?, ?, ?)', [
+            ('B1', standard, '2024-01-01', '2024-01-15', None),          # overdue, open
+            ('B2', student, '2024-01-01', '2024-01-10', None),           # overdue, open
+            ('B3', standard, '2024-01-01', '2024-01-15', '2024-01-18'),  # returned late, never fined
+            ('B4', standard, '2024-01-01', '2024-02-15', None),          # not due yet
+        ])
+        conn.commit()
+    return library
+
+
+def fines(library):
+    with library.connection() as conn:
+        return conn.execute('''
+            SELECT l.BookID, f.Amount, f.AccruedThrough FROM Fines f JOIN Loans l ON l.LoanID = f.LoanID
+            ORDER BY l.BookID
+        ''').fetchall()
+
+
+def test_accrual_creates_then_grows_fines_once_per_day(library):
+    assert library.accrue_overdue_fines('2024-01-20') == {'created': 2, 'updated': 0}
+    assert fines(library) == [('B1', 2.5, '2024-01-20'), ('B2', 1.0, '2024-01-20')]
+
+    assert library.accrue_overdue_fines('2024-01-20') == {'created': 0, 'updated': 0}
+
+    with library.connection() as conn:
+        conn.execute("UPDATE Loans SET ReturnDate = '2024-01-22' WHERE BookID = 'B2'")
+        conn.commit()
+    assert library.accrue_overdue_fines('2024-01-25') == {'created': 0, 'updated': 2}
+    # B2 stops accruing at its return date
+    assert fines(library) == [('B1', 5.0, '2024-01-25'), ('B2', 1.2, '2024-01-22')]
+
+
+def test_paid_fines_stop_growing(library):
+    library.accrue_overdue_fines('2024-01-20')
+    with library.connection() as conn:
+        conn.execute("UPDATE Fines SET Status = 'paid'")
+        conn.commit()
+    assert library.accrue_overdue_fines('2024-01-30') == {'created': 0, 'updated': 0}
+
+
+def test_job_runs_once_per_slot_and_records_timing(library):
+    run = jobs.run_job(library, 'accrue_fines')
+    # The job accrues up to today, by which time every open loan is overdue
+    assert run['status'] == 'succeeded' and run['result']['created'] == 3
+    assert jobs.run_job(library, 'accrue_fines') is None
+    assert jobs.run_job(library, 'accrue_fines', force=True)['result'] == {'created': 0, 'updated': 0}
+
+    history = jobs.job_history(library, name='accrue_fines')
+    assert [row[3] for row in history] == ['succeeded', 'succeeded']
+    assert all(row[5] is not None for row in history)
+
+
+def test_failed_run_can_be_claimed_again(library, monkeypatch):
+    def broken(library):
+        raise RuntimeError('disk full')
+    monkeypatch.setitem(jobs.JOBS, 'accrue_fines', (broken, 'daily'))
+    assert jobs.run_job(library, 'accrue_fines')['error'] == 'RuntimeError: disk full'
+
+    monkeypatch.setitem(jobs.JOBS, 'accrue_fines', (jobs._accrue_fines, 'daily'))
+    assert jobs.run_job(library, 'accrue_fines')['status'] == 'succeeded'
+    assert [row[3] for row in jobs.job_history(library)] == ['succeeded']
@@ -0,0 +1,151 @@
+"""
+Tests for the FIFO hold queue: positions, allocation on return, pickup and the expiry sweeper
+"""
+import threading
+
+import pytest
+
+from app import LibraryManager
+from jobs import JOBS
+from migrations import MIGRATIONS, migrate
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)',
+                         [(1, 'Ann'), (2, 'Bob'), (3, 'Cy'), (4, 'Dee')])
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType, MemberID) "
+                         "VALUES (?, ?, 'x', ?, ?, ?)", [
+                             (101, 'lib1', 'Librarian One', 'librarian', None),
+                             (202, 'bob', 'Bob', 'student', 2),
+                         ])
+        conn.commit()
+    library.add_book('111', 'Atlas', 'Ann Author', 'Maps', 2020)
+    return library
+
+
+def positions(library, *member_ids):
+    return [[(hold[1], hold[6], hold[7]) for hold in library.get_member_holds(member_id)]
+            for member_id in member_ids]
+
+
+def test_returned_copy_goes_to_the_head_of_the_queue(library, librarian_client):
+    assert library.loan_book('111', 1)[0]
+    assert library.create_reservation('111', 2) == (True, 'Book reserved. Position 1 in the queue')
+    assert library.create_reservation('111', 3)[1] == 'Book reserved. Position 2 in the queue'
+    assert library.create_reservation('111', 4)[0]
+    assert library.create_reservation('111', 3) == (False, 'Member already has a hold on this book!')
+    assert positions(library, 2, 3, 4) == [[('111', 0, 1)], [('111', 0, 2)], [('111', 0, 3)]]
+
+    with library.connection() as conn:
+        loan_id = conn.execute('SELECT LoanID FROM Loans').fetchone()[0]
+    librarian_client.get(f'/return_book/{loan_id}')
+
+    # Bob's hold is ready, the copy is on the hold shelf rather than back in circulation
+    assert positions(library, 2, 3, 4) == [[('111', 1, 0)], [('111', 0, 1)], [('111', 0, 2)]]
+    assert library.get_copy_counts('111') == (0, 1)
+    assert library.loan_book('111', 3) == (False, 'Book is not available!')
+    assert [message[4] for message in library.get_inbox(202)][:1] == ['Hold ready: Atlas']
+
+    # Bob collects it: the hold is fulfilled and the queue moves up
+    assert library.loan_book('111', 2)[0]
+    assert positions(library, 2, 3, 4) == [[], [('111', 0, 1)], [('111', 0, 2)]]
+    with library.connection() as conn:
+        assert conn.execute("SELECT Status FROM BookReservations WHERE MemberID = 2").fetchone()[0] == 'fulfilled'
+        assert conn.execute("SELECT State FROM Copies WHERE Barcode = '111-1'").fetchone()[0] == 'loaned'
+
+
+def test_positions_follow_cancellations_and_use_the_queue_index(library):
+    library.loan_book('111', 1)
+    for member_id in (2, 3, 4):
+        library.create_reservation('111', member_id)
+    assert library.cancel_reservation(1)  # Bob, at the head
+    assert not library.cancel_reservation(1)  # already cancelled
+    assert positions(library, 3, 4) == [[('111', 0, 1)], [('111', 0, 2)]]
+
+    # New copies fill the queue before reaching the shelf
+    library.add_book_copies('111', 2)
+    assert positions(library, 3, 4) == [[('111', 1, 0)], [('111', 1, 0)]]
+    assert library.get_copy_counts('111') == (0, 3)
+
+    with library.connection() as conn:
+        plan = ' '.join(row[3] for row in conn.execute('''
+            EXPLAIN QUERY PLAN SELECT COUNT(*) FROM BookReservations q
+            WHERE q.BookID = '111' AND q.Status = 'active' AND q.CopyBarcode IS NULL AND q.QueueSeq < 5
+        '''))
+    assert 'idx_reservations_queue' in plan
+
+
+def test_sweeper_expires_uncollected_holds_and_passes_the_copy_on(library):
+    library.create_reservation('111', 2)
+    assert library.loan_book('111', 1) == (False, 'Book is not available!')  # the only copy is held for Bob
+    assert library.get_copy_counts('111') == (0, 1)
+    library.create_reservation('111', 3)
+
+    assert JOBS['expire_holds'][0](library) == {'expired': 0, 'reallocated': 0}
+    # Bob was told to pick up by his ExpiryDate: a shorter setting doesn't bring that forward
+    library.update_system_setting('reservation_hold_days', '2')
+    with library.connection() as conn:
+        conn.execute("UPDATE BookReservations SET ReadyDate = date('now', '-3 days'), "
+                     "ExpiryDate = date('now') WHERE MemberID = 2")
+        conn.commit()
+    assert library.expire_stale_holds() == {'expired': 0, 'reallocated': 0}
+    with library.connection() as conn:
+        conn.execute("UPDATE BookReservations SET ExpiryDate = date('now', '-1 days') WHERE MemberID = 2")
+        conn.commit()
+        plan = ' '.join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT ReservationID FROM BookReservations "
+            "WHERE Status = 'active' AND CopyBarcode IS NOT NULL AND ExpiryDate < date('now')"))
+    assert 'idx_reservations_expiry' in plan
+    assert library.expire_stale_holds() == {'expired': 1, 'reallocated': 1}
+    assert positions(library, 2, 3) == [[], [('111', 1, 0)]]
+    with library.connection() as conn:
+        expiry = conn.execute("SELECT ExpiryDate = date('now', '+2 days') FROM BookReservations "
+                              "WHERE MemberID = 3").fetchone()[0]
+    assert expiry == 1
+
+    # The last hold in line expiring puts the copy back on the shelf
+    with library.connection() as conn:
+        conn.execute("UPDATE BookReservations SET ExpiryDate = date('now', '-1 days') WHERE MemberID = 3")
+        conn.commit()
+    assert library.expire_stale_holds() == {'expired': 1, 'reallocated': 0}
+    assert library.get_copy_counts('111') == (1, 1)
+
+
+def test_simultaneous_holds_by_one_member_queue_once(library):
+    assert library.loan_book('111', 1)[0]
+    barrier = threading.Barrier(6)
+    results = []
+
+    def reserve():
+        barrier.wait()
+        results.append(library.create_reservation('111', 2)[0])
+
+    threads = [threading.Thread(target=reserve) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 5 + [True]
+    assert positions(library, 2) == [[('111', 0, 1)]]
+
+
+def test_migration_queues_existing_reservations_in_order(tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path, migrations=[migration for migration in MIGRATIONS if migration[0] < 14])
+    library = LibraryManager(db_path)
+    with library.connection() as conn:
+        conn.execute("INSERT INTO Books (ISBN, Title, Author, AvailabilityStatus) VALUES ('111', 'Atlas', 'A', "
+                     "'Available')")
+        conn.executemany("INSERT INTO BookReservations (BookID, MemberID, ExpiryDate) VALUES ('111', ?, '2024-01-04')",
+                         [(5,), (6,)])
+        conn.commit()
+
+    migrate(db_path)
+    assert positions(library, 5, 6) == [[('111', 1, 0)], [('111', 0, 1)]]
+    with library.connection() as conn:
+        assert conn.execute('SELECT MemberID, ExpiryDate IS NULL FROM BookReservations ORDER BY MemberID').fetchall() \
+            == [(5, 0), (6, 1)]
+    assert library.get_copy_counts('111') == (0, 1)
@@ -0,0 +1,205 @@
+"""
+Tests for pooled SMTP delivery, against a local SMTP stand-in server
+"""
+import socketserver
+import threading
+import time
+
+import pytest
+
+from library_chatbot import LibraryChatbot
+from mailer import Mailer
+from migrations import migrate
+
+
+class StandInSMTP(socketserver.ThreadingTCPServer):
+    """Just enough SMTP (EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, QUIT) to accept mail
+
+    `faults` maps a recipient to a list of replies its RCPT gets before it is
+    accepted, e.g. ['451 try later'] or ['drop'] to close the connection.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.latency = latency
+        self.faults = {}
+        self.delivered = []
+        self.connections = 0
+        self.logins = 0
+        self.lock = threading.Lock()
+
+    @property
+    def config(self):
+        return {'smtp_server': '127.0.0.1', 'smtp_port': self.server_address[1], 'use_tls': False,
+                'sender_email': 'library@example.com', 'sender_password': 'secret'}
+
+
+class StandInHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stand-in ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                return
+            verb = line.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-stand-in')
+                self.reply('250 AUTH PLAIN')
+            elif verb == 'AUTH':
+                with server.lock:
+                    server.logins += 1
+                self.reply('235 authenticated')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 ok')
+            elif verb == 'RCPT':
+                address = line.split(':', 1)[1].strip('<> ')
+                with server.lock:
+                    fault = server.faults.get(address, []).pop(0) if server.faults.get(address) else None
+                if fault == 'drop':
+                    return
+                if fault:
+                    self.reply(fault)
+                else:
+                    recipients.append(address)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(server.latency)
+                with server.lock:
+                    server.delivered.extend(recipients)
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+@pytest.fixture
+def smtp_server():
+    server = StandInSMTP()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def batch(mail, count):
+    return ((i, mail.message(f'member{i}@example.com', 'Reminder', 'Please return your book')) for i in range(count))
+
+
+def test_sessions_are_reused_across_messages(smtp_server):
+    mail = Mailer(smtp_server.config, workers=3)
+    report = mail.send_all(batch(mail, 60))
+    assert (report.sent, report.failed) == (60, 0)
+    assert sorted(smtp_server.delivered) == sorted(f'member{i}@example.com' for i in range(60))
+    assert report.sessions == smtp_server.connections == smtp_server.logins <= 3
+    assert report.messages_per_sec > 0
+
+
+def test_transient_failures_are_retried_and_permanent_ones_are_not(smtp_server):
+    smtp_server.faults = {
+        'member1@example.com': ['451 mailbox busy', '421 too many connections'],
+        'member2@example.com': ['drop'],
+        'member3@example.com': ['550 no such user'],
+    }
+    mail = Mailer(smtp_server.config, workers=2, backoff=0.01)
+    results = {}
+    report = mail.send_all(batch(mail, 5), on_result=lambda key, error: results.update({key: error}))
+    assert (report.sent, report.failed, report.retries) == (4, 1, 3)
+    assert [key for key, _ in report.failures] == [3]
+    assert results[3] is not None and sum(error is None for error in results.values()) == 4
+    assert 'member3@example.com' not in smtp_server.delivered
+
+
+def test_a_failing_result_callback_does_not_stop_delivery(smtp_server):
+    mail = Mailer(smtp_server.config, workers=2)
+    recorded = []
+
+    def on_result(key, error):
+        if key % 2:
+            raise RuntimeError('database is locked')
+        recorded.append(key)
+
+    # Many more messages than the queue holds: dead workers would block send_all for good
+    report = mail.send_all(batch(mail, 20), on_result=on_result)
+    assert (report.sent, report.failed) == (20, 0)
+    assert sorted(recorded) == list(range(0, 20, 2))
+    assert sorted(key for key, _ in report.callback_errors) == list(range(1, 20, 2))
+    assert report.callback_errors[0][1] == 'RuntimeError: database is locked'
+
+
+def test_retries_give_up_after_max_retries(smtp_server):
+    smtp_server.faults = {'member0@example.com': ['451 busy'] * 10}
+    mail = Mailer(smtp_server.config, workers=1, max_retries=2, backoff=0.01)
+    report = mail.send_all(batch(mail, 1))
+    assert (report.sent, report.failed, report.retries) == (0, 1, 2)
+
+
+def test_chatbot_sends_overdue_reminders_concurrently(smtp_server, tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    chatbot = LibraryChatbot(db_path)
+    with chatbot.get_connection() as conn:
+        conn.execute("INSERT INTO Books VALUES ('B1', 'Overdue Book', 'Author', 'Fiction', 2000, 'Loaned')")
+        for i in range(20):
+            contact = f'reader{i}@example.com' if i else 'no email on file'
+            member = conn.execute('INSERT INTO Members (Name, ContactInfo) VALUES (?, ?)',
+                                  (f'Reader {i}', contact)).lastrowid
+            conn.execute("INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate) "
+                         "VALUES ('B1', ?, '2024-01-01', '2024-01-15')", (member,))
+    chatbot.email_config = dict(smtp_server.config, workers=4)
+    smtp_server.latency = 0.01
+
+    report = chatbot.send_overdue_reminders()
+    assert (report.sent, report.failed) == (19, 0)
+    assert len(smtp_server.delivered) == 19
+    assert smtp_server.connections <= 4
+
+
+def test_digests_group_each_members_loans_into_one_email(smtp_server, tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    chatbot = LibraryChatbot(db_path)
+    with chatbot.get_connection() as conn:
+        conn.executemany("INSERT INTO Books VALUES (?, ?, 'Author', 'Fiction', 2000, 'Loaned')",
+                         [(f'B{i}', f'Book {i}') for i in range(5)])
+        ann = conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Ann', 'ann@example.com')").lastrowid
+        bob = conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Bob', 'bob@example.com')").lastrowid
+        conn.executemany("INSERT INTO Loans (BookID, MemberID, DueDate, ReturnDate) VALUES (?, ?, date('now', ?), ?)", [
+            ('B0', ann, '-10 days', None),
+            ('B1', ann, '+2 days', None),
+            ('B2', ann, '-3 days', None),
+            ('B3', ann, '+30 days', None),          # not due yet
+            ('B4', bob, '+1 days', None),
+            ('B0', bob, '-40 days', '2024-01-01'),  # returned
+        ])
+    chatbot.email_config = smtp_server.config
+
+    digests = chatbot.iter_reminder_digests(3, batch_size=1)
+    first = next(digests)
+    # Each batch is read and closed before it is handed out: a loan written meanwhile shows up in the next one
+    with chatbot.get_connection() as conn:
+        conn.execute("INSERT INTO Loans (BookID, MemberID, DueDate) VALUES ('B3', ?, date('now', '-1 days'))", (bob,))
+    digests = [first] + list(digests)
+    assert [(name, [loan[0] for loan in loans]) for _, name, _, loans in digests] == [
+        ('Ann', ['Book 0', 'Book 2', 'Book 1']), ('Bob', ['Book 3', 'Book 4'])]
+    assert [loan[3] for loan in digests[0][3]] == [10, 3, -2]
+
+    report = chatbot.send_reminder_digests(3)
+    assert report.sent == 2
+    assert sorted(smtp_server.delivered) == ['ann@example.com', 'bob@example.com']
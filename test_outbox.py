@@ -0,0 +1,173 @@
+"""
+Tests for the notification outbox: enqueueing with the change, exactly-once inbox delivery, email retries
+"""
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import outbox
+from app import LibraryManager
+from outbox import OutboxWorker, enqueue
+from test_mailer import smtp_server  # noqa: F401 (fixture)
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.executemany('INSERT INTO Members (MemberID, Name) VALUES (?, ?)', [(1, 'Ann'), (2, 'Bob')])
+        conn.executemany("INSERT INTO Users (UserID, Username, Password, Name, UserType, MemberID, Email) "
+                         "VALUES (?, ?, 'x', ?, ?, ?, ?)", [
+                             (101, 'lib1', 'Librarian One', 'librarian', None, None),
+                             (201, 'ann', 'Ann', 'student', 1, 'ann@example.com'),
+                             (202, 'bob', 'Bob', 'student', 2, None),
+                         ])
+        conn.commit()
+    library.add_book('111', 'Atlas', 'Ann Author', 'Maps', 2020)
+    yield library
+    library.outbox.stop()
+
+
+def outbox_rows(library):
+    with library.connection() as conn:
+        return conn.execute('SELECT Kind, Channel, ToUserID, Email, Status FROM Outbox ORDER BY OutboxID').fetchall()
+
+
+def messages(library, user_id):
+    with library.connection() as conn:
+        return conn.execute('SELECT Subject, MessageType, OutboxID FROM Messages WHERE ToUserID = ? ORDER BY MessageID',
+                            (user_id,)).fetchall()
+
+
+def test_return_queues_its_confirmation_and_the_worker_delivers_it_once(library, librarian_client, monkeypatch):
+    monkeypatch.setattr(library.outbox, 'wake', lambda: None)
+    assert library.loan_book('111', 1)[0]
+    with library.connection() as conn:
+        loan_id = conn.execute('SELECT LoanID FROM Loans').fetchone()[0]
+    librarian_client.get(f'/return_book/{loan_id}')
+
+    # Nothing is rendered or delivered in the request: an inbox row and one for Ann's email address
+    assert outbox_rows(library) == [('return_confirmation', 'inbox', 201, None, 'pending'),
+                                    ('return_confirmation', 'email', 201, 'ann@example.com', 'pending')]
+    assert messages(library, 201) == []
+
+    counts = library.deliver_outbox()
+    assert (counts['claimed'], counts['sent'], counts['skipped']) == (2, 1, 1)  # no email settings here
+    assert messages(library, 201) == [('Book Return Confirmation: Atlas', 'return_confirmation', 1)]
+    assert [row[4] for row in outbox_rows(library)] == ['sent', 'skipped']
+    assert library.deliver_outbox()['claimed'] == 0
+
+    # A worker that delivered a row but lost its claim (it looked dead) can't deliver it again
+    with library.connection() as conn:
+        conn.execute("UPDATE Outbox SET Status = 'sending', ClaimedBy = 'gone', ClaimedAt = 0 WHERE OutboxID = 1")
+        conn.commit()
+    assert library.deliver_outbox()['claimed'] == 1
+    assert len(messages(library, 201)) == 1
+    assert library.get_outbox_stats()['sent'] == 1
+
+
+def test_notifications_commit_and_roll_back_with_their_change(library, librarian_client):
+    # A request approval is queued in the loan's transaction and the background worker delivers it
+    response = librarian_client.post('/add_book_from_request', json={
+        'isbn': '222', 'title': 'Birds', 'author': 'Bob Author', 'member_id': '2', 'student_user_id': '202',
+        'loan_immediately': 'true'})
+    assert response.get_json()['success']
+    deadline = time.time() + 5
+    while not messages(library, 202) and time.time() < deadline:
+        time.sleep(0.05)
+    assert messages(library, 202) == [('Book Request Approved: Birds', 'librarian_reply', 1)]
+
+    # A loan that doesn't happen queues nothing
+    assert library.loan_book('222', 1, notification={'kind': 'request_approved', 'to_user_id': 201,
+                                                      'payload': {'title': 'Birds', 'author': 'Bob Author'}}) \
+        == (False, 'Book is not available!')
+    with pytest.raises(ValueError):
+        with library.connection() as conn:
+            enqueue(conn.cursor(), 'no_such_template', {}, to_user_id=201)
+    assert len(outbox_rows(library)) == 1
+
+
+def test_email_is_retried_with_backoff_and_refusals_fail_at_once(library, smtp_server, monkeypatch):
+    with library.connection() as conn:
+        for user_id, title in ((201, 'Atlas'), (202, 'Birds')):
+            enqueue(conn.cursor(), 'request_approved', {'title': title, 'author': 'A'}, to_user_id=user_id,
+                    email=f'user{user_id}@example.com')
+        conn.commit()
+    smtp_server.faults = {'user201@example.com': ['451 mailbox busy'], 'user202@example.com': ['550 no such user']}
+    worker = OutboxWorker(library.pool, dict(smtp_server.config, max_retries=0))
+
+    counts = worker.drain()
+    assert (counts['sent'], counts['pending'], counts['failed']) == (2, 1, 1)  # the two inbox rows were sent
+    with library.connection() as conn:
+        retry = conn.execute("SELECT Attempts, NextAttemptAt - ? > 20, LastError FROM Outbox "
+                             "WHERE Email = 'user201@example.com'", (time.time(),)).fetchone()
+    assert retry[:2] == (1, 1) and '451' in retry[2]
+    assert worker.drain()['claimed'] == 0  # not due yet
+
+    monkeypatch.setattr(outbox, 'RETRY_BACKOFF', 0)
+    with library.connection() as conn:
+        conn.execute("UPDATE Outbox SET NextAttemptAt = 0 WHERE Status = 'pending'")
+        conn.commit()
+    assert worker.drain()['sent'] == 1
+    assert smtp_server.delivered == ['user201@example.com']
+    assert [row[4] for row in outbox_rows(library)] == ['sent', 'sent', 'sent', 'failed']
+
+
+def test_a_database_error_recording_email_results_fails_the_cycle_without_hanging(library, smtp_server,
+                                                                                     monkeypatch):
+    with library.connection() as conn:
+        for n in range(10):
+            enqueue(conn.cursor(), 'request_approved', {'title': f'Title {n}', 'author': 'A'},
+                    email=f'reader{n}@example.com')
+        conn.commit()
+    worker = OutboxWorker(library.pool, dict(smtp_server.config, workers=2))
+
+    def locked(cursor, worker_id, outcomes):
+        raise sqlite3.OperationalError('database is locked')
+
+    # The mail sender threads never touch the database; the batch's results are written once at the end
+    monkeypatch.setattr(outbox, '_finish', locked)
+    finished = threading.Event()
+
+    def drain():
+        with pytest.raises(sqlite3.OperationalError):
+            worker.drain()
+        finished.set()
+
+    threading.Thread(target=drain, daemon=True).start()
+    assert finished.wait(10)
+    assert len(smtp_server.delivered) == 10
+    assert worker.stats()['last_error'] == 'OperationalError: database is locked'
+    assert {row[4] for row in outbox_rows(library)} == {'sending'}  # taken over after CLAIM_TIMEOUT
+
+
+def drain_in_process(db_path):
+    # Another web worker: its own pool and outbox worker on the same file
+    library = LibraryManager(db_path)
+    library.deliver_outbox()
+
+
+def test_concurrent_workers_deliver_each_row_exactly_once(library):
+    with library.connection() as conn:
+        for n in range(300):
+            enqueue(conn.cursor(), 'request_approved', {'title': f'Title {n}', 'author': 'A'}, to_user_id=202)
+        conn.commit()
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=drain_in_process, args=(library.db_name,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    library.deliver_outbox()
+    for worker in workers:
+        worker.join(60)
+    assert [worker.exitcode for worker in workers] == [0] * len(workers)
+
+    delivered = messages(library, 202)
+    assert len(delivered) == 300
+    assert sorted(outbox_id for _, _, outbox_id in delivered) == list(range(1, 301))
+    assert {row[4] for row in outbox_rows(library)} == {'sent'}
+    with library.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM MessageRecipients WHERE UserID = 202 AND ReadAt IS NULL'
+                            ).fetchone()[0] == 300
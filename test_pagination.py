@@ -0,0 +1,101 @@
+"""
+Tests for keyset pagination of the catalog, loan, member and fine listings
+"""
+import pytest
+
+from pagination import InvalidCursor, encode_cursor
+
+
+@pytest.fixture
+def library(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        conn.execute('DELETE FROM Loans')
+        conn.execute('DELETE FROM Books')
+        # Duplicate titles so the ISBN tie-breaker matters
+        conn.executemany(
+            "INSERT INTO Books VALUES (?, ?, 'Author', 'Fiction', 2000, ?)",
+            [(f'{i:03d}', f'Title {i // 3:02d}', 'Available' if i % 2 else 'Loaned') for i in range(25)])
+        member_id = conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Reader', 'r@example.com')").lastrowid
+        conn.executemany(
+            f"INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate) VALUES (?, {member_id}, '2024-01-01', ?)",
+            [(f'{i:03d}', f'2024-02-{1 + i % 4:02d}') for i in range(10)])
+        conn.commit()
+    return library
+
+
+def walk(fetch, limit):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = fetch(cursor, limit)
+        rows.extend(page)
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+
+def test_books_pages_cover_catalog_in_order_without_duplicates(library):
+    rows, pages = walk(library.get_books_page, 4)
+    assert pages == 7
+    assert [(b[1], b[0]) for b in rows] == sorted((b[1], b[0]) for b in library.get_all_books())
+
+    available, _ = walk(lambda c, n: library.get_books_page(c, n, available_only=True), 5)
+    assert len(available) == library.count_books(available_only=True) == 12
+    assert {b[5] for b in available} == {'Available'}
+
+
+def test_loans_page_by_due_date_then_loan_id(library):
+    rows, _ = walk(library.get_active_loans_page, 3)
+    assert [(l[4], l[0]) for l in rows] == sorted((l[4], l[0]) for l in library.get_active_loans())
+    assert len(rows) == library.count_active_loans() == 10
+
+
+def test_cursor_is_tied_to_its_listing(library):
+    _, cursor = library.get_books_page(limit=2)
+    with pytest.raises(InvalidCursor):
+        library.get_active_loans_page(cursor)
+    with pytest.raises(InvalidCursor):
+        library.get_books_page('not-a-cursor')
+    with pytest.raises(InvalidCursor):
+        library.get_books_page(encode_cursor('books', ['only one value']))
+
+
+def test_keyset_queries_seek_into_an_index(library):
+    _, cursor = library.get_books_page(limit=2)
+    with library.connection() as conn:
+        plan = conn.execute('''EXPLAIN QUERY PLAN
+            SELECT ISBN FROM Books WHERE (Title, ISBN) > (?, ?) ORDER BY Title, ISBN LIMIT 3
+        ''', ('Title 01', '004')).fetchall()
+    details = ' '.join(row[3] for row in plan)
+    assert 'idx_books_title_isbn' in details
+    assert 'TEMP B-TREE' not in details
+
+
+def test_api_returns_page_cursor_and_rendered_rows(library, librarian_client):
+    client = librarian_client
+
+    first = client.get('/api/books?limit=10&render=book_rows').get_json()
+    assert len(first['items']) == 10 and first['html'].count('<tr>') == 10
+    second = client.get(f"/api/books?limit=10&cursor={first['next_cursor']}").get_json()
+    assert 'html' not in second
+    assert first['items'][-1]['title'] <= second['items'][0]['title']
+    assert not {b['isbn'] for b in first['items']} & {b['isbn'] for b in second['items']}
+
+    assert client.get('/api/loans?cursor=garbage').status_code == 400
+
+
+def test_fine_rows_show_member_and_book_title(library, librarian_client):
+    with library.connection() as conn:
+        loan_id = conn.execute("SELECT MIN(LoanID) FROM Loans").fetchone()[0]
+        conn.execute("INSERT INTO Fines (MemberID, LoanID, FineType, Amount, IssueDate, Description, AccruedThrough) "
+                     "SELECT MemberID, LoanID, 'overdue', 1.5, '2024-02-10', 'Late', '2024-02-09' "
+                     "FROM Loans WHERE LoanID = ?", (loan_id,))
+        conn.commit()
+    client = librarian_client
+
+    body = client.get('/api/fines?render=fine_rows').get_json()
+    assert [(f['member_name'], f['book_title'], f['issue_date'], f['description']) for f in body['items']] == [
+        ('Reader', 'Title 00', '2024-02-10', 'Late')]
+    cells = [cell.strip() for cell in body['html'].split('<td')[1:4]]
+    assert cells[1] == '><strong>Reader</strong></td>'
+    assert cells[2] == '>Title 00</td>'
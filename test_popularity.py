@@ -0,0 +1,116 @@
+"""
+Tests for the precomputed popular-books ranking
+"""
+import sqlite3
+
+import pytest
+
+import popularity
+from app import LibraryManager
+from copies import close_loan
+from db_pool import run_immediate
+from migrations import migrate
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute('DELETE FROM Books')
+    conn.executemany("INSERT INTO Books VALUES (?, ?, 'Author', 'Fiction', 2000, 'Available')",
+                     [('A', 'Often borrowed'), ('B', 'Often reviewed'), ('C', 'Recently borrowed')])
+    conn.executemany("INSERT INTO Loans (BookID, MemberID, LoanDate) VALUES (?, 1, ?)",
+                     [('A', '2020-01-01')] * 3 + [('B', '2020-01-01')] * 2)
+    conn.executemany("INSERT INTO Loans (BookID, MemberID, LoanDate) VALUES ('C', 1, date('now', ?))",
+                     [('-1 days',), ('-10 days',)])
+    conn.executemany("INSERT INTO BookReviews (BookID, MemberID, Rating) VALUES ('B', 1, ?)",
+                     [(5,), (4,), (3,), (4,)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def top(db_path, window='all', limit=10, on_stale=None):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [(row[0], row[3], row[4]) for row in popularity.top_books(conn, limit, window, on_stale)]
+    finally:
+        conn.close()
+
+
+def refresh(db_path, window):
+    conn = sqlite3.connect(db_path)
+    try:
+        popularity.refresh_snapshot(conn, window)
+    finally:
+        conn.close()
+
+
+def test_loan_counts_are_not_multiplied_by_reviews(db_path):
+    assert top(db_path) == [('A', 3, 0.0), ('B', 2, 4.0), ('C', 2, 0.0)]
+
+
+def test_triggers_follow_loan_and_review_changes(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM Loans WHERE BookID = 'A' AND LoanID = (SELECT MIN(LoanID) FROM Loans)")
+    conn.execute("UPDATE Loans SET BookID = 'B' WHERE LoanID = (SELECT MAX(LoanID) FROM Loans WHERE BookID = 'A')")
+    conn.execute("UPDATE BookReviews SET Rating = 1 WHERE Rating = 5")
+    conn.execute("INSERT INTO BookReviews (BookID, MemberID, Rating) VALUES ('C', 1, 2)")
+    conn.commit()
+    conn.close()
+    assert top(db_path) == [('B', 3, 3.0), ('C', 2, 2.0), ('A', 1, 0.0)]
+
+
+def test_windows_only_count_recent_loans(db_path):
+    refresh(db_path, '7d')
+    refresh(db_path, '30d')
+    assert top(db_path, '7d') == [('C', 1, 0.0)]
+    assert top(db_path, '30d') == [('C', 2, 0.0)]
+
+    # Reads serve the last snapshot as it is until the next refresh
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO Loans (BookID, MemberID, LoanDate) VALUES ('A', 1, date('now'))")
+    conn.commit()
+    conn.close()
+    assert top(db_path, '7d') == [('C', 1, 0.0)]
+    refresh(db_path, '7d')
+    assert top(db_path, '7d') == [('A', 1, 0.0), ('C', 1, 0.0)]
+
+
+def test_stale_snapshots_are_served_without_writing_and_rebuilt_off_thread(db_path, monkeypatch):
+    stale = []
+    assert top(db_path, '7d', on_stale=stale.append) == []
+    assert stale == ['7d']
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM PopularityPeriods').fetchone()[0] == 0
+    conn.close()
+
+    # The manager hands the rebuild to a background thread; the next read sees it
+    library = LibraryManager(db_path)
+    started = []
+
+    class Thread:
+        def __init__(self, target, **kwargs):
+            self.start = lambda: started.append(target)
+
+    monkeypatch.setattr(popularity.threading, 'Thread', Thread)
+    library.get_popular_books(5, '30d')
+    assert len(started) == 1
+    started[0]()
+    assert top(db_path, '30d', on_stale=stale.append) == [('C', 2, 0.0)]
+    assert stale == ['7d']
+
+
+def test_manager_serves_ranking_with_limit(db_path):
+    library = LibraryManager(db_path)
+    assert [book[0] for book in library.get_popular_books(2)] == ['A', 'B']
+    # Loans count straight away: the ranking is read from the trigger-maintained table, not cached
+    for _ in range(2):
+        assert library.loan_book('C', 1)[0]
+        with library.connection() as conn:
+            loan_id = conn.execute('SELECT MAX(LoanID) FROM Loans').fetchone()[0]
+            assert run_immediate(conn, lambda cursor: close_loan(cursor, loan_id))
+    assert [book[0] for book in library.get_popular_books(2)] == ['C', 'A']
+    with pytest.raises(ValueError):
+        library.get_popular_books(5, 'decade')
@@ -0,0 +1,123 @@
+"""
+Tests for unattended reminder runs and the reminder ledger
+"""
+import threading
+import time
+
+import pytest
+
+from library_chatbot import LibraryChatbot, reminder_run_exit_code
+from migrations import migrate
+from test_mailer import StandInSMTP
+
+
+@pytest.fixture
+def smtp_server():
+    server = StandInSMTP()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def chatbot(tmp_path, smtp_server):
+    db_path = str(tmp_path / 'library.db')
+    migrate(db_path)
+    chatbot = LibraryChatbot(db_path)
+    chatbot.email_config = smtp_server.config
+    with chatbot.get_connection() as conn:
+        conn.executemany("INSERT INTO Books VALUES (?, ?, 'Author', 'Fiction', 2000, 'Loaned')",
+                         [(f'B{i}', f'Book {i}') for i in range(4)])
+        ann = conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Ann', 'ann@example.com')").lastrowid
+        bob = conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Bob', 'bob@example.com')").lastrowid
+        conn.executemany("INSERT INTO Loans (LoanID, BookID, MemberID, DueDate) VALUES (?, ?, ?, date('now', ?))", [
+            (1, 'B0', ann, '-3 days'),      # overdue
+            (2, 'B1', ann, '+1 days'),      # due soon
+            (3, 'B2', bob, '-20 days'),     # final notice
+            (4, 'B3', bob, '+10 days'),     # not yet
+        ])
+    return chatbot
+
+
+def ledger(chatbot):
+    with chatbot.get_connection() as conn:
+        return conn.execute('SELECT LoanID, Kind, Status FROM ReminderLedger ORDER BY LoanID, Kind').fetchall()
+
+
+def test_reruns_do_not_remind_twice(chatbot, smtp_server):
+    first = chatbot.run_reminders()
+    assert (first['claimed'], first['digests'], first['sent'], first['status']) == (3, 2, 2, 'completed')
+    assert ledger(chatbot) == [(1, 'overdue', 'sent'), (2, 'due_soon', 'sent'), (3, 'final_notice', 'sent')]
+
+    second = chatbot.run_reminders()
+    assert (second['claimed'], second['digests'], second['sent']) == (0, 0, 0)
+    assert len(smtp_server.delivered) == 2
+    assert [run[2] for run in chatbot.get_reminder_runs()] == ['completed', 'completed']
+
+
+def test_next_stage_is_reminded_again(chatbot, smtp_server):
+    chatbot.run_reminders()
+    with chatbot.get_connection() as conn:
+        conn.execute("UPDATE Loans SET DueDate = date('now', '-2 days') WHERE LoanID = 2")
+    run = chatbot.run_reminders()
+    assert (run['claimed'], run['sent']) == (1, 1)
+    assert (2, 'overdue', 'sent') in ledger(chatbot)
+    assert smtp_server.delivered.count('ann@example.com') == 2
+
+
+def test_failed_sends_are_released_for_the_next_run(chatbot, smtp_server):
+    smtp_server.faults = {'bob@example.com': ['550 mailbox unavailable']}
+    run = chatbot.run_reminders()
+    assert (run['sent'], run['failed']) == (1, 1)
+    assert [row[0] for row in ledger(chatbot)] == [1, 2]
+
+    run = chatbot.run_reminders()
+    assert (run['claimed'], run['sent']) == (1, 1)
+    assert 'bob@example.com' in smtp_server.delivered
+
+
+def test_exit_code_reports_failed_sends(chatbot, smtp_server):
+    smtp_server.faults = {'ann@example.com': ['535 authentication rejected'],
+                          'bob@example.com': ['535 authentication rejected']}
+    run = chatbot.run_reminders()
+    assert (run['sent'], run['failed'], run['error']) == (0, 2, None)
+    assert reminder_run_exit_code(run) == 1
+
+    smtp_server.faults = {'bob@example.com': ['550 mailbox unavailable']}
+    run = chatbot.run_reminders()
+    assert (run['sent'], run['failed']) == (1, 1)
+    assert reminder_run_exit_code(run) == 2
+
+    assert reminder_run_exit_code(chatbot.run_reminders()) == 0
+
+
+def test_results_that_cannot_be_recorded_fail_the_run(chatbot, monkeypatch):
+    def locked(run_id, loan_ids, sent):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(chatbot, 'record_reminder_result', locked)
+    run = chatbot.run_reminders()
+    assert (run['sent'], run['status']) == (2, 'failed')
+    assert run['error'] == '2 results not recorded: RuntimeError: database is locked'
+    assert reminder_run_exit_code(run) == 1
+    assert ledger(chatbot) == []
+
+
+def test_claims_of_a_crashed_run_are_resumed(chatbot, smtp_server):
+    stale = time.time() - 3600
+    with chatbot.get_connection() as conn:
+        crashed = conn.execute("INSERT INTO ReminderRuns (StartedAt, HeartbeatAt, Status) VALUES (?, ?, 'running')",
+                               (stale, stale)).lastrowid
+        conn.execute("INSERT INTO ReminderLedger (LoanID, Kind, RunID, Status, ClaimedAt, SentAt) "
+                     "VALUES (1, 'overdue', ?, 'sent', ?, ?)", (crashed, stale, stale))
+        conn.execute("INSERT INTO ReminderLedger (LoanID, Kind, RunID, Status, ClaimedAt) "
+                     "VALUES (3, 'final_notice', ?, 'sending', ?)", (crashed, stale))
+
+    run = chatbot.run_reminders()
+    assert (run['resumed'], run['claimed'], run['sent']) == (1, 1, 2)
+    assert all(status == 'sent' for _, _, status in ledger(chatbot))
+    assert sorted(smtp_server.delivered) == ['ann@example.com', 'bob@example.com']
+    statuses = {run[0]: run[2] for run in chatbot.get_reminder_runs()}
+    assert statuses[crashed] == 'interrupted'
@@ -0,0 +1,119 @@
+"""
+Schema tests: the migration runner, and that the hot LibraryManager
+queries are served by the indexes created in migrations.py (checked with
+EXPLAIN QUERY PLAN on the SQL the methods actually execute).
+"""
+import sqlite3
+
+import pytest
+
+from app import LibraryManager
+from migrations import MIGRATIONS, migrate
+
+
+# Schema as created by database.py, before any migration existed
+LEGACY_SCHEMA = '''
+    CREATE TABLE Books (
+        ISBN TEXT PRIMARY KEY,
+        Title TEXT NOT NULL,
+        Author TEXT NOT NULL,
+        Genre TEXT,
+        PublicationYear INT,
+        AvailabilityStatus TEXT
+    );
+    CREATE TABLE Members (
+        MemberID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT NOT NULL,
+        ContactInfo TEXT,
+        RegistrationDate DATE
+    );
+    CREATE TABLE Loans (
+        LoanID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BookID TEXT NOT NULL,
+        MemberID INT NOT NULL,
+        LoanDate DATE,
+        DueDate DATE,
+        ReturnDate DATE
+    );
+'''
+
+
+def executed_sql(library, call):
+    """Run `call` and return the SQL statements it sent to SQLite"""
+    statements = []
+    # The pool hands connections out LIFO, so the method gets this one back
+    conn = library.get_connection()
+    raw = conn.raw
+    raw.set_trace_callback(statements.append)
+    conn.close()
+    try:
+        call()
+    finally:
+        raw.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+
+
+def query_plan(library, sql):
+    with library.connection() as conn:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+
+
+@pytest.mark.parametrize('call, index', [
+    (lambda lib: lib.get_student_loans(1), 'idx_loans_member_loandate'),
+    (lambda lib: lib.get_student_recent_returns(1), 'idx_loans_member_active'),
+    (lambda lib: lib.get_overdue_loans(), 'idx_loans_open_duedate'),
+    (lambda lib: lib.get_active_loans(), 'idx_loans_open_duedate'),
+    (lambda lib: lib.get_user_messages(1), 'idx_message_recipients_inbox'),
+    (lambda lib: lib.get_inbox(1, 'librarian_reply', limit=5), 'idx_message_recipients_type'),
+    (lambda lib: lib.get_inbox(1, unread_only=True), 'idx_message_recipients_unread'),
+    (lambda lib: lib.get_member_fines(1), 'idx_fines_member_issued'),
+    (lambda lib: lib.get_member_reservations(1), 'idx_reservations_member_status'),
+    (lambda lib: lib.get_audit_logs(), 'idx_auditlogs_timestamp'),
+    (lambda lib: lib.get_audit_logs(user_id=1), 'idx_auditlogs_user_timestamp'),
+    (lambda lib: lib.get_audit_logs(action='quick loan', action_match='prefix'), 'idx_auditlogs_action'),
+])
+def test_hot_query_uses_index(migrated_library, call, index):
+    library = migrated_library
+    statements = executed_sql(library, lambda: call(library))
+    assert statements, 'no SELECT was captured'
+    plans = [query_plan(library, sql) for sql in statements]
+    assert any(index in step for plan in plans for step in plan), plans
+    # ...and nothing falls back to a full table scan
+    full_scans = [step for plan in plans for step in plan
+                  if step.startswith('SCAN ') and ' USING ' not in step]
+    assert not full_scans, plans
+
+
+def test_migrations_are_recorded_once(migrated_library):
+    library = migrated_library
+    with library.connection() as conn:
+        versions = [row[0] for row in conn.execute('SELECT Version FROM schema_version')]
+    assert versions == sorted(version for version, _, _ in MIGRATIONS)
+    assert migrate(library.db_name) == []
+
+
+def test_constructing_manager_runs_no_sql(tmp_path):
+    db_path = str(tmp_path / 'fresh.db')
+    LibraryManager(db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0
+    conn.close()
+
+
+def test_baseline_adopts_legacy_database(tmp_path):
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO Members (Name, ContactInfo) VALUES ('Ada', 'ada@example.com')")
+    conn.commit()
+    conn.close()
+
+    applied = migrate(db_path)
+    assert [version for version, _ in applied] == [version for version, _, _ in MIGRATIONS]
+
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(Members)')]
+    assert {'MembershipTier', 'Status', 'Address'} <= set(columns)
+    assert conn.execute('SELECT COUNT(*) FROM Members').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM Users').fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,60 @@
+"""
+Tests for the trigger-maintained dashboard counters
+"""
+
+# Each counter recounted the way the dashboard used to compute it
+RECOUNT_QUERIES = {
+    'total_books': 'SELECT COUNT(*) FROM Books',
+    'available_books': 'SELECT COUNT(*) FROM Books WHERE AvailabilityStatus = "Available"',
+    'total_members': 'SELECT COUNT(*) FROM Members WHERE Status = "active" OR Status IS NULL',
+    'active_loans': 'SELECT COUNT(*) FROM Loans WHERE ReturnDate IS NULL',
+    'overdue_loans': 'SELECT COUNT(*) FROM Loans WHERE DueDate < date("now") AND ReturnDate IS NULL',
+    'active_reservations': 'SELECT COUNT(*) FROM BookReservations WHERE Status = "active"',
+    'unpaid_fines': 'SELECT COUNT(*) FROM Fines WHERE Status = "unpaid"',
+    'unread_messages': 'SELECT COUNT(*) FROM Messages WHERE IsRead = 0',
+    'new_members_month': 'SELECT COUNT(*) FROM Members WHERE RegistrationDate >= date("now", "-30 days")',
+}
+
+
+def recounted(library):
+    with library.connection() as conn:
+        return {name: conn.execute(query).fetchone()[0] for name, query in RECOUNT_QUERIES.items()}
+
+
+def test_counters_follow_inserts_updates_and_deletes(migrated_library):
+    library = migrated_library
+    assert library.get_dashboard_stats() == recounted(library)
+
+    library.add_book('111', 'Counting', 'A. Author', 'Maths', 2001)
+    library.add_book('222', 'Recounting', 'A. Author', 'Maths', 2002)
+    member_id = library.add_member('Reader', 'reader@example.com')
+    library.loan_book('111', member_id)
+    with library.connection() as conn:
+        # Overdue loan, unpaid fine, unread message, then state changes on each
+        conn.execute("INSERT INTO Loans (BookID, MemberID, LoanDate, DueDate) "
+                     "VALUES ('222', ?, '2020-01-01', '2020-01-15')", (member_id,))
+        conn.execute("INSERT INTO Fines (MemberID, FineType, Amount) VALUES (?, 'overdue', 2.5)", (member_id,))
+        conn.execute("UPDATE Fines SET Status = 'paid' WHERE FineID = (SELECT MIN(FineID) FROM Fines)")
+        conn.execute("INSERT INTO Messages (FromUserID, ToUserID, Subject, Message) VALUES (1, 1, 's', 'm')")
+        conn.execute('UPDATE Messages SET IsRead = 1 WHERE MessageID = (SELECT MIN(MessageID) FROM Messages)')
+        conn.execute("UPDATE Members SET Status = 'inactive' WHERE MemberID = 1")
+        conn.execute("DELETE FROM Books WHERE ISBN = '222'")
+        conn.commit()
+
+    stats = library.get_dashboard_stats()
+    assert stats == recounted(library)
+    assert stats['overdue_loans'] >= 1 and stats['new_members_month'] >= 1
+
+
+def test_reconcile_reports_and_repairs_drift(migrated_library):
+    library = migrated_library
+    assert library.reconcile_dashboard_counters() == {}
+    actual = library.get_dashboard_stats()['active_loans']
+    with library.connection() as conn:
+        conn.execute("UPDATE StatCounters SET Value = Value + 5 WHERE Name = 'active_loans'")
+        conn.commit()
+
+    assert library.reconcile_dashboard_counters(repair=False) == {'active_loans': (actual + 5, actual)}
+    assert library.get_dashboard_stats()['active_loans'] == actual + 5
+    library.reconcile_dashboard_counters()
+    assert library.get_dashboard_stats()['active_loans'] == actual